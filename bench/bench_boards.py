@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure the time to relay a move to a game's players and observers,
+rendering the board once per user as the server used to, and once per
+distinct view as Game.send_boards now does.  Run from the top-level
+directory:  python bench/bench_boards.py """
+
+import sys
+import time
+import random
+
+sys.path.insert(0, 'src/')
+
+import variant.chess
+from game_constants import PLAYED
+
+MOVES = ['e4', 'c5', 'Nf3', 'd6', 'd4', 'cxd4', 'Nxd4', 'Nf6', 'Nc3', 'a6']
+
+class FakeSession(object):
+    def __init__(self, ms):
+        self.ivars = {'ms': ms, 'compressmove': 0}
+
+class FakeUser(object):
+    def __init__(self, name, style, ms, flip):
+        self.name = name
+        self.vars = {'style': style, 'flip': flip}
+        self.session = FakeSession(ms)
+        self.out = 0
+    def write_nowrap(self, s):
+        self.out += len(s)
+
+class FakeClock(object):
+    is_ticking = True
+    def get_white_time(self):
+        return 171.234
+    def get_black_time(self):
+        return 165.5
+
+class FakeGame(object):
+    gtype = PLAYED
+    number = 42
+    white_time = 3
+    inc = 0
+    info_str = '(GuestABCD vs. GuestEFGH) 3 0 unrated blitz'
+    def __init__(self, nobs):
+        self.white = FakeUser('GuestABCD', 12, 1, 0)
+        self.black = FakeUser('GuestEFGH', 12, 1, 0)
+        self.players = set([self.white, self.black])
+        # most observers use style 12, with or without milliseconds
+        self.observers = set(FakeUser('Guest%04d' % i,
+            random.choice([12, 12, 12, 1]), random.choice([0, 1]),
+            random.random() < 0.05) for i in range(nobs))
+        self.clock = FakeClock()
+        self.variant = variant.chess.Chess(self)
+
+def send_boards_uncached(g):
+    for u in list(g.players) + list(g.observers):
+        if u.vars['style'] == 12:
+            u.write_nowrap(g.variant.to_style12(u))
+        else:
+            u.write_nowrap(g.variant.to_style1(u))
+
+def send_boards_cached(g):
+    # as in Game.send_boards()
+    cache = {}
+    for u in list(g.players) + list(g.observers):
+        if u.vars['style'] == 12:
+            key = (12,) + g.variant.style12_view(u)
+        else:
+            key = (1,) + g.variant.style1_view(u)
+        s = cache.get(key)
+        if s is None:
+            if key[0] == 12:
+                s = g.variant.render_style12(*key[1:])
+            else:
+                s = g.variant.render_style1(*key[1:])
+            cache[key] = s
+        u.write_nowrap(s)
+
+def bench(nobs, send):
+    random.seed(2010)
+    g = FakeGame(nobs)
+    start = time.time()
+    for san in MOVES:
+        mv = g.variant.pos.move_from_san(san)
+        mv.time = 1.5
+        mv.lag = 0
+        g.variant.do_move(mv)
+        send(g)
+    return (time.time() - start) / len(MOVES)
+
+if __name__ == '__main__':
+    g = FakeGame(10)
+    for u in list(g.players) + list(g.observers):
+        assert(g.variant.to_style12(u) == g.variant.render_style12(
+            *g.variant.style12_view(u)))
+    for nobs in [10, 100, 500, 2000]:
+        t_old = bench(nobs, send_boards_uncached)
+        t_new = bench(nobs, send_boards_cached)
+        print('%5d observers: %8.2f ms per move rendering each board, '
+            '%6.2f ms sharing boards' % (nobs, 1000 * t_old, 1000 * t_new))
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure the CPU time to send a channel tell and a shout to 2000
+users, writing to each user as the server used to, and rendering once
+for each group of users with broadcast.Broadcast.  Run from the
+top-level directory:  python bench/bench_broadcast.py """
+
+import sys
+import time
+import random
+
+sys.path.insert(0, 'src/')
+
+import lang
+import telnet
+import connection
+
+from broadcast import Broadcast
+
+MEMBERS = 2000
+MESSAGES = 50
+
+class FakeTCP(object):
+    def __init__(self):
+        self.sent = 0
+    def write(self, data):
+        self.sent += len(data)
+
+class FakeConn(object):
+    buffer_output = False
+    def __init__(self, transport):
+        self.transport = transport
+    def write(self, s):
+        self.transport.write(s)
+
+class FakeSession(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+class FakeUser(object):
+    """ The parts of user.User used to send messages. """
+    is_online = True
+    def __init__(self, i):
+        t = telnet.TelnetTransport()
+        t.transport = FakeTCP()
+        t.compatibility = random.random() < 0.05
+        t.enableWrapping(random.choice([79] * 8 + [120, 200]))
+        self.session = FakeSession(FakeConn(t))
+        self.vars = {'lang': random.choice(['en'] * 9 + ['es'])}
+    def write(self, s):
+        connection.written_users.add(self)
+        self.session.conn.write(s)
+    def write_(self, s, args={}):
+        connection.written_users.add(self)
+        self.session.conn.write(lang.langs[self.vars['lang']].gettext(s) %
+            args)
+
+def bench_tell(users, old):
+    start = time.clock()
+    for i in range(MESSAGES):
+        msg = '\nGuestABCD(U)(53): anyone want to play a game of blitz? I will take either color, and message %d is long enough to be wrapped\n' % i
+        if old:
+            for u in users:
+                u.write(msg)
+        else:
+            b = Broadcast(msg, translate=False)
+            for u in users:
+                b.send(u)
+        connection.written_users.clear()
+    return (time.clock() - start) / MESSAGES
+
+def bench_shout(users, old):
+    start = time.clock()
+    for i in range(MESSAGES):
+        args = ('GuestABCD(U)', 'is anyone around for a game of crazyhouse? %d' % i)
+        if old:
+            for u in users:
+                u.write_("\n%s shouts: %s\n", args)
+        else:
+            b = Broadcast("\n%s shouts: %s\n", args)
+            for u in users:
+                b.send(u)
+        connection.written_users.clear()
+    return (time.clock() - start) / MESSAGES
+
+if __name__ == '__main__':
+    random.seed(2010)
+    users = [FakeUser(i) for i in range(MEMBERS)]
+    for (name, f) in [('channel tell', bench_tell), ('shout', bench_shout)]:
+        t_old = f(users, True)
+        # the first pass filled the wrapping cache, so clear it
+        telnet._wrapped.clear()
+        t_new = f(users, False)
+        print('%-12s to %d users: %6.2f ms per message writing to each, '
+            '%5.2f ms with Broadcast' % (name, MEMBERS, 1000 * t_old,
+            1000 * t_new))
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Show how slow queries affect the reactor.  A move is "relayed"
+every 20 ms while queries that take QUERY_LATENCY seconds (using
+MySQL's SLEEP()) are issued, first directly on the reactor thread as
+the server used to, then through the database pool.  We report how
+late the relays were.  This needs the same database setup as the
+server.  Run from the top-level directory:
+python bench/bench_db_stall.py """
+
+import sys
+import time
+
+sys.path.insert(0, 'src/')
+
+from twisted.internet import reactor, task, defer
+
+from db import db, adb
+
+RELAY_INTERVAL = 0.02
+QUERY_LATENCY = 0.25
+QUERIES = 20
+QUERY_INTERVAL = 0.1
+
+def slow_query(db_, secs):
+    cursor = db_.db.cursor()
+    cursor = db_.query(cursor, """SELECT SLEEP(%s)""", (secs,))
+    cursor.close()
+
+class Relay(object):
+    """ Stands in for relaying moves; records how late each one was. """
+    def __init__(self):
+        self.delays = []
+        self.last = None
+
+    def tick(self):
+        now = time.time()
+        if self.last is not None:
+            self.delays.append(max(0.0, now - self.last - RELAY_INTERVAL))
+        self.last = now
+
+def run(name, issue):
+    relay = Relay()
+    lc = task.LoopingCall(relay.tick)
+    lc.start(RELAY_INTERVAL)
+    dlist = []
+    for i in range(QUERIES):
+        d = task.deferLater(reactor, i * QUERY_INTERVAL, issue)
+        dlist.append(d)
+    d = defer.DeferredList(dlist)
+    def done(result):
+        lc.stop()
+        delays = sorted(relay.delays)
+        print('%-12s %4d relays, mean delay %7.1f ms, p99 %7.1f ms, max %7.1f ms' %
+            (name, len(delays), 1000 * sum(delays) / len(delays),
+                1000 * delays[int(len(delays) * .99)], 1000 * delays[-1]))
+    d.addCallback(done)
+    return d
+
+@defer.inlineCallbacks
+def main():
+    yield run('blocking', lambda: slow_query(db, QUERY_LATENCY))
+    yield run('pool', lambda: adb.run_interaction(slow_query, QUERY_LATENCY))
+    reactor.stop()
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
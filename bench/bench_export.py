@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure the rate at which stored games are written as PGN, plain
+and gzipped, as when exporting the game archive.  The rows are made
+from the games in data/chess.pgn, repeated to give as many as asked
+for (a million by default); reading them from the database is not
+counted.  The rows are made as they are written, so memory use stays
+constant.
+Run from the top-level directory:  python bench/bench_export.py [games] """
+
+import os
+import sys
+import gzip
+import time
+import datetime
+import tempfile
+
+sys.path.insert(0, 'src/')
+
+import pgn
+
+def read_rows():
+    f = open('data/chess.pgn', 'r')
+    rows = []
+    for g in pgn.Pgn(f):
+        rows.append({'white_name': g.tags['White'],
+            'white_rating': g.tags.get('WhiteElo', '0'),
+            'black_name': g.tags['Black'],
+            'black_rating': g.tags.get('BlackElo', '0'),
+            'eco': 'A00', 'speed_name': 'blitz', 'variant_name': 'chess',
+            'clock': 'fischer', 'time': 3, 'inc': 0, 'rated': True,
+            'result': g.result, 'result_reason': 'Res',
+            'ply_count': len(g.moves),
+            'movetext': ' '.join([m.text + m.decorator for m in g.moves]),
+            'when_started': datetime.datetime(2010, 1, 1),
+            'when_ended': datetime.datetime(2010, 1, 1, 0, 5),
+            'fen': None})
+    return rows
+
+def gen_rows(rows, count):
+    for i in xrange(count):
+        row = rows[i % len(rows)]
+        row['game_id'] = i + 1
+        yield row
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rows = read_rows()
+    for (name, opener) in [('plain', open), ('gzip', gzip.open)]:
+        (fd, path) = tempfile.mkstemp(suffix='.pgn')
+        os.close(fd)
+        f = opener(path, 'wb')
+        start = time.time()
+        n = pgn.write_games(f, gen_rows(rows, count))
+        f.close()
+        secs = time.time() - start
+        size = os.path.getsize(path)
+        os.remove(path)
+        print '%-5s %d games in %.1f s: %.0f games/s, %.1f MB' % (name,
+            n, secs, n / secs, size / 1e6)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
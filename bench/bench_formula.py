@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure formula evaluations per second, compiling each formula once
+and, as the server used to, parsing it again for every evaluation.  Run
+from the top-level directory:  python bench/bench_formula.py """
+
+import sys
+import time
+
+sys.path.insert(0, 'src/')
+
+import formula
+from game_constants import WHITE
+
+EVALS = 20000
+
+formulas = [
+    '!lightning && !blitz',
+    'time >= 3 minutes and inc <= 12 # no long games',
+    'rating > 1500 && ratingdiff < 300 || !registered',
+    '(white || nocolor) && !computer && !abuser && f1',
+    '',
+]
+fvars = {'f1': 'timeseal | myrating - rating > 200', 'f2': None}
+
+class FakeSpeed(object):
+    pass
+
+class FakeUser(object):
+    def __init__(self, rating, is_guest):
+        self.rating = rating
+        self.is_guest = is_guest
+        self.vars = fvars
+    def has_title(self, title):
+        return False
+    def has_timeseal(self):
+        return True
+    def get_rating(self, sv):
+        return self.rating
+
+class FakeChallenge(object):
+    def __init__(self):
+        self.a = FakeUser(1612, False)
+        self.b = FakeUser(1480, False)
+        self.time = 5
+        self.inc = 2
+        self.side = WHITE
+        self.speed_name = 'blitz'
+        self.speed_variant = FakeSpeed()
+
+def run(chal, uncached):
+    n = 0
+    start = time.time()
+    for i in xrange(EVALS):
+        for s in formulas:
+            if uncached:
+                formula._compiled.clear()
+            formula.check_formula(chal, s)
+            n += 1
+    return n / (time.time() - start)
+
+if __name__ == '__main__':
+    chal = FakeChallenge()
+    for s in formulas:
+        print('%-55r %r' % (s, formula.check_formula(chal, s)))
+    old_rate = run(chal, True)
+    new_rate = run(chal, False)
+    print('parsed each time: %9.0f evals/s' % old_rate)
+    print('compiled once:    %9.0f evals/s (%.1fx)' %
+        (new_rate, new_rate / old_rate))
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,175 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Reconnect many clients at once, as happens when the server restarts,
+and report how long it takes until all of them are at the prompt.  The
+clients log in as registered users StormAAA, StormAAB and so on, which
+are created the first time with a cheap bcrypt work factor and kept
+for later runs; with -g they log in as guests instead.  The server
+must be running, with maxplayer (and maxguest, for -g) raised above
+the number of clients; you will probably also need to raise ulimit -n.
+Run from the top-level directory:
+python bench/bench_login_storm.py [-g] [clients] """
+
+import sys
+import time
+import string
+
+import bcrypt
+
+from twisted.internet import epollreactor
+epollreactor.install()
+
+from twisted.internet import reactor, protocol
+
+sys.path.insert(0, 'src/')
+
+import admin
+from config import config
+from db import db
+
+CLIENTS = 5000
+PASSWD = 'storm'
+
+def storm_name(i):
+    """ Names may only have letters, so number the users in base 26. """
+    s = ''
+    for j in range(3):
+        s = string.ascii_uppercase[i % 26] + s
+        i //= 26
+    return 'Storm' + s
+
+def create_users(count):
+    pwhash = bcrypt.hashpw(PASSWD, bcrypt.gensalt(4))
+    created = 0
+    for i in range(count):
+        name = storm_name(i)
+        if not db.user_get(name):
+            db.user_add(name, '', pwhash, '', admin.Level.user)
+            created += 1
+    if created:
+        print('created %d users' % created)
+
+class StormClient(protocol.Protocol):
+    def __init__(self, name):
+        self.name = name
+        self.data = ''
+        self.done = False
+
+    def connectionMade(self):
+        self.start = time.time()
+
+    def dataReceived(self, data):
+        if self.done:
+            return
+        self.data += data
+        if 'login: ' in self.data:
+            self.transport.write('%s\r\n' % self.name)
+        elif 'password: ' in self.data:
+            self.transport.write('%s\r\n' % PASSWD)
+        elif 'Press return' in self.data:
+            self.transport.write('\r\n')
+        elif 'fics% ' in self.data:
+            self.done = True
+            self.factory.storm.online(self, time.time() - self.start)
+        else:
+            return
+        self.data = ''
+
+    def connectionLost(self, reason):
+        if not self.done:
+            self.done = True
+            self.factory.storm.failed(self, self.data)
+
+class StormFactory(protocol.ClientFactory):
+    def __init__(self, storm, name):
+        self.storm = storm
+        self.name = name
+
+    def buildProtocol(self, addr):
+        p = StormClient(self.name)
+        p.factory = self
+        return p
+
+    def clientConnectionFailed(self, connector, reason):
+        self.storm.failed(None, reason.getErrorMessage())
+
+class Storm(object):
+    def __init__(self, names):
+        self.names = names
+        self.clients = []
+        self.times = []
+        self.failures = 0
+
+    def start(self):
+        self.start_time = time.time()
+        for name in self.names:
+            reactor.connectTCP('127.0.0.1', config.port,
+                StormFactory(self, name))
+
+    def online(self, client, secs):
+        self.clients.append(client)
+        self.times.append(secs)
+        self._check_done()
+
+    def failed(self, client, reason):
+        self.failures += 1
+        if self.failures <= 10:
+            print('login failed: %r' % reason[-200:])
+        self._check_done()
+
+    def _check_done(self):
+        done = len(self.times) + self.failures
+        if done % 500 == 0 or done == len(self.names):
+            print('%6.1f s: %d online, %d failed' % (time.time() -
+                self.start_time, len(self.times), self.failures))
+        if done == len(self.names):
+            self.report()
+            for c in self.clients:
+                c.transport.write('quit\r\n')
+            reactor.callLater(1.0, reactor.stop)
+
+    def report(self):
+        total = time.time() - self.start_time
+        times = sorted(self.times)
+        print('%d clients online in %.1f s (%.0f logins/s), %d failed' %
+            (len(times), total, len(times) / total, self.failures))
+        if times:
+            print('time to prompt: median %.2f s, p99 %.2f s, max %.2f s' %
+                (times[len(times) // 2], times[int(len(times) * .99)],
+                    times[-1]))
+
+def main():
+    args = sys.argv[1:]
+    guests = False
+    if args and args[0] == '-g':
+        guests = True
+        args = args[1:]
+    count = int(args[0]) if args else CLIENTS
+    if guests:
+        names = ['guest'] * count
+    else:
+        create_users(count)
+        names = [storm_name(i) for i in range(count)]
+    reactor.callWhenRunning(Storm(names).start)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure the memory used by a game of normal chess of 100 plies,
+including its move history, by keeping many such games in memory and
+comparing the size of the process before and after.  The moves are
+made the way the server makes them, with SAN, a time and a lag for
+each.  The games are random but repeatable.  Memory is measured with
+getrusage(), so this only gives correct results on Linux.
+Run from the top-level directory:  python bench/bench_memory.py [games] """
+
+import sys
+import random
+import resource
+
+sys.path.insert(0, 'src/')
+
+import variant.chess
+
+GAMES = 1000
+PLIES = 100
+
+class FakeGame(object):
+    pass
+
+def make_games(count):
+    """ Play random games of PLIES plies, returning the move codes of
+    each. """
+    random.seed(2010)
+    ret = []
+    while len(ret) < count:
+        v = variant.chess.Chess(FakeGame())
+        codes = []
+        for ply in range(PLIES):
+            legal = v.pos.get_legal_moves()
+            if not legal or v.pos.is_draw_nomaterial:
+                break
+            mv = random.choice(legal)
+            codes.append(mv.get_code())
+            v.do_move(mv)
+        if len(codes) == PLIES:
+            ret.append(codes)
+    return ret
+
+def max_rss():
+    # in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else GAMES
+    # only a few distinct games are needed
+    games = make_games(50)
+
+    # Memory freed while making the games above is reused by the first
+    # games kept, so only measure the growth from keeping the second
+    # half of them.
+    kept = []
+    for i in range(2 * count):
+        if i == count:
+            before = max_rss()
+        v = variant.chess.Chess(FakeGame())
+        for code in games[i % len(games)]:
+            mv = v.pos.move_from_code(code)
+            v.do_move(mv)
+            mv.time = 1.234
+            mv.lag = 100
+        kept.append(v)
+    used = max_rss() - before
+
+    print '%d games of %d plies: %.1f kB per game, %.0f bytes per ply' % (
+        count, PLIES, used / 1024.0 / count, float(used) / count / PLIES)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
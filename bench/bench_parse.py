@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure the time to parse and make moves in normal chess, as when
+replaying stored movetext for examine mode or an adjourned game, or
+when a player enters a move.  Stored games are also replayed from
+their compact moves, which need no parsing.  The games are random but
+repeatable.
+Run from the top-level directory:  python bench/bench_parse.py """
+
+import sys
+import time
+import random
+
+sys.path.insert(0, 'src/')
+
+import variant.chess
+
+GAMES = 20
+MAX_PLY = 200
+
+class FakeGame(object):
+    pass
+
+def make_games():
+    """ Play random games, returning each as a list of (san, lalg,
+    stored) tuples, where stored is the move as read back from a game
+    with compact moves. """
+    random.seed(2010)
+    ret = []
+    for i in range(GAMES):
+        v = variant.chess.Chess(FakeGame())
+        moves = []
+        for ply in range(MAX_PLY):
+            legal = v.pos.get_legal_moves()
+            if not legal or v.pos.is_draw_nomaterial:
+                break
+            mv = random.choice(legal)
+            v.do_move(mv)
+            san = mv.to_san()
+            moves.append((san, str(mv).lower(), (mv.to_compact(), san)))
+        ret.append(moves)
+    return ret
+
+def replay(games, notation):
+    """ Parse and make every move, returning the time per ply. """
+    plies = 0
+    start = time.time()
+    for moves in games:
+        v = variant.chess.Chess(FakeGame())
+        for m in moves:
+            if notation == 2:
+                v.do_move(v.parse_stored_move(m[notation]))
+                continue
+            mv = v.parse_move(m[notation], None)
+            v.do_move(mv)
+            # a command typed during a game is tried as a move first
+            assert(v.parse_move('finger', None) is None)
+        plies += len(moves)
+    return (time.time() - start) / plies
+
+if __name__ == '__main__':
+    games = make_games()
+    print '%d games, %d plies' % (len(games), sum([len(g) for g in games]))
+    for (name, notation) in [('san', 0), ('lalg', 1), ('compact', 2)]:
+        print '%-7s %.1f us/ply' % (name, 1e6 * replay(games, notation))
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Run perft on the positions in variant/perft.py for each variant,
+checking the node counts against the published ones and reporting
+nodes per second.  Each position is searched to the deepest depth
+with at most MAX_NODES nodes; give a different limit as an argument.
+The chess960, crazyhouse and bughouse positions check their material
+and hash on every move, which is most of their time; python -O skips
+some of that.
+Run from the top-level directory:  python bench/bench_perft.py [nodes] """
+
+import sys
+import time
+
+sys.path.insert(0, 'src/')
+
+from variant import perft
+
+MAX_NODES = 20000
+
+def run(max_nodes):
+    failed = False
+    totals = {}
+    for (variant_name, fen, holding, counts) in perft.suite:
+        pos = perft.make_pos(variant_name, fen, holding)
+        depth = 0
+        while depth < len(counts) and counts[depth] <= max_nodes:
+            depth += 1
+        if depth == 0:
+            continue
+        start = time.time()
+        nodes = perft.perft(pos, depth)
+        secs = time.time() - start
+        ok = nodes == counts[depth - 1]
+        failed = failed or not ok
+        print('%-10s %-6s %d %9d %s  %s%s' % (variant_name,
+            'ok' if ok else 'FAILED', depth, nodes,
+            '%8.0f nodes/s' % (nodes / secs), fen,
+            ' [%s]' % holding if holding else ''))
+        (n, s) = totals.get(variant_name, (0, 0.0))
+        totals[variant_name] = (n + nodes, s + secs)
+
+    print('')
+    for (variant_name, (nodes, secs)) in sorted(totals.items()):
+        print('%-10s %9d nodes in %6.1fs: %8.0f nodes/s' % (variant_name,
+            nodes, secs, nodes / secs))
+    return not failed
+
+if __name__ == '__main__':
+    max_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else MAX_NODES
+    if not run(max_nodes):
+        sys.exit(1)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
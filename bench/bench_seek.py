@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure finding the matches for new seeks, and posting and removing
+seeks, with 10000 standing seeks, comparing the seek book index to
+scanning every seek.  Run from the top-level directory:
+python bench/bench_seek.py """
+
+import sys
+import time
+import random
+
+sys.path.insert(0, 'src/')
+
+import seek_book
+import formula
+from game_constants import WHITE, BLACK
+
+STANDING = 10000
+NEW = 2000
+
+speeds = [('lightning', 1, 0), ('blitz', 3, 0), ('blitz', 5, 0),
+    ('blitz', 2, 12), ('standard', 15, 0), ('standard', 45, 45),
+    ('slow', 90, 30)]
+variants = ['chess'] * 6 + ['crazyhouse', 'chess960', 'bughouse']
+formulas = [None, '!lightning', 'rating > 1200 && time >= 3', 'inc = 0']
+
+class FakeUser(object):
+    def __init__(self, i):
+        self.name = 'Player%d' % i
+        self.rating = random.randint(800, 2400)
+        self.vars = {'formula': random.choice(formulas)}
+    def censor_or_noplay(self, other):
+        return False
+    def get_rating(self, sv):
+        return self.rating
+
+class FakeSeek(object):
+    """ The parts of seek.Seek used to match seeks. """
+    def __init__(self, a):
+        (speed_name, t, inc) = random.choice(speeds)
+        self.a = a
+        self.b = None
+        self.expired = False
+        self.manual = random.random() < 0.1
+        self.formula = random.random() < 0.3
+        self.side = random.choice([None, None, WHITE, BLACK])
+        self.time = t
+        self.inc = inc
+        self.speed_name = speed_name
+        self.speed_variant = None
+        self.variant_name = random.choice(variants)
+        self.tags = {'rated': random.random() < 0.7,
+            'speed_name': speed_name, 'variant_name': self.variant_name,
+            'clock_name': 'fischer', 'time': t, 'inc': inc, 'idn': None}
+
+    def matches(self, other):
+        if other.expired or self.a == other.a:
+            return False
+        if self.side is not None or other.side is not None:
+            if self.side is None or other.side is None:
+                return False
+            if other.side == self.side:
+                return False
+        return self.tags == other.tags
+
+    def check_formula(self, b):
+        (self.b, self.a) = (self.a, b)
+        try:
+            return (not self.formula or
+                formula.check_formula(self, self.b.vars['formula']))
+        finally:
+            (self.a, self.b) = (self.b, None)
+
+def find_matching_scan(seeks, seek):
+    """ The old way: look at every seek. """
+    ret = []
+    for s in seeks.values():
+        if seek.matches(s):
+            if (not seek.a.censor_or_noplay(s.a) and
+                    s.check_formula(seek.a) and seek.check_formula(s.a)):
+                ret.append(s)
+    return ret
+
+def find_matching_book(book, seek):
+    ret = []
+    for s in book.candidates(seek):
+        if seek.matches(s):
+            if (not seek.a.censor_or_noplay(s.a) and
+                    s.check_formula(seek.a) and seek.check_formula(s.a)):
+                ret.append(s)
+    return ret
+
+if __name__ == '__main__':
+    random.seed(2010)
+    users = [FakeUser(i) for i in range(STANDING)]
+    book = seek_book.SeekBook(90)
+
+    start = time.time()
+    for u in users:
+        book.add(FakeSeek(u), 0)
+    print('posted %d seeks in %.3fs' % (len(book), time.time() - start))
+
+    new_seeks = [FakeSeek(FakeUser(STANDING + i)) for i in range(NEW)]
+
+    start = time.time()
+    scan_counts = [len(find_matching_scan(book.seeks, s)) for s in new_seeks]
+    scan_rate = NEW / (time.time() - start)
+
+    start = time.time()
+    book_counts = [len(find_matching_book(book, s)) for s in new_seeks]
+    book_rate = NEW / (time.time() - start)
+
+    assert(scan_counts == book_counts)
+    print('find_matching, scanning: %9.0f seeks/s' % scan_rate)
+    print('find_matching, indexed:  %9.0f seeks/s (%.0fx)' %
+        (book_rate, book_rate / scan_rate))
+
+    # churn: remove and post seeks, reusing numbers
+    start = time.time()
+    now = 0
+    for i in range(NEW):
+        s = random.choice(book.seeks.values())
+        if not s.expired:
+            s.expired = True
+            s.expired_time = now
+            book.remove(s)
+        now += 1
+        book.add(FakeSeek(users[i]), now)
+    print('%d removes and posts: %.3fs, highest seek number %d' %
+        (NEW, time.time() - start, max(book.seeks)))
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
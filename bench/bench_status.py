@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure the time to make each move and find whether the side to
+move is in check, checkmated or stalemated, which the server does after
+every move of every game.  The games are the ones in data/chess.pgn and
+data/zh.pgn; parsing the moves is not counted.
+Run from the top-level directory:  python bench/bench_status.py """
+
+import sys
+import time
+
+sys.path.insert(0, 'src/')
+
+import variant.chess
+import variant.crazyhouse
+from pgn import Pgn
+
+FILES = [('chess', variant.chess.Chess, 'data/chess.pgn'),
+    ('crazyhouse', variant.crazyhouse.Crazyhouse, 'data/zh.pgn')]
+
+class FakeGame(object):
+    pass
+
+def replay(cls, games):
+    """ Play through each game, returning the number of plies, the
+    time spent making moves and detecting check and mate, and the
+    number of checkmates found. """
+    plies = 0
+    secs = 0.0
+    mates = 0
+    for g in games:
+        v = cls(FakeGame())
+        for m in g.moves:
+            mv = v.parse_move(m.text, None)
+            # do_move(), timing only the part we are interested in
+            mv.to_san()
+            start = time.time()
+            v.pos.make_move(mv)
+            v.pos.detect_check()
+            secs += time.time() - start
+            mv.add_san_decorator()
+            plies += 1
+        if v.pos.is_checkmate:
+            mates += 1
+    return (plies, secs, mates)
+
+if __name__ == '__main__':
+    for (name, cls, fn) in FILES:
+        f = open(fn, 'r')
+        games = list(Pgn(f))
+        f.close()
+        (plies, secs, mates) = replay(cls, games)
+        print '%-10s %2d games, %5d plies, %2d mates: %.1f us/ply' % (
+            name, len(games), plies, mates, 1e6 * secs / plies)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
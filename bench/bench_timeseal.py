@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure zipseal lines decoded and encoded per second with 1000 and
+5000 connections, each with its own codec.  Run from the top-level
+directory:  python bench/bench_timeseal.py """
+
+import sys
+import time
+import random
+
+sys.path.insert(0, 'src/')
+
+from timeseal import Timeseal
+
+LINES_PER_CONN = 20
+
+# typical client input and server output
+client_lines = ['e2e4', 'tell 1 hello there', 'who', 'match GuestABCD 5 0',
+    'observe 12', 'finger admin', 'moves']
+server_lines = [
+    '\n<12> rnbqkbnr pppppppp -------- -------- ----P--- -------- PPPP-PPP RNBQKBNR B 4 1 1 1 1 0 12 GuestABCD GuestEFGH 0 5 0 39 39 300000 300000 1 P/e2-e4 (0:00.000) e4 0 0 0\nfics% ',
+    '\nGuestABCD(U)(1): hello there\nfics% ',
+    '\n' + ('GuestABCD ' * 120) + '\n',
+]
+
+def bench(nconns):
+    conns = [Timeseal() for i in range(nconns)]
+    inp = ['%s\x18%x' % (random.choice(client_lines), random.randint(1, 1 << 31))
+        for i in range(256)]
+
+    n = 0
+    start = time.time()
+    for i in range(LINES_PER_CONN):
+        line = inp[i % len(inp)]
+        for c in conns:
+            c.decode_zipseal(line)
+            n += 1
+    dec_rate = n / (time.time() - start)
+
+    n = 0
+    start = time.time()
+    for i in range(LINES_PER_CONN):
+        line = server_lines[i % len(server_lines)]
+        for c in conns:
+            c.compress_zipseal(line)
+            n += 1
+    enc_rate = n / (time.time() - start)
+
+    zin = sum(c.zipseal_in for c in conns)
+    zout = sum(c.zipseal_out for c in conns)
+    print('%5d connections: %9.0f lines decoded/s, %9.0f lines encoded/s, ratio %.3f' %
+        (nconns, dec_rate, enc_rate, float(zout) / zin))
+
+if __name__ == '__main__':
+    random.seed(2010)
+    for nconns in [1000, 5000]:
+        bench(nconns)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Measure word wrapping of channel traffic: each message is sent to
+many users, mostly at the default width.  Compares telnet.wrap_text to
+the old way of wrapping every write with textwrap.  Run from the
+top-level directory:  python bench/bench_wrap.py """
+
+import sys
+import time
+import random
+import textwrap
+
+sys.path.insert(0, 'src/')
+
+import telnet
+
+RECIPIENTS = 200
+MESSAGES = 200
+
+words = ['hello', 'anyone', 'want', 'to', 'play', 'a', 'game', '5', '0',
+    'blitz', 'rated?', 'the', 'Najdorf', 'is', 'overrated', 'lol', 'gg',
+    'thanks', 'for', 'the', 'game!', 'seek', 'e4', 'd4', ':)', 'caf\xc3\xa9']
+names = ['GuestABCD(U)', 'admin(*)(SR)(TD)', 'Fischer(GM)', 'alice']
+
+def make_message(i):
+    n = random.choice([3, 5, 8, 12, 20, 40])
+    text = ' '.join(random.choice(words) for j in range(n))
+    return '\n%s(%d): %s\n' % (random.choice(names), random.choice([1, 4, 53]),
+        text)
+
+# each transport used to have its own TextWrapper
+old_wrappers = {}
+def old_wrap(data, width):
+    if width not in old_wrappers:
+        old_wrappers[width] = textwrap.TextWrapper(width=width,
+            expand_tabs=True, replace_whitespace=False,
+            drop_whitespace=False, break_long_words=True,
+            subsequent_indent=r'\   ')
+    wrapper = old_wrappers[width]
+    udata = data.decode('utf-8')
+    return ''.join([wrapper.fill(line)
+        for line in udata.splitlines(True)]).encode('utf-8')
+
+def run(wrap, messages, widths):
+    start = time.time()
+    for m in messages:
+        for w in widths:
+            wrap(m, w)
+    return len(messages) * len(widths) / (time.time() - start)
+
+if __name__ == '__main__':
+    random.seed(2010)
+    messages = [make_message(i) for i in range(MESSAGES)]
+    widths = [79] * (RECIPIENTS - 20) + [120] * 10 + [60] * 10
+    for m in messages:
+        assert(old_wrap(m, 79) == telnet.wrap_text(m, 79))
+    old_rate = run(old_wrap, messages, widths)
+    new_rate = run(telnet.wrap_text, messages, widths)
+    print('textwrap on each write: %9.0f writes/s' % old_rate)
+    print('wrap_text:              %9.0f writes/s (%.1fx)' %
+        (new_rate, new_rate / old_rate))
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -221,6 +221,7 @@ CREATE TABLE `game` (
      'Res', 'TM', 'PW', 'PDr', 'WLM', 'WNM', 'MBB', '50') NOT NULL,
   `ply_count` SMALLINT NOT NULL,
   `movetext` TEXT,
+  `compact_moves` BLOB DEFAULT NULL COMMENT 'moves packed 2 bytes each; see variant/base_variant.py',
   `when_started` TIMESTAMP NOT NULL,
   `when_ended` TIMESTAMP NOT NULL,
   INDEX(`white_name`),
@@ -417,6 +418,7 @@ CREATE TABLE `adjourned_game` (
   `adjourn_reason` ENUM('Agr', 'Dis'),
   `ply_count` SMALLINT NOT NULL,
   `movetext` TEXT,
+  `compact_moves` BLOB DEFAULT NULL COMMENT 'moves packed 2 bytes each; see variant/base_variant.py',
   `when_started` TIMESTAMP NOT NULL,
   `when_adjourned` TIMESTAMP NOT NULL,
   `idn` INT(4) DEFAULT NULL COMMENT 'chess960 position ID, if any',
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""This is a script to fill in the compact_moves column of games and
+adjourned games that were stored before the server wrote it, by
+replaying their SAN movetext.  It adds the column first if the
+database does not have it yet.  Bughouse games are skipped, since their
+drops depend on the partner's board; they keep being replayed from SAN.
+Run from the top-level directory:
+python scripts/backfill-compact-moves.py """
+
+import sys
+import MySQLdb
+
+import __builtin__
+__builtin__.__dict__['N_'] = lambda s: s
+__builtin__.__dict__['A_'] = lambda s: s
+
+sys.path.insert(0, 'src/')
+import variant.chess
+import variant.chess960
+import variant.crazyhouse
+from variant.base_variant import IllegalMoveError
+
+# rows read at a time
+BATCH = 500
+
+VARIANTS = {'chess': variant.chess.Chess,
+    'chess960': variant.chess960.Chess960,
+    'crazyhouse': variant.crazyhouse.Crazyhouse}
+
+TABLES = [('game', 'game_id', """SELECT game_id,variant_name,idn,
+            movetext,ply_count
+        FROM game LEFT JOIN variant USING(variant_id)
+            LEFT JOIN game_idn USING(game_id)
+        WHERE compact_moves IS NULL AND game_id > %s
+        ORDER BY game_id LIMIT %s"""),
+    ('adjourned_game', 'adjourn_id', """SELECT adjourn_id,variant_name,idn,
+            movetext,ply_count
+        FROM adjourned_game LEFT JOIN variant USING(variant_id)
+        WHERE compact_moves IS NULL AND adjourn_id > %s
+        ORDER BY adjourn_id LIMIT %s""")]
+
+class FakeGame(object):
+    def __init__(self, idn):
+        self.idn = idn
+
+def add_column(cursor, table):
+    cursor.execute("""SHOW COLUMNS FROM %s LIKE 'compact_moves'""" % table)
+    if not cursor.fetchone():
+        cursor.execute("""ALTER TABLE %s ADD COLUMN compact_moves BLOB
+            DEFAULT NULL AFTER movetext""" % table)
+        print 'added compact_moves to %s' % table
+
+def get_compact_moves(variant_name, idn, movetext, ply_count):
+    v = VARIANTS[variant_name](FakeGame(idn))
+    moves = movetext.split(' ') if ply_count else []
+    if len(moves) != ply_count:
+        raise IllegalMoveError('ply count %d does not match movetext' %
+            ply_count)
+    for m in moves:
+        mv = v.parse_stored_move(m)
+        mv.time = 0.0
+        v.do_move(mv)
+    return v.get_compact_moves()
+
+def backfill(db, table, id_col, query):
+    cursor = db.cursor()
+    add_column(cursor, table)
+    (count, skipped) = (0, 0)
+    last_id = 0
+    while True:
+        cursor.execute(query, (last_id, BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        for (id_, variant_name, idn, movetext, ply_count) in rows:
+            last_id = id_
+            if variant_name not in VARIANTS or (variant_name == 'chess960'
+                    and idn is None):
+                skipped += 1
+                continue
+            try:
+                updates.append((get_compact_moves(variant_name, idn,
+                    movetext, ply_count), id_))
+            except IllegalMoveError as e:
+                print '%s %d: %s' % (table, id_, e.reason)
+                skipped += 1
+        cursor.executemany("""UPDATE %s SET compact_moves=%%s
+            WHERE %s=%%s""" % (table, id_col), updates)
+        count += len(updates)
+    cursor.close()
+    print '%s: filled in %d rows, skipped %d' % (table, count, skipped)
+
+def main():
+    db = MySQLdb.connect(host='localhost', db='chess',
+        read_default_file="~/.my.cnf")
+    for (table, id_col, query) in TABLES:
+        backfill(db, table, id_col, query)
+
+if __name__ == "__main__":
+    main()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
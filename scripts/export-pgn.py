@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""This is a script to export the game table, or the games of one
+user, as PGN.  The output is gzipped if its name ends in .gz.  The
+admin command aexportpgn does the same from within the server.
+Run from the top-level directory:
+python scripts/export-pgn.py [-u username] file.pgn[.gz] """
+
+import sys
+
+import __builtin__
+__builtin__.__dict__['N_'] = lambda s: s
+__builtin__.__dict__['A_'] = lambda s: s
+
+sys.path.insert(0, 'src/')
+from db import db
+from pgn_export import export_games
+
+def main():
+    args = sys.argv[1:]
+    name = None
+    if len(args) >= 2 and args[0] == '-u':
+        name = args[1]
+        args = args[2:]
+    if len(args) != 1:
+        print __doc__
+        sys.exit(1)
+    (count, secs) = export_games(db, args[0], name)
+    print 'exported %d games in %.1f s (%.0f games/s)' % (count, secs,
+        count / secs if secs else 0)
+
+if __name__ == "__main__":
+    main()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
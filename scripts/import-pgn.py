@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""This is a script to import games from PGN files, such as the FICS
+games database, into the game table.  Files ending in .gz are read
+compressed.  The files are read one game at a time, so they can be of
+any size; the games are checked by replaying them in a pool of worker
+processes, and inserted a batch at a time.  Chess, crazyhouse and
+chess960 games are imported; games of other variants, games from a
+set-up position and games that are unfinished or have illegal moves
+are skipped.
+Run from the top-level directory:
+python scripts/import-pgn.py [-j workers] file.pgn[.gz] ... """
+
+import sys
+import gzip
+import time
+import datetime
+import multiprocessing
+
+import __builtin__
+__builtin__.__dict__['N_'] = lambda s: s
+__builtin__.__dict__['A_'] = lambda s: s
+
+sys.path.insert(0, 'src/')
+import variant.chess
+import variant.chess960
+import variant.crazyhouse
+import speed_variant
+from db import db
+from pgn import read_games, PgnGame, PgnError
+from variant.base_variant import IllegalMoveError
+
+# games read, replayed and inserted at a time
+BATCH = 1000
+
+# games given to a worker at a time
+CHUNK = 50
+
+INITIAL_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+class SkipGame(Exception):
+    def __init__(self, reason):
+        self.reason = reason
+
+class FakeGame(object):
+    def __init__(self, fen):
+        self.fen = fen
+
+class ImportChess960(variant.chess960.Chess960):
+    """ A chess960 game that starts from the FEN of its PGN tags, so
+    that the workers do not need the database. """
+    def __init__(self, game):
+        self.game = game
+        self.pos = variant.chess960.Position(game.fen)
+        self.name = 'chess960'
+
+VARIANTS = {'chess': variant.chess.Chess,
+    'chess960': ImportChess960,
+    'crazyhouse': variant.crazyhouse.Crazyhouse}
+
+def get_variant_name(tags):
+    name = tags.get('Variant', '').lower()
+    event = tags.get('Event', '').lower()
+    if name in ['fischerandom', 'chess960'] or 'wild/fr' in event:
+        return 'chess960'
+    if name == 'crazyhouse' or 'crazyhouse' in event:
+        return 'crazyhouse'
+    if name in ['', 'normal', 'standard'] and not ('wild' in event or
+            'bughouse' in event or 'suicide' in event or
+            'losers' in event or 'atomic' in event):
+        return 'chess'
+    raise SkipGame('unsupported variant')
+
+def get_time_control(tags):
+    """ Return (time, inc, speed_name), with the time in minutes
+    and the increment in seconds. """
+    tc = tags.get('TimeControl', '-')
+    if tc in ['-', '?', '']:
+        return (0, 0, 'untimed')
+    try:
+        (secs, inc) = tc.split('+') if '+' in tc else (tc, 0)
+        (t, inc) = (int(secs) // 60, int(inc))
+    except ValueError:
+        raise SkipGame('bad time control %s' % tc)
+    # the same limits the server uses for fischer clocks; see match.py
+    expected_duration = t + inc * float(2) / 3
+    if expected_duration == 0:
+        speed_name = 'untimed'
+    elif expected_duration < 3.0:
+        speed_name = 'lightning'
+    elif expected_duration < 15.0:
+        speed_name = 'blitz'
+    elif expected_duration < 75.0:
+        speed_name = 'standard'
+    else:
+        speed_name = 'slow'
+    return (t, inc, speed_name)
+
+def get_when_started(tags):
+    date = tags.get('Date', '?')
+    if '?' in date:
+        raise SkipGame('no date')
+    time_ = tags.get('Time', '00:00:00').replace('?', '0')
+    try:
+        return datetime.datetime.strptime('%s %s' % (date, time_),
+            '%Y.%m.%d %H:%M:%S')
+    except ValueError:
+        raise SkipGame('bad date %s %s' % (date, time_))
+
+def get_rating(tags, tag):
+    rating = tags.get(tag, '0')
+    return rating if rating.isdigit() and len(rating) <= 4 else '0'
+
+def get_result_reason(g, v):
+    """ Work out how a game ended, from the position at the end and
+    from the comments FICS puts at the end of its games. """
+    if g.is_checkmate or v.pos.is_checkmate:
+        return 'Mat'
+    if g.is_stalemate or v.pos.is_stalemate:
+        return 'Sta'
+    if g.is_repetition:
+        return 'Rep'
+    if g.is_fifty:
+        return '50'
+    if g.is_draw_nomaterial:
+        return 'NM'
+    comments = g.moves[-1].comments if g.moves else g.initial_comments
+    for com in reversed(comments):
+        # comments may be wrapped over several lines
+        com = ' '.join(com.split())
+        if 'resigns' in com:
+            return 'Res'
+        elif 'forfeits on time' in com:
+            return 'Fla'
+        elif 'ran out of time' in com:
+            return 'TM'
+        elif 'agreement' in com:
+            return 'Agr'
+        elif 'disconnection' in com:
+            return 'Dis'
+        elif 'adjudication' in com:
+            return 'Adj'
+    return 'Agr' if g.result == '1/2-1/2' else 'Res'
+
+def parse_game(raw):
+    """ Parse and replay one game; this runs in the worker processes.
+    Return (line_num, row, None) with the row to insert, or
+    (line_num, None, reason) if the game is skipped. """
+    (tags, movetext, line_num) = raw
+    try:
+        try:
+            g = PgnGame(tags, movetext)
+        except AssertionError:
+            raise SkipGame('no White tag')
+        if getattr(g, 'result', '*') == '*':
+            raise SkipGame('unfinished game')
+        variant_name = get_variant_name(tags)
+        fen = tags.get('FEN')
+        if variant_name == 'chess960':
+            if not fen:
+                raise SkipGame('chess960 game without a FEN tag')
+        elif fen and fen != INITIAL_FEN:
+            raise SkipGame('set-up position')
+
+        v = VARIANTS[variant_name](FakeGame(fen))
+        for m in g.moves:
+            mv = v.parse_move(m.text, None)
+            if not mv:
+                raise IllegalMoveError('bad move %s' % m.text)
+            mv.time = 0.0
+            v.do_move(mv)
+
+        pos = v.pos
+        (t, inc, speed_name) = get_time_control(tags)
+        when_started = get_when_started(tags)
+        eco = tags.get('ECO', '')[0:3]
+        event = tags.get('Event', '').lower()
+        row = {'white_name': tags['White'],
+            'white_rating': get_rating(tags, 'WhiteElo'),
+            'black_name': tags.get('Black', ''),
+            'black_rating': get_rating(tags, 'BlackElo'),
+            'eco': eco if len(eco) == 3 else 'A00',
+            'variant_name': variant_name, 'speed_name': speed_name,
+            'time': t, 'inc': inc,
+            'rated': 'rated' in event and 'unrated' not in event,
+            'result': g.result,
+            'result_reason': get_result_reason(g, v),
+            'ply_count': pos.ply - pos.start_ply,
+            'movetext': ' '.join(pos.history.get_move(i).to_san()
+                for i in xrange(pos.start_ply, pos.ply)),
+            'compact_moves': v.get_compact_moves(),
+            'when_started': when_started, 'when_ended': when_started,
+            'fen': fen}
+    except (PgnError, IllegalMoveError, SkipGame) as e:
+        return (line_num, None, e.reason)
+    return (line_num, row, None)
+
+_idns = {}
+def get_idn(fen):
+    if fen not in _idns:
+        _idns[fen] = db.idn_from_fen(fen)
+    return _idns[fen]
+
+def add_games(fn, results):
+    """ Insert the games of a batch that were not skipped, returning
+    the number inserted. """
+    rows = []
+    for (line_num, row, reason) in results:
+        if row is None:
+            print '%s:%d: skipped: %s' % (fn, line_num, reason)
+            continue
+        if row['variant_name'] == 'chess960':
+            row['idn'] = get_idn(row['fen'])
+            if row['idn'] is None:
+                print '%s:%d: skipped: unknown chess960 position' % (fn,
+                    line_num)
+                continue
+        sv = speed_variant.from_names(row['speed_name'],
+            row['variant_name'])
+        row['speed_id'] = sv.speed.id_
+        row['variant_id'] = sv.variant.id_
+        rows.append(row)
+    if not rows:
+        return 0
+    game_id = db.game_add_many(rows)
+    idns = [(game_id + i, row['idn']) for (i, row) in enumerate(rows)
+        if row['variant_name'] == 'chess960']
+    if idns:
+        db.game_add_idn_many(idns)
+    return len(rows)
+
+def batches(games):
+    batch = []
+    for g in games:
+        batch.append(g)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def import_file(pool, fn):
+    f = gzip.open(fn, 'rb') if fn.endswith('.gz') else open(fn, 'r')
+    (read, added) = (0, 0)
+    start = time.time()
+    # Replay each batch while the one before it is inserted, keeping
+    # no more than two batches in memory.
+    pending = None
+    for batch in batches(read_games(f)):
+        read += len(batch)
+        result = pool.map_async(parse_game, batch, CHUNK)
+        if pending is not None:
+            added += add_games(fn, pending.get())
+        pending = result
+    if pending is not None:
+        added += add_games(fn, pending.get())
+    f.close()
+    secs = time.time() - start
+    print '%s: imported %d of %d games in %.1f s (%.0f games/s)' % (fn,
+        added, read, secs, read / secs if secs else 0)
+
+def main():
+    args = sys.argv[1:]
+    workers = None
+    if len(args) >= 2 and args[0] == '-j':
+        workers = int(args[1])
+        args = args[2:]
+    if not args:
+        print __doc__
+        sys.exit(1)
+    pool = multiprocessing.Pool(workers)
+    for fn in args:
+        import_file(pool, fn)
+    pool.close()
+    pool.join()
+
+if __name__ == "__main__":
+    main()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -52,7 +52,6 @@ class Alias(object):
             'gfm': 'getgame $@fm',
             'gm': 'getgame $@m',
             'got': 'goboard $@',
-            'goto': 'goboard $@',
             'h': 'help $@',
             'hi': 'history $@',
             'ho': 'history $o',
@@ -19,7 +19,6 @@
 # At present this is only used for tests.
 
 import re
-import copy
 
 # XXX we ignore additional tags on the same line
 tag_re = re.compile(r'''\[(\w+)\s+"([^"\n]*?)"\]\s*''')
@@ -39,8 +38,8 @@ fifty_re = re.compile(r'''\s+drawn\s+by\s+the\s+50\s+move\s+rule\s*$''')
 
 class PgnError(Exception):
     def __init__(self, reason):
+        Exception.__init__(self, reason)
         self.reason = reason
-        print(reason)
 
 class BpgnMove(object):
     def __init__(self, text, decorator, char):
@@ -52,69 +51,69 @@ class BpgnMove(object):
     def add_comment(self, com):
         self.comments.append(com)
 
-class Bpgn(object):
-    def __init__(self, f):
-        self.f = f
-
-    def __iter__(self):
-        skip_blank = True
-        line_num = 0
-        tags = {}
-        in_tag_section = True
-
-        for line in self.f:
-            line = line.rstrip('\r\n')
-            if skip_blank:
-                if line == '' or line[0:6] == '{ FEN ':
-                    line_num += 1
+def read_games(f):
+    """ Read the games of a BPGN file one at a time, yielding (tags,
+    movetext, line_num) for each, like pgn.read_games(). """
+    skip_blank = True
+    tags = {}
+    movetext = []
+    in_tag_section = True
+    start_line = None
+
+    for (line_num, line) in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if skip_blank:
+            if line == '' or line[0:6] == '{ FEN ':
+                continue
+            else:
+                skip_blank = False
+                start_line = line_num
+
+        if in_tag_section:
+            if line == '':
+                in_tag_section = False
+            else:
+                if line[0] == ';':
+                    # skip comment
                     continue
-                else:
-                    skip_blank = False
-
-            if in_tag_section:
-                if line == '':
-                    movetext = []
+                m = tag_re.match(line)
+                if not m:
                     in_tag_section = False
                 else:
-                    if len(line) > 0 and line[0] == ';':
-                        # skip comment
-                        line_num += 1
-                        continue
-                    m = tag_re.match(line)
-                    if not m:
-                        in_tag_section = False
-                        movetext = []
-                    else:
-                        tags[m.group(1)] = m.group(2).replace(r'\"', '"')
-
-            if not in_tag_section:
-                if line == '':
-                    # Search for the result to try to handle blank lines
-                    # within the movetext.  This doesn't account for
-                    # results within user comments, but works for now.
-                    movetext_str = '\n'.join(movetext)
-                    if not result_re.search(movetext_str):
-                        movetext.append(line)
-                        line_num += 1
-                        continue
-                    yield PgnGame(tags, movetext_str)
-                    tags.clear()
-                    skip_blank = True
-                    in_tag_section = True
-                else:
+                    tags[m.group(1)] = m.group(2).replace(r'\"', '"')
+
+        if not in_tag_section:
+            if line == '':
+                # Search for the result to try to handle blank lines
+                # within the movetext.  This doesn't account for
+                # results within user comments, but works for now.
+                movetext_str = '\n'.join(movetext)
+                if not result_re.search(movetext_str):
                     movetext.append(line)
+                    continue
+                yield (tags, movetext_str, start_line)
+                tags = {}
+                movetext = []
+                skip_blank = True
+                in_tag_section = True
+            else:
+                movetext.append(line)
 
-            line_num += 1
+    if len(tags) > 0:
+        yield (tags, '\n'.join(movetext), start_line)
 
-        if len(tags) > 0:
-            movetext_str = '\n'.join(movetext)
-            yield PgnGame(tags, movetext_str)
+class Bpgn(object):
+    def __init__(self, f):
+        self.f = f
 
+    def __iter__(self):
+        for (tags, movetext, line_num) in read_games(self.f):
+            yield PgnGame(tags, movetext)
         self.f.close()
 
 class PgnGame(object):
     def __init__(self, tags, movetext):
-        self.tags = copy.copy(tags)
+        self.tags = tags
         self.movetext = movetext
         self.is_checkmate = False
         self.is_stalemate = False
@@ -228,7 +227,6 @@ class PgnGame(object):
                 i = m.end()
                 continue
 
-            print('match %r' % move_num_re.match(s, i))
             raise PgnError('unrecognized sytax in pgn: "%s", i %d' % (s[i:i+15], i))
 
     def __str__(self):
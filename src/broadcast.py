@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Sending the same message to many users.  The message is translated
+once for each language and wrapped and escaped once for each kind of
+connection, instead of once for each user. """
+
+import lang
+import connection
+
+class Broadcast(object):
+    def __init__(self, msg, args=None, translate=True, wrap=True):
+        """ MSG is translated for each user and formatted with ARGS,
+        as with user.write_(); if TRANSLATE is False, it is only
+        formatted.  If WRAP is False, it is sent as with
+        user.write_nowrap(). """
+        self.msg = msg
+        self.args = args
+        self.translate = translate
+        self.wrap = wrap
+        # map from language to text
+        self._texts = {}
+        # map from (language, wrap width, compatibility) to bytes
+        self._rendered = {}
+
+    def _get_text(self, lang_name):
+        try:
+            return self._texts[lang_name]
+        except KeyError:
+            pass
+        if lang_name is None:
+            text = self.msg
+        else:
+            text = lang.langs[lang_name].gettext(self.msg)
+        if self.args is not None:
+            text = text % self.args
+        self._texts[lang_name] = text
+        return text
+
+    def send(self, u):
+        """ Send the message to one user.  The caller is responsible
+        for checking whether the user should get the message. """
+        connection.written_users.add(u)
+        conn = u.session.conn
+        lang_name = u.vars['lang'] if self.translate else None
+        text = self._get_text(lang_name)
+        if conn.buffer_output and self.wrap:
+            # the user is running a command in block mode
+            conn.write(text)
+            return
+        t = conn.transport
+        key = (lang_name, t.wrap_width if self.wrap else None,
+            t.compatibility)
+        try:
+            data = self._rendered[key]
+        except KeyError:
+            data = t.render(text, self.wrap)
+            self._rendered[key] = data
+        t.write_rendered(data)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -23,6 +23,8 @@ from datetime import datetime
 import list_
 import admin
 
+from broadcast import Broadcast
+
 import db as dbmod
 from db import db
 from config import config
@@ -50,6 +52,7 @@ class Channel(object):
         #if user.is_chmuzzled:
         #    user.write(_('You are muzzled in all channels.\n'))
         msg = '\n%s(%d): %s\n' % (user.get_display_name(), self.id, msg)
+        b = Broadcast(msg, translate=False)
         is_guest = user.is_guest
         count = 0
         name = user.name
@@ -59,15 +62,16 @@ class Channel(object):
             if not u.hears_channels():
                 continue
             if not name in u.censor:
-                u.write(msg)
+                b.send(u)
                 count += 1
         return count
 
     def qtell(self, msg):
+        b = Broadcast(msg, translate=False)
         for u in self.online:
             if not u.hears_channels():
                 continue
-            u.write(msg)
+            b.send(u)
 
     def log_on(self, user):
         self.online.append(user)
@@ -109,10 +113,11 @@ class Channel(object):
             # clear the topic
             self.topic = None
             db.channel_del_topic(self.id)
+            b = Broadcast('\n%s(%d): *** Cleared topic. ***\n',
+                (owner.get_display_name(), self.id))
             for u in self.online:
                 if u.hears_channels():
-                    u.write_('\n%s(%d): *** Cleared topic. ***\n',
-                        (owner.get_display_name(), self.id))
+                    b.send(u)
         else:
             # set a new topic
             self.topic = topic
@@ -210,10 +215,11 @@ class Channel(object):
             u.write_('*** You have been kicked out of channel %(chid)d by %(owner)s. ***\n' %
                 {'owner': owner.name, 'chid': self.id})
 
+        b = Broadcast('\n%s(%d): *** Kicked out %s. ***\n',
+            (owner.get_display_name(), self.id, u.name))
         for p in self.online:
             if p.hears_channels():
-                p.write_('\n%s(%d): *** Kicked out %s. ***\n',
-                    (owner.get_display_name(), self.id, u.name))
+                b.send(p)
 
     def get_display_name(self):
         if self.name is not None:
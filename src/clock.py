@@ -19,6 +19,8 @@
 import datetime
 import time
 
+from twisted.internet import reactor
+
 import time_format
 import online
 
@@ -27,8 +29,17 @@ from config import config
 
 clock_names = {}
 
+# seconds between flag checks when a player is out of time but the
+# opponent does not have autoflag set
+autoflag_interval = 5
+
 class Clock(object):
+    # the reactor call that checks the flag of the player whose
+    # clock is ticking, when that player's time runs out
+    _flag_call = None
+
     def __init__(self, g, white_time, black_time):
+        self.game = g
         self._white_time = white_time
         self._black_time = black_time
         self.inc = g.inc
@@ -39,9 +50,55 @@ class Clock(object):
         self.is_ticking = True
         self._side_ticking = side
         self.started_time = time.time()
+        self._schedule_flag()
 
     def stop(self):
         self.is_ticking = False
+        self._cancel_flag()
+
+    def get_deadline(self):
+        """ Return the time, as given by time.time(), when the player
+        whose clock is ticking runs out of time, or None if the clock
+        is not ticking.  Increments and other time that a clock adds
+        are added after a move, so they do not affect the deadline. """
+        if not self.is_ticking:
+            return None
+        if self._side_ticking == WHITE:
+            return self.started_time + self._white_time
+        else:
+            return self.started_time + self._black_time
+
+    def _schedule_flag(self):
+        self._cancel_flag()
+        deadline = self.get_deadline()
+        if deadline is not None:
+            self._flag_call = reactor.callLater(
+                max(0.0, deadline - time.time()), self._flag_due)
+
+    def _cancel_flag(self):
+        if self._flag_call is not None:
+            if self._flag_call.active():
+                self._flag_call.cancel()
+            self._flag_call = None
+
+    def _flag_due(self):
+        self._flag_call = None
+        g = self.game
+        if not (g.is_active and self.is_ticking):
+            return
+        deadline = self.get_deadline()
+        if deadline > time.time():
+            # the call came a little early
+            self._schedule_flag()
+            return
+        u = g.get_user_to_move()
+        if g.get_opp(u).vars['autoflag']:
+            # TODO: send auto-flagging message a la original fics.
+            if self.check_flag(g, self._side_ticking):
+                return
+        # the opponent may set autoflag or use the flag command later
+        self._flag_call = reactor.callLater(autoflag_interval,
+            self._flag_due)
 
     def _time_to_str(self, secs):
         if secs < 0:
@@ -62,6 +119,8 @@ class Clock(object):
             self._white_time += secs
         else:
             self._black_time += secs
+        if self.is_ticking and self._side_ticking == side:
+            self._schedule_flag()
 
     def got_move(self, side, ply, elapsed=None):
         """ Stop the clock, and record the time remaining for the player
@@ -196,10 +255,14 @@ clock_names['overtime'] = OvertimeClock
 
 class UntimedClock(Clock):
     def __init__(self, g=None, white_time=None, black_time=None):
+        self.game = g
         self.is_ticking = False
         self._white_time = 0
         self._black_time = 0
 
+    def get_deadline(self):
+        return None
+
     def got_move(self, side, ply, elapsed=None):
         pass
 
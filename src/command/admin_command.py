@@ -17,6 +17,7 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
 import datetime
 
 import user
@@ -26,8 +27,9 @@ import admin
 import speed_variant
 import list_
 from reload import reload
+from pgn_export import pgn_export
 
-from db import db
+from db import db, log_error
 from command import Command, ics_command, requires_registration
 from command_parser import BadCommandError
 from config import config
@@ -55,11 +57,43 @@ class Addplayer(Command):
                 % u.name)
         else:
             passwd = user.make_passwd()
-            user_id = user.add_user(name, email, passwd, real_name)
-            #db.add_comment(conn.user.id, user_id,
-            #    'Player added by %s using addplayer.' % conn.user.name)
-            conn.write(A_('Added: >%s< >%s< >%s< >%s<\n')
-                % (name, real_name, email, passwd))
+            def added(user_id):
+                #db.add_comment(conn.user.id, user_id,
+                #    'Player added by %s using addplayer.' % conn.user.name)
+                conn.write(A_('Added: >%s< >%s< >%s< >%s<\n')
+                    % (name, real_name, email, passwd))
+            conn.wait_for(user.add_user(name, email, passwd, real_name),
+                added)
+
+@ics_command('aexportpgn', 'o', admin.Level.admin)
+class Aexportpgn(Command):
+    def run(self, args, conn):
+        name = None
+        if args[0] is not None:
+            u = user.find_by_prefix_for_user(args[0], conn)
+            if not u:
+                return
+            name = u.name
+        path = os.path.join(config.pgn_export_dir, '%s-%s.pgn.gz' % (
+            name or 'games',
+            datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S')))
+        d = pgn_export.start(path, name)
+        if d is None:
+            conn.write(A_('A PGN export is already running.\n'))
+            return
+        conn.write(A_('Exporting games to %s.\n') % path)
+
+        u = conn.user
+        def done((count, secs)):
+            if u.is_online:
+                u.write(A_('\nPGN export finished: %(count)d games written to %(path)s in %(secs).1f seconds (%(rate).0f games/s).\n') % {
+                    'count': count, 'path': path, 'secs': secs,
+                    'rate': count / secs if secs else 0})
+        def failed(failure):
+            log_error(failure, 'PGN export')
+            if u.is_online:
+                u.write(A_('\nPGN export to %s failed.\n') % path)
+        d.addCallbacks(done, failed)
 
 @ics_command('announce', 'S', admin.Level.admin)
 class Announce(Command):
@@ -150,10 +184,11 @@ class Asetpasswd(Command):
             elif not user.is_legal_passwd(passwd):
                 conn.write('"%s" is not a valid password.\n' % passwd)
             else:
-                u.set_passwd(passwd)
-                conn.write('Password of %s changed to %s.\n' % (u.name, '*' * len(passwd)))
-                if u.is_online:
-                    u.write_('\n%s has changed your password.\n', (conn.user.name,))
+                def changed(result):
+                    conn.write('Password of %s changed to %s.\n' % (u.name, '*' * len(passwd)))
+                    if u.is_online:
+                        u.write_('\n%s has changed your password.\n', (conn.user.name,))
+                conn.wait_for(u.set_passwd(passwd), changed)
 
 @ics_command('asetrating', 'wwwddfddd', admin.Level.admin)
 class Asetrating(Command):
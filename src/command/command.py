@@ -159,11 +159,14 @@ class Password(Command):
             conn.write(_("Setting a password is only for registered players.\n"))
         else:
             [oldpass, newpass] = args
-            if not conn.user.check_passwd(oldpass):
-                conn.write(_("Incorrect password; password not changed!\n"))
-            else:
-                conn.user.set_passwd(newpass)
+            def checked(ok):
+                if not ok:
+                    conn.write(_("Incorrect password; password not changed!\n"))
+                else:
+                    conn.wait_for(conn.user.set_passwd(newpass), changed)
+            def changed(result):
                 conn.write(_("Password changed to %s.\n") % ('*' * len(newpass)))
+            conn.wait_for(conn.user.check_passwd(oldpass), checked)
 
 @ics_command('quit', '', admin.Level.user)
 class Quit(Command):
@@ -22,6 +22,8 @@ import pytz
 import time
 
 import time_format
+import telnet
+import login
 
 from command import ics_command, Command
 
@@ -48,5 +50,19 @@ class Uptime(Command):
             % time.strftime("%a %b %e, %H:%M UTC %Y", time.gmtime(server.start_time)))
         conn.write(_("Up for: %s\n") % time_format.hms_words(time.time() -
             server.start_time))
+        if conn.user.is_admin():
+            st = telnet.stats
+            conn.write(_("Output: %(writes)d writes in %(sends)d sends, %(bytes_in)d bytes (%(bytes_out)d after zipseal)\n") % st)
+            times = []
+            for phase in login.PHASES:
+                (count, total, longest) = login.stats[phase]
+                times.append('%s %.1f/%.1f (%d)' % (phase,
+                    1000 * total / count if count else 0.0,
+                    1000 * longest, count))
+            conn.write(_("Login ms (average/longest): %s\n") %
+                ', '.join(times))
+            adm = login.admission
+            conn.write(_("Logins in progress: %(running)d (%(queued)d queued)\n") %
+                {'running': adm.limit - adm.tokens, 'queued': len(adm.waiting)})
 
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -101,6 +101,15 @@ class Forward(Command):
             return
         g.forward(n, conn)
 
+@ics_command('goto', 'd')
+class Goto(Command):
+    def run(self, args, conn):
+        g = conn.user.session.game
+        if not g or g.gtype != game.EXAMINED:
+            conn.write(_("You are not examining a game.\n"))
+            return
+        g.goto(args[0], conn)
+
 @ics_command('unexamine', '')
 class Unexamine(Command):
     def run(self, args, conn):
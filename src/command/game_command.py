@@ -21,11 +21,11 @@ import re
 
 import offer
 import game
+import eco
 
 from command_parser import BadCommandError
 from command import ics_command, Command
 from game_constants import *
-from db import db
 
 
 class GameMixin(object):
@@ -111,12 +111,12 @@ class Eco(Command, GameMixin):
                 if not self.eco_pat.match(args[1]):
                     conn.write(_("You haven't specified a valid ECO code.\n"))
                 else:
-                    rows = db.look_up_eco(args[1])
+                    rows = eco.book.look_up_eco(args[1])
             elif args[0] == 'n':
                 if not self.nic_pat.match(args[1]):
                     conn.write(_("You haven't specified a valid NIC code.\n"))
                 else:
-                    rows = db.look_up_nic(args[1])
+                    rows = eco.book.look_up_nic(args[1])
             else:
                 raise BadCommandError()
             for row in rows:
@@ -136,10 +136,10 @@ class Eco(Command, GameMixin):
             g = self._game_param(args[0], conn)
 
         if g:
-            (ply, eco, long) = g.get_eco()
+            (ply, eco_code, long) = g.get_eco()
             (nicply, nic) = g.get_nic()
             conn.write(_('Eco for game %d (%s vs. %s):\n') % (g.number, g.white_name, g.black_name))
-            conn.write(_(' ECO[%3d]: %s\n') % (ply, eco))
+            conn.write(_(' ECO[%3d]: %s\n') % (ply, eco_code))
             conn.write(_(' NIC[%3d]: %s\n') % (nicply, nic))
             conn.write(_('LONG[%3d]: %s\n') % (ply, long))
 
@@ -47,9 +47,8 @@ class Seek(Command):
             conn.write(e[0])
             return
 
-        # Check if the user has already posted the same seek.  It might be
-        # more efficient to do this check as part of seek.find_matching()
-        if s in seek.seeks.values():
+        # Check if the user has already posted the same seek.
+        if s in conn.user.session.seeks:
             conn.write(_('You already have an active seek with the same parameters.\n'))
             return
 
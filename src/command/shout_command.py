@@ -19,6 +19,8 @@
 
 from command import *
 
+from broadcast import Broadcast
+
 @ics_command('shout', 'S', admin.Level.user)
 class Shout(Command):
     @requires_registration
@@ -35,10 +37,11 @@ class Shout(Command):
             count = 0
             name = conn.user.name
             dname = conn.user.get_display_name()
+            b = Broadcast("\n%s shouts: %s\n", (dname, args[0]))
             for u in online.online:
                 if u.vars['shout'] and not u.in_silence():
                     if name not in u.censor:
-                        u.write_("\n%s shouts: %s\n", (dname, args[0]))
+                        b.send(u)
                         count += 1
             conn.write(ngettext("(shouted to %d player)\n", "(shouted to %d players)\n", count) % count)
 
@@ -58,11 +61,11 @@ class It(Command):
             count = 0
             name = conn.user.name
             dname = conn.user.get_display_name()
+            b = Broadcast("\n--> %s %s\n", (dname, args[0]))
             for u in online.online:
                 if u.vars['shout'] and not u.in_silence():
                     if name not in u.censor:
-                        u.write(_("\n--> %s %s\n") %
-                            (dname, args[0]))
+                        b.send(u)
                         count += 1
             conn.write(ngettext("(it-shouted to %d player)\n", "(it-shouted to %d players)\n", count) % count)
 
@@ -82,10 +85,11 @@ class Cshout(Command):
             count = 0
             name = conn.user.name
             dname = conn.user.get_display_name()
+            b = Broadcast("\n%s c-shouts: %s\n", (dname, args[0]))
             for u in online.online:
                 if u.vars['cshout'] and not u.in_silence():
                     if name not in u.censor:
-                        u.write_("\n%s c-shouts: %s\n", (dname, args[0]))
+                        b.send(u)
                         count += 1
             conn.write(ngettext("(c-shouted to %d player)\n", "(c-shouted to %d players)\n", count) % count)
 
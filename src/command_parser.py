@@ -30,6 +30,7 @@ import trie
 import admin
 import timeseal
 import block
+import timer
 
 class CommandList(object):
     def __init__(self):
@@ -62,6 +63,7 @@ class CommandParser(object):
             s = s[2:].lstrip()
         else:
             conn.user.session.last_command_time = time.time()
+            timer.reset_idle(conn.user)
             if conn.user.session.idlenotified_by:
                 for u in conn.user.session.idlenotified_by:
                     u.write_('\nNotification: %s has unidled.\n',
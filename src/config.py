@@ -25,8 +25,43 @@ class Config(object):
     db_host = "localhost"
     db_db = "chess"
 
+    # number of threads (and connections) used for queries
+    # that run outside the reactor thread
+    db_pool_min = 1
+    db_pool_max = 4
+
+    # where game results, history and ratings are journaled until
+    # they are written to the database
+    journal_path = 'journal.log'
+    # seconds between writes of journaled records to the database,
+    # and the number of records that causes a write right away
+    journal_flush_interval = 1.0
+    journal_batch_size = 200
+    # seconds to wait before trying again if a write fails
+    journal_retry_interval = 10.0
+
+    # where the aexportpgn command writes its files
+    pgn_export_dir = 'export'
+
+    # bcrypt work factor for new password hashes; each step up doubles
+    # the time to hash or check a password.  Existing hashes keep the
+    # work factor they were made with.
+    passwd_work_factor = 12
+    # number of passwords hashed or checked at once, each in a thread
+    passwd_threads = 2
+
     # login timout in seconds
     login_timeout = 30
+    # number of logins whose names, passwords or data are being looked
+    # up at once; others wait in a queue, so a storm of reconnecting
+    # clients after a restart doesn't starve users already online
+    max_logins_in_progress = 20
+    # seconds the welcome and login messages are kept after being
+    # read from the database
+    server_message_cache_time = 60
+    # connections the operating system holds for the server to accept;
+    # after a restart, many clients may try to reconnect at once
+    listen_backlog = 1024
     min_login_name_len = 3
 
     # max idle time in seconds
@@ -30,9 +30,9 @@ import lang
 
 from config import config
 from db import db
-from timeseal import timeseal, REPLY as TIMESEAL_REPLY
+from timeseal import Timeseal, REPLY as TIMESEAL_REPLY
 from session import Session
-from login import login
+from login import login, admit, timed, add_phase_time
 
 # the set of users we have sent messages to and to whom we should
 # thefore send prompts
@@ -44,6 +44,41 @@ def send_prompts():
     written_users.clear()
     assert(not written_users)
 
+# Output to each connection is held until the end of the current reactor
+# iteration, then sent in one write, after any prompts.
+pending_output = set()
+_flush_call = None
+def _output_pending(transport):
+    global _flush_call
+    pending_output.add(transport)
+    if _flush_call is None:
+        _flush_call = reactor.callLater(0, flush_output)
+
+def flush_output():
+    global _flush_call
+    _flush_call = None
+    # users written to outside of a command, for example by
+    # a Deferred firing, get their prompt now
+    send_prompts()
+    while pending_output:
+        pending_output.pop().flush()
+
+# The messages sent to every new connection are read from the database
+# at most once in config.server_message_cache_time seconds, instead of
+# once for each connection, since many clients may connect at once.
+_server_messages = {}
+def get_server_message(name):
+    now = time.time()
+    try:
+        (when, text) = _server_messages[name]
+        if now - when < config.server_message_cache_time:
+            return text
+    except KeyError:
+        pass
+    text = db.get_server_message(name)
+    _server_messages[name] = (now, text)
+    return text
+
 class Connection(basic.LineReceiver):
     implements(twisted.internet.interfaces.IProtocol)
     # the telnet transport changes all '\r\n' to '\n',
@@ -60,19 +95,28 @@ class Connection(basic.LineReceiver):
     def connectionMade(self):
         lang.langs['en'].install(names=['ngettext'])
         self.session = Session(self)
+        self.timeseal = Timeseal()
+        self.queued_lines = []
+        self.transport.bufferOutput(_output_pending)
         if self.transport.getHost().port == config.zipseal_port:
             self.session.use_zipseal = True
-            self.transport.encoder = timeseal.compress_zipseal
+            self.transport.encoder = self.timeseal.compress_zipseal
             self.session.check_for_timeseal = False
         self.factory.connections.append(self)
-        self.write(db.get_server_message('welcome'))
+        self.write(get_server_message('welcome'))
         self.login()
         self.session.login_last_command = time.time()
         self.ip = self.transport.getPeer().host
         self.timeout_check = reactor.callLater(config.login_timeout, self.login_timeout)
 
     def login_timeout(self):
-        assert(self.state in ['login', 'passwd'])
+        assert(self.state in ['login', 'passwd', 'waiting'])
+        if self.state == 'waiting':
+            # the server, not the client, is slow; for example, the
+            # login may be queued behind many others after a restart
+            self.timeout_check = reactor.callLater(config.login_timeout,
+                self.login_timeout)
+            return
         self.timeout_check = None
         self.write(_("\n**** LOGIN TIMEOUT ****\n"))
         self.loseConnection('login timeout')
@@ -84,7 +128,7 @@ class Connection(basic.LineReceiver):
 
     def login(self):
         self.state = 'login'
-        self.write(db.get_server_message('login'))
+        self.write(get_server_message('login'))
         if self.transport.compatibility:
             # the string "freechess.org" must appear somewhere in this message;
             # otherwise, Babs will refuse to connect
@@ -94,9 +138,9 @@ class Connection(basic.LineReceiver):
     def lineReceived(self, line):
         #print '((%s,%s))\n' % (self.state, repr(line))
         if self.session.use_timeseal:
-            (t, dline) = timeseal.decode_timeseal(line)
+            (t, dline) = self.timeseal.decode_timeseal(line)
         elif self.session.use_zipseal:
-            (t, dline) = timeseal.decode_zipseal(line)
+            (t, dline) = self.timeseal.decode_zipseal(line)
         else:
             t = None
             dline = line
@@ -123,14 +167,69 @@ class Connection(basic.LineReceiver):
         # ignore
         pass
 
+    def handleLine_waiting(self, line):
+        """ Hold on to lines that arrive while we are waiting for
+        a Deferred, to be handled in order once it fires. """
+        self.queued_lines.append((self.session.timeseal_last_timestamp,
+            line))
+
+    def wait_for(self, d, callback):
+        """ Stop handling input until the Deferred d fires, then pass
+        its result to callback and handle any lines that were received
+        in the meantime. """
+        prev_state = self.state
+        self.state = 'waiting'
+        def fired(result):
+            if self.state != 'waiting':
+                # the connection was closed while we were waiting
+                return
+            self.state = prev_state
+            if prev_state == 'prompt':
+                lang.langs[self.user.vars['lang']].install(
+                    names=['ngettext'])
+            else:
+                lang.langs['en'].install(names=['ngettext'])
+            callback(result)
+            if prev_state == 'prompt':
+                if self.state == 'prompt':
+                    # a command was waiting; the user gets a prompt
+                    # after its result
+                    written_users.add(self.user)
+                elif self.state == 'waiting':
+                    # the callback is waiting for something else, and
+                    # the prompt is sent once that has finished
+                    written_users.discard(self.user)
+            self._handle_queued_lines()
+        def failed(failure):
+            self.log('error while waiting: %s' % failure.getTraceback())
+            if self.state == 'waiting':
+                self.write('\nServer error; please try again later.\n')
+                if prev_state == 'prompt':
+                    # only the command failed
+                    self.state = prev_state
+                    written_users.add(self.user)
+                    self._handle_queued_lines()
+                else:
+                    self.loseConnection('server error')
+        d.addCallback(fired).addErrback(failed)
+
+    def _handle_queued_lines(self):
+        while self.queued_lines and self.state not in ['waiting',
+                'quitting']:
+            (t, line) = self.queued_lines.pop(0)
+            self.session.timeseal_last_timestamp = t
+            getattr(self, "handleLine_" + self.state)(line)
+
     def handleLine_login(self, line):
         self.timeout_check.cancel()
         self.timeout_check = reactor.callLater(config.login_timeout, self.login_timeout)
         self.session.login_last_command = time.time()
         if self.session.check_for_timeseal:
             self.session.check_for_timeseal = False
-            (t, dec) = timeseal.decode_timeseal(line)
-            if t != 0:
+            (t, dec) = self.timeseal.decode_timeseal(line)
+            # t is -1 if the line looks like timeseal but its
+            # timestamp is malformed; treat that as no timeseal
+            if t > 0:
                 if dec[0:10] == 'TIMESTAMP|':
                     self.session.use_timeseal = True
                     return
@@ -148,7 +247,11 @@ class Connection(basic.LineReceiver):
         name = line.strip()
         # hide password
         self.transport.will(telnet.ECHO)
-        self.claimed_user = login.get_user(name, self)
+        self.wait_for(admit(self, login.get_user, name, self),
+            self._got_user)
+
+    def _got_user(self, u):
+        self.claimed_user = u
         if self.claimed_user:
             self.state = 'passwd'
         else:
@@ -169,22 +272,40 @@ class Connection(basic.LineReceiver):
             passwd = line.strip()
             if len(passwd) == 0:
                 self.login()
-            elif self.claimed_user.check_passwd(passwd):
-                self.prompt()
             else:
-                self.write('\n**** Invalid password! ****\n\n')
-                self.login()
+                self.wait_for(admit(self, self._check_passwd, passwd),
+                    self._checked_passwd)
         assert(self.state != 'passwd')
 
+    def _check_passwd(self, passwd):
+        return timed(self.claimed_user.check_passwd(passwd), 'passwd')
+
+    def _checked_passwd(self, ok):
+        if ok:
+            self.prompt()
+        else:
+            self.write('\n**** Invalid password! ****\n\n')
+            self.login()
+
     def prompt(self):
+        # everything the user needs from the database is read in one
+        # trip to the database pool, so the reactor doesn't wait
+        self.wait_for(admit(self, self._get_log_on_data), self._log_on)
+
+    def _get_log_on_data(self):
+        return timed(self.claimed_user.get_log_on_data(), 'fetch')
+
+    def _log_on(self, data):
+        start = time.time()
         self.user = self.claimed_user
         self.timeout_check.cancel()
         self.timeout_check = None
-        self.user.log_on(self)
+        self.user.log_on(self, data)
         assert(self.user.is_online)
         written_users.add(self.user)
         self.state = 'prompt'
         send_prompts()
+        add_phase_time('log_on', start)
 
     def handleLine_prompt(self, line):
         if line == TIMESEAL_REPLY:
@@ -197,6 +318,10 @@ class Connection(basic.LineReceiver):
         try:
             command_parser.parser.parse(line, self)
         finally:
+            if self.state == 'waiting':
+                # the command is waiting for a Deferred, so the prompt
+                # is sent once it has finished
+                written_users.discard(self.user)
             send_prompts()
 
     def loseConnection(self, reason):
@@ -220,11 +345,16 @@ class Connection(basic.LineReceiver):
             self.user.log_off()
         self.transport.loseConnection()
         if reason == 'quit':
-            #timeseal.print_stats()
+            #self.timeseal.print_stats()
             self.write(db.get_server_message('logout'))
 
     def connectionLost(self, reason):
         basic.LineReceiver.connectionLost(self, reason)
+        # anything we were waiting for is no longer needed
+        self.state = 'quitting'
+        if self.timeout_check:
+            self.timeout_check.cancel()
+            self.timeout_check = None
         try:
             if self.user.is_online:
                 if self.logged_in_again:
@@ -16,7 +16,12 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import threading
+
 from MySQLdb import connect, cursors, IntegrityError, OperationalError
+from twisted.internet import reactor, threads, defer
+from twisted.python import threadpool
+
 from config import config
 
 class DuplicateKeyError(Exception):
@@ -24,6 +29,120 @@ class DuplicateKeyError(Exception):
 class DeleteError(Exception):
     pass
 
+# Queries that are run both on their own and together with others in
+# one round trip by query_sets().  Each returns a (query, args) pair,
+# so that the SQL is only written once.
+
+_user_cols = """user_id,user_name,user_passwd,user_last_logout,
+    user_admin_level,user_email,user_real_name,user_banned,
+    user_muzzled,user_muted,user_ratedbanned,user_playbanned"""
+
+def _user_id_sql(by_name):
+    """ The SQL for a user's id, given either as the id itself or,
+    if by_name, as the user's name. """
+    if by_name:
+        return '(SELECT user_id FROM user WHERE user_name=%s)'
+    return '%s'
+
+def _user_query(name):
+    return ("""SELECT %s FROM user WHERE user_name=%%s""" % _user_cols,
+        (name,))
+
+def _vars_query(user, vnames, by_name=False):
+    return ("""SELECT %s FROM user WHERE user_id=%s""" % (','.join(vnames),
+        _user_id_sql(by_name)), (user,))
+
+def _channels_query(user, by_name=False):
+    return ("""SELECT channel_id FROM channel_user
+        WHERE user_id=%s""" % _user_id_sql(by_name), (user,))
+
+def _formula_query(user, by_name=False):
+    return ("""SELECT num,f FROM formula WHERE user_id=%s
+        ORDER BY num ASC""" % _user_id_sql(by_name), (user,))
+
+def _notes_query(user, by_name=False):
+    return ("""SELECT num,txt FROM note WHERE user_id=%s
+        ORDER BY num ASC""" % _user_id_sql(by_name), (user,))
+
+def _aliases_query(user_id):
+    return ("""SELECT name,val FROM user_alias WHERE user_id=%s
+        ORDER BY name ASC""", (user_id,))
+
+def _titles_query(user_id):
+    return ("""SELECT title_name,title_flag,title_light
+        FROM user_title LEFT JOIN title USING (title_id)
+        WHERE user_id=%s ORDER BY title_id ASC""", (user_id,))
+
+def _notified_query(user_id):
+    return ("""SELECT user_name FROM user LEFT JOIN user_notify
+        ON (user.user_id=user_notify.notified)
+        WHERE notifier=%s""", (user_id,))
+
+def _notifiers_query(user_id):
+    return ("""SELECT user_name FROM user LEFT JOIN user_notify
+        ON (user.user_id=user_notify.notifier)
+        WHERE notified=%s""", (user_id,))
+
+def _gnotified_query(user_id):
+    return ("""SELECT user_name FROM user LEFT JOIN user_gnotify
+        ON (user.user_id=user_gnotify.gnotified)
+        WHERE gnotifier=%s""", (user_id,))
+
+def _gnotifiers_query(user_id):
+    return ("""SELECT user_name FROM user LEFT JOIN user_gnotify
+        ON (user.user_id=user_gnotify.gnotifier)
+        WHERE gnotified=%s""", (user_id,))
+
+def _censored_query(user_id):
+    return ("""SELECT user_name FROM user LEFT JOIN censor
+        ON (user.user_id=censor.censored)
+        WHERE censorer=%s""", (user_id,))
+
+def _noplayed_query(user_id):
+    return ("""SELECT user_name FROM user LEFT JOIN noplay
+        ON (user.user_id=noplay.noplayed)
+        WHERE noplayer=%s""", (user_id,))
+
+def _adjourned_query(user_id):
+    return ("""SELECT adjourn_id,white_user_id,black_user_id,
+            white.user_name as white_name, black.user_name as black_name
+        FROM adjourned_game
+            LEFT JOIN user AS white
+                ON (white.user_id = white_user_id)
+            LEFT JOIN user AS black
+                ON (black.user_id = black_user_id)
+        WHERE white_user_id=%s or black_user_id=%s""", (user_id, user_id))
+
+def _history_query(user_id):
+    return ("""SELECT game_id, num, result_char, user_rating,
+            color_char, opp_name, opp_rating, h.eco, flags, h.time,
+            h.inc, h.result_reason, h.when_ended, movetext,
+            compact_moves, idn
+        FROM history AS h LEFT JOIN game USING(game_id)
+            LEFT JOIN game_idn USING (game_id)
+        WHERE user_id=%s
+        ORDER BY when_ended ASC
+        LIMIT 10""", (user_id,))
+
+def _all_ratings_query(user_id):
+    return ("""SELECT variant_id,speed_id,rating,rd,volatility,
+            win,loss,draw,total,best,when_best,ltime
+        FROM rating WHERE user_id=%s""", (user_id,))
+
+def _news_since_query(when, is_admin):
+    return ("""SELECT news_id,news_title,DATE(news_when) as news_date,
+            news_poster
+        FROM news_index WHERE news_is_admin=%s AND news_when > %s
+        ORDER BY news_id DESC LIMIT 10""", ('1' if is_admin else '0', when))
+
+def _message_count_query(user_id):
+    return ("""SELECT COUNT(*) AS total,SUM(unread) AS unread
+        FROM message WHERE to_user_id=%s""", (user_id,))
+
+def _server_message_query(name):
+    return ("""SELECT server_message_text FROM server_message
+        WHERE server_message_name=%s""", (name,))
+
 class DB(object):
     def __init__(self):
         self.connect()
@@ -54,21 +173,109 @@ class DB(object):
             cursor.execute(*args)
             return cursor
 
+    def query_many(self, cursor, query, rows):
+        """ Like query(), but for executemany(), which turns an INSERT
+        or REPLACE into a single multi-row statement. """
+        try:
+            cursor.executemany(query, rows)
+            return cursor
+        except (AttributeError, OperationalError):
+            cursor.close()
+            self.db.close()
+            self.connect()
+            cursor = self.db.cursor(cursor.__class__)
+            cursor.executemany(query, rows)
+            return cursor
+
+    def query_sets(self, queries):
+        """ Run several SELECTs, given as a list of (query, args), in
+        one round trip to the server, as a single multi-statement
+        query.  Returns a list of the rows of each, as dicts. """
+        sql = ';\n'.join([q % self.db.literal(args) for (q, args) in queries])
+        cursor = self.db.cursor(cursors.DictCursor)
+        cursor = self.query(cursor, sql)
+        ret = [cursor.fetchall()]
+        while cursor.nextset():
+            ret.append(cursor.fetchall())
+        cursor.close()
+        assert(len(ret) == len(queries))
+        return ret
+
     def user_get(self, name):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT
-                user_id,user_name,user_passwd,user_last_logout,
-                user_admin_level, user_email,user_real_name,user_banned,
-                user_muzzled,user_muted,user_ratedbanned,user_playbanned
-            FROM user WHERE user_name=%s""", (name,))
+        cursor = self.query(cursor, *_user_query(name))
         row = cursor.fetchone()
         cursor.close()
         return row
 
+    def user_get_profile(self, name, vnames):
+        """ Get a user's row, as user_get() does, along with the user's
+        vars, channels, formula and notes, in one round trip.  Returns
+        None if there is no such user. """
+        (users, vars_, channels, formula, notes) = self.query_sets([
+            _user_query(name),
+            _vars_query(name, vnames, by_name=True),
+            _channels_query(name, by_name=True),
+            _formula_query(name, by_name=True),
+            _notes_query(name, by_name=True)])
+        if not users:
+            return None
+        row = users[0]
+        row['vars'] = vars_[0]
+        row['channels'] = [r['channel_id'] for r in channels]
+        row['formula'] = formula
+        row['notes'] = notes
+        return row
+
+    def user_get_log_on(self, user_id, last_logout):
+        """ Get what a registered user needs when logging on, in one
+        round trip.  Returns a dict whose values are the rows that
+        the queries of the same names in this class return, except
+        that the message counts are (total, unread) and the motd
+        is its text. """
+        return self.user_get_log_on_many([(user_id, last_logout)])[0]
+
+    def user_get_log_on_many(self, users):
+        """ Like user_get_log_on(), but for several users, given as a
+        list of (user_id, last_logout), still in one round trip.
+        Returns a list of dicts in the same order. """
+        queries = []
+        for (user_id, last_logout) in users:
+            queries += self._log_on_queries(user_id, last_logout)
+        sets = self.query_sets([(q, args) for (name, q, args) in queries] +
+            [_server_message_query('motd')])
+        motd = sets.pop()[0]['server_message_text']
+        n = len(queries) // len(users)
+        ret = []
+        for i in range(len(users)):
+            d = dict(zip([name for (name, q, args) in queries[0:n]],
+                sets[i * n:(i + 1) * n]))
+            row = d['message_count'][0]
+            d['message_count'] = (int(row['total']), int(row['unread'] or 0))
+            d['motd'] = motd
+            ret.append(d)
+        return ret
+
+    def _log_on_queries(self, user_id, last_logout):
+        """ The queries for user_get_log_on(), as (name, query, args). """
+        return [(name,) + q for (name, q) in [
+            ('news', _news_since_query(last_logout, False)),
+            ('message_count', _message_count_query(user_id)),
+            ('notified', _notified_query(user_id)),
+            ('notifiers', _notifiers_query(user_id)),
+            ('gnotifiers', _gnotifiers_query(user_id)),
+            ('gnotified', _gnotified_query(user_id)),
+            ('aliases', _aliases_query(user_id)),
+            ('noplayed', _noplayed_query(user_id)),
+            ('censored', _censored_query(user_id)),
+            ('history', _history_query(user_id)),
+            ('adjourned', _adjourned_query(user_id)),
+            ('titles', _titles_query(user_id)),
+            ('ratings', _all_ratings_query(user_id))]]
+
     def user_get_vars(self, user_id, vnames):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, ("SELECT %s" % ','.join(vnames)) +
-            " FROM user WHERE user_id=%s", (user_id,))
+        cursor = self.query(cursor, *_vars_query(user_id, vnames))
         row = cursor.fetchone()
         cursor.close()
         return row
@@ -81,7 +288,7 @@ class DB(object):
 
     def user_get_formula(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT num,f FROM formula WHERE user_id=%s ORDER BY num ASC""", (user_id,))
+        cursor = self.query(cursor, *_formula_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -104,7 +311,7 @@ class DB(object):
 
     def user_get_notes(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT num,txt FROM note WHERE user_id=%s ORDER BY num ASC""", (user_id,))
+        cursor = self.query(cursor, *_notes_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -135,19 +342,16 @@ class DB(object):
 
     def user_get_aliases(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT name,val FROM user_alias WHERE user_id=%s ORDER BY name ASC""", (user_id,))
+        cursor = self.query(cursor, *_aliases_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
 
     def user_get_matching(self, prefix, limit=8):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT user_id,user_name,user_passwd,
-                user_last_logout,user_admin_level,user_email,user_real_name,
-                user_banned,user_muzzled,user_muted,user_ratedbanned,
-                user_playbanned
-            FROM user WHERE user_name LIKE %s""" + " LIMIT %s" % limit,
-                (prefix + '%',))
+        cursor = self.query(cursor, """SELECT %s
+            FROM user WHERE user_name LIKE %%s LIMIT %d""" % (_user_cols,
+                limit), (prefix + '%',))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -370,8 +574,7 @@ class DB(object):
     # channels
     def user_get_channels(self, id):
         cursor = self.db.cursor() #cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT channel_id FROM channel_user
-            WHERE user_id=%s""", (id,))
+        cursor = self.query(cursor, *_channels_query(id))
         rows = cursor.fetchall()
         cursor.close()
         return [r[0] for r in rows]
@@ -499,7 +702,7 @@ class DB(object):
 
     def user_get_titles(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT title_name,title_flag,title_light FROM user_title LEFT JOIN title USING (title_id) WHERE user_id=%s ORDER BY title_id ASC""", (user_id,))
+        cursor = self.query(cursor, *_titles_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -531,14 +734,14 @@ class DB(object):
 
     def user_get_notified(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT user_name FROM user LEFT JOIN user_notify ON (user.user_id=user_notify.notified) WHERE notifier=%s""", (user_id,))
+        cursor = self.query(cursor, *_notified_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
 
     def user_get_notifiers(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT user_name FROM user LEFT JOIN user_notify ON (user.user_id=user_notify.notifier) WHERE notified=%s""", (user_id,))
+        cursor = self.query(cursor, *_notifiers_query(user_id))
         rows = cursor.fetchall()
         return rows
 
@@ -564,18 +767,14 @@ class DB(object):
 
     def user_get_gnotified(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT user_name FROM user
-            LEFT JOIN user_gnotify ON (user.user_id=user_gnotify.gnotified)
-            WHERE gnotifier=%s""", (user_id,))
+        cursor = self.query(cursor, *_gnotified_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
 
     def user_get_gnotifiers(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT user_name FROM user
-            LEFT JOIN user_gnotify ON (user.user_id=user_gnotify.gnotifier)
-            WHERE gnotified=%s""", (user_id,))
+        cursor = self.query(cursor, *_gnotifiers_query(user_id))
         rows = cursor.fetchall()
         return rows
 
@@ -599,7 +798,7 @@ class DB(object):
 
     def user_get_censored(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT user_name FROM user LEFT JOIN censor ON (user.user_id=censor.censored) WHERE censorer=%s""", (user_id,))
+        cursor = self.query(cursor, *_censored_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -624,7 +823,7 @@ class DB(object):
 
     def user_get_noplayed(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT user_name FROM user LEFT JOIN noplay ON (user.user_id=noplay.noplayed) WHERE noplayer=%s""", (user_id,))
+        cursor = self.query(cursor, *_noplayed_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -643,38 +842,6 @@ class DB(object):
         cursor.close()
         return [r[0] for r in rows]
 
-    # eco
-    def get_eco(self, hash):
-        cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT eco,long_ FROM eco WHERE hash=%s""", (hash,))
-        row = cursor.fetchone()
-        cursor.close()
-        return row
-
-    def get_nic(self, hash):
-        cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT nic FROM nic WHERE hash=%s""", (hash,))
-        row = cursor.fetchone()
-        cursor.close()
-        return row
-
-    def look_up_eco(self, eco):
-        cursor = self.db.cursor(cursors.DictCursor)
-        if len(eco) == 3:
-            # match all subvariations
-            eco = '%s%%' % eco
-        cursor = self.query(cursor, """SELECT eco,nic,long_,eco.fen AS fen FROM eco LEFT JOIN nic USING(hash) WHERE eco LIKE %s LIMIT 100""", (eco,))
-        rows = cursor.fetchall()
-        cursor.close()
-        return rows
-
-    def look_up_nic(self, nic):
-        cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT eco,nic,long_,nic.fen AS fen FROM nic LEFT JOIN eco USING(hash) WHERE nic = %s LIMIT 100""", (nic,))
-        rows = cursor.fetchall()
-        cursor.close()
-        return rows
-
     # game
     def game_add(self, white_name, white_rating, black_name, black_rating,
             eco, variant_id, speed_id, time, inc, rated, result, result_reason,
@@ -699,7 +866,8 @@ class DB(object):
                 eco=%(eco)s,variant_id=%(variant_id)s,speed_id=%(speed_id)s,
                 time=%(time)s,inc=%(inc)s,rated=%(rated)s,
                 adjourn_reason=%(adjourn_reason)s,ply_count=%(ply_count)s,
-                movetext=%(movetext)s,when_started=%(when_started)s,
+                movetext=%(movetext)s,compact_moves=%(compact_moves)s,
+                when_started=%(when_started)s,
                 when_adjourned=%(when_adjourned)s""", g)
         adjourn_id = cursor.lastrowid
         cursor.close()
@@ -707,15 +875,7 @@ class DB(object):
 
     def get_adjourned(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT adjourn_id,white_user_id,black_user_id,
-                white.user_name as white_name, black.user_name as black_name
-            FROM adjourned_game
-                LEFT JOIN user AS white
-                    ON (white.user_id = white_user_id)
-                LEFT JOIN user AS black
-                    ON (black.user_id = black_user_id)
-            WHERE white_user_id=%s or black_user_id=%s""",
-            (user_id,user_id))
+        cursor = self.query(cursor, *_adjourned_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -726,8 +886,8 @@ class DB(object):
                 white_clock,black_user_id,black_clock,
                 eco,speed_name,variant_name,
                 clock_name,time,inc,rated,adjourn_reason,ply_count,movetext,
-                when_started,when_adjourned,idn,overtime_move_num,
-                overtime_bonus
+                compact_moves,when_started,when_adjourned,idn,
+                overtime_move_num,overtime_bonus
             FROM adjourned_game LEFT JOIN variant USING(variant_id)
                 LEFT JOIN speed USING(speed_id)
             WHERE (white_user_id=%s AND black_user_id=%s)
@@ -745,14 +905,7 @@ class DB(object):
 
     def user_get_history(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT game_id, num, result_char, user_rating,
-                color_char, opp_name, opp_rating, h.eco, flags, h.time,
-                h.inc, h.result_reason, h.when_ended, movetext, idn
-            FROM history AS h LEFT JOIN game USING(game_id)
-                LEFT JOIN game_idn USING (game_id)
-            WHERE user_id=%s
-            ORDER BY when_ended ASC
-            LIMIT 10""", (user_id,))
+        cursor = self.query(cursor, *_history_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -778,7 +931,7 @@ class DB(object):
 
     def user_get_all_ratings(self, user_id):
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """SELECT variant_id,speed_id,rating,rd,volatility,win,loss,draw,total,best,when_best,ltime FROM rating WHERE user_id=%s""", (user_id,))
+        cursor = self.query(cursor, *_all_ratings_query(user_id))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -854,12 +1007,8 @@ class DB(object):
         return rows
 
     def get_news_since(self, when, is_admin):
-        is_admin = '1' if is_admin else '0'
         cursor = self.db.cursor(cursors.DictCursor)
-        cursor = self.query(cursor, """
-            SELECT news_id,news_title,DATE(news_when) as news_date,news_poster
-            FROM news_index WHERE news_is_admin=%s AND news_when > %s
-            ORDER BY news_id DESC LIMIT 10""", (is_admin,when))
+        cursor = self.query(cursor, *_news_since_query(when, is_admin))
         rows = cursor.fetchall()
         cursor.close()
         return rows
@@ -949,10 +1098,7 @@ class DB(object):
     def get_message_count(self, uid):
         """ Get counts of total and unread messages for a given user. """
         cursor = self.db.cursor()
-        cursor = self.query(cursor, """SELECT COUNT(*),SUM(unread)
-            FROM message
-            WHERE to_user_id=%s""",
-            (uid,))
+        cursor = self.query(cursor, *_message_count_query(uid))
         ret = cursor.fetchone()
         if ret[0] == 0:
             ret = (0, 0)
@@ -1111,6 +1257,105 @@ class DB(object):
         else:
             return None
 
+    def game_iter(self, name=None, batch=1000):
+        """ Yield the stored games in order of id, or only the games
+        played by the given user.  The rows are read through a
+        server-side cursor, a batch at a time, so even the whole table
+        can be walked in constant memory.  The connection cannot be
+        used for anything else until the last row has been read. """
+        cursor = self.db.cursor(cursors.SSDictCursor)
+        query = """SELECT game_id,white_name,white_rating,black_name,
+                black_rating,eco,speed_name,variant_name,clock,time,inc,
+                rated,result,result_reason,ply_count,movetext,
+                when_started,when_ended,fen
+            FROM game LEFT JOIN speed USING(speed_id)
+                LEFT JOIN variant USING(variant_id)
+                LEFT JOIN game_idn USING(game_id)
+                LEFT JOIN chess960_pos USING(idn)"""
+        if name is None:
+            cursor = self.query(cursor, query + """
+                ORDER BY game_id""")
+        else:
+            cursor = self.query(cursor, query + """
+                WHERE white_name=%s OR black_name=%s
+                ORDER BY game_id""", (name, name))
+        try:
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+    # batched writes, used by the journal
+    def game_find(self, g):
+        """ Look for a game that was already added; used when replaying
+        the journal after a crash. """
+        cursor = self.db.cursor()
+        cursor = self.query(cursor, """SELECT game_id FROM game
+            WHERE white_name=%(white_name)s AND black_name=%(black_name)s
+                AND when_started=%(when_started)s
+                AND when_ended=%(when_ended)s""", g)
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def game_add_many(self, games):
+        """ Add several games with one statement and return the id of
+        the first.  The ids of the rows of a multi-row insert into a
+        MyISAM table are consecutive. """
+        cursor = self.db.cursor()
+        cursor = self.query_many(cursor, """INSERT INTO game
+            (white_name,white_rating,black_name,black_rating,eco,
+                variant_id,speed_id,time,inc,rated,result,result_reason,
+                ply_count,movetext,compact_moves,when_started,when_ended)
+            VALUES (%(white_name)s,%(white_rating)s,%(black_name)s,
+                %(black_rating)s,%(eco)s,%(variant_id)s,%(speed_id)s,
+                %(time)s,%(inc)s,%(rated)s,%(result)s,%(result_reason)s,
+                %(ply_count)s,%(movetext)s,%(compact_moves)s,
+                %(when_started)s,%(when_ended)s)""", games)
+        game_id = cursor.lastrowid
+        assert(cursor.rowcount == len(games))
+        cursor.close()
+        return game_id
+
+    def game_add_idn_many(self, rows):
+        cursor = self.db.cursor()
+        cursor = self.query_many(cursor, """REPLACE INTO game_idn
+            (game_id,idn) VALUES (%s,%s)""", rows)
+        cursor.close()
+
+    def user_add_history_many(self, entries):
+        """ Like user_add_history(), but for several entries, which
+        must each have a user_id. """
+        cursor = self.db.cursor()
+        cursor = self.query_many(cursor, """REPLACE INTO history
+            (user_id,game_id,num,result_char,user_rating,color_char,opp_name,
+                opp_rating,eco,flags,time,inc,result_reason,when_ended)
+            VALUES (%(user_id)s,%(game_id)s,%(num)s,%(result_char)s,
+                %(user_rating)s,%(color_char)s,%(opp_name)s,%(opp_rating)s,
+                %(eco)s,%(flags)s,%(time)s,%(inc)s,%(result_reason)s,
+                %(when_ended)s)""", entries)
+        cursor.close()
+
+    def user_set_rating_many(self, rows):
+        """ Like user_set_rating(), but for several ratings, each
+        given as a dict. """
+        cursor = self.db.cursor()
+        cursor = self.query_many(cursor, """INSERT INTO rating
+            (user_id,speed_id,variant_id,rating,rd,volatility,win,loss,draw,
+                total,ltime)
+            VALUES (%(user_id)s,%(speed_id)s,%(variant_id)s,%(rating)s,
+                %(rd)s,%(volatility)s,%(win)s,%(loss)s,%(draw)s,%(total)s,
+                %(ltime)s)
+            ON DUPLICATE KEY UPDATE rating=VALUES(rating),rd=VALUES(rd),
+                volatility=VALUES(volatility),win=VALUES(win),
+                loss=VALUES(loss),draw=VALUES(draw),total=VALUES(total),
+                ltime=VALUES(ltime)""", rows)
+        cursor.close()
+
     def game_add_idn(self, game_id, idn):
         cursor = self.db.cursor()
         cursor = self.query(cursor, """INSERT INTO game_idn VALUES(%s,%s)""",
@@ -1119,15 +1364,114 @@ class DB(object):
 
     def get_server_message(self, name):
         cursor = self.db.cursor()
-        cursor = self.query(cursor, """SELECT server_message_text FROM server_message
-            WHERE server_message_name = %s""", (name,))
+        cursor = self.query(cursor, *_server_message_query(name))
         row = cursor.fetchone()
         cursor.close()
         return row[0]
 
+class AsyncDB(object):
+    """ Runs DB methods in a bounded pool of threads, so that a slow query
+    does not block the reactor.  Each thread has its own connection.
+    Every method of DB can be called on this object, but returns a
+    Deferred that fires with the result instead. """
+    def __init__(self, minthreads, maxthreads):
+        self.local = threading.local()
+        self.threadpool = threadpool.ThreadPool(minthreads, maxthreads,
+            'db')
+        self.running = False
+        # the last Deferred in each chain of serialized calls
+        self._tails = {}
+        reactor.callWhenRunning(self.start)
+
+    def start(self):
+        if not self.running:
+            self.threadpool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+            self.running = True
+
+    def stop(self):
+        if self.running:
+            self.threadpool.stop()
+            self.running = False
+
+    def _get_db(self):
+        """ Get the DB for the current pool thread, connecting
+        if necessary. """
+        try:
+            return self.local.db
+        except AttributeError:
+            self.local.db = DB()
+            return self.local.db
+
+    def _run(self, f, args, kwargs):
+        return f(self._get_db(), *args, **kwargs)
+
+    def run_interaction(self, f, *args, **kwargs):
+        """ Call f(db, *args, **kwargs) in a pool thread, where db is
+        the DB object for that thread.  This is useful for doing several
+        queries in one trip to the pool.  Returns a Deferred. """
+        return threads.deferToThreadPool(reactor, self.threadpool,
+            self._run, f, args, kwargs)
+
+    def run_serial(self, key, f, *args, **kwargs):
+        """ Like run_interaction(), but calls with the same key are run
+        one at a time, in the order they were made.  This is for writes
+        whose order matters, such as two updates of the same row. """
+        prev = self._tails.get(key)
+        if prev is None:
+            d = self.run_interaction(f, *args, **kwargs)
+        else:
+            d = defer.Deferred()
+            def go(ignored):
+                self.run_interaction(f, *args, **kwargs).chainDeferred(d)
+            prev.addCallback(go)
+        tail = defer.Deferred()
+        self._tails[key] = tail
+        def done(result):
+            if self._tails.get(key) is tail:
+                del self._tails[key]
+            tail.callback(None)
+            return result
+        d.addBoth(done)
+        return d
+
+    def serial(self, key):
+        """ Get an object whose DB methods are run with run_serial(),
+        for example adb.serial(user.name).user_log(...). """
+        return _SerialDB(self, key)
+
+    def __getattr__(self, name):
+        meth = getattr(DB, name)
+        def run(*args, **kwargs):
+            return self.run_interaction(meth, *args, **kwargs)
+        run.__name__ = name
+        return run
+
+class _SerialDB(object):
+    def __init__(self, adb, key):
+        self.adb = adb
+        self.key = key
+
+    def __getattr__(self, name):
+        meth = getattr(DB, name)
+        def run(*args, **kwargs):
+            return self.adb.run_serial(self.key, meth, *args, **kwargs)
+        run.__name__ = name
+        return run
+
+def log_error(failure, what='database query'):
+    """ An errback for Deferreds returned by AsyncDB whose results
+    nobody waits for. """
+    print('error in %s: %s' % (what, failure.getTraceback()))
+
 try:
     db
 except NameError:
     db = DB()
 
+try:
+    adb
+except NameError:
+    adb = AsyncDB(config.db_pool_min, config.db_pool_max)
+
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
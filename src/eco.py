@@ -0,0 +1,194 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" The ECO and NIC opening books, kept in memory and indexed by the
+Zobrist hash of each position. """
+
+import re
+
+import variant.chess
+
+eco_file = 'data/scid.epd'
+nic_file = 'data/nic999.idx'
+
+# positions after this ply are not looked up
+MAX_PLY = 36
+
+_eco_re = re.compile(r'(.+) +eco +([A-Z]\d\d\S*) +(.+);')
+_nic_fen_re = re.compile(r'\S+ \S+ \S+ \S+')
+_nic_re = re.compile(r'([A-Z][A-Z]\.\d\d)\*?')
+
+def read_eco_file(path=eco_file):
+    """ Read an EPD file of ECO codes, as made by scid's eco2epd tool,
+    yielding (fen, eco, long_) for each position. """
+    for line in open(path, 'r'):
+        line = line.decode('iso-8859-1').encode('utf-8')
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        m = _eco_re.match(line)
+        if not m:
+            raise RuntimeError('failed to match: %s' % line)
+        yield (m.group(1), m.group(2), m.group(3))
+
+def read_nic_file(path=nic_file):
+    """ Read a file of NIC codes, which alternates lines of FEN and
+    codes, yielding (fen, nic) for each position. """
+    fen = None
+    for line in open(path, 'r'):
+        line = line.strip()
+        if fen is None:
+            assert(_nic_fen_re.match(line))
+            fen = line
+        else:
+            m = _nic_re.match(line)
+            if not m:
+                raise RuntimeError('failed to match %s' % line)
+            yield (fen, m.group(1))
+            fen = None
+
+def fen_hash(fen):
+    """ The hash of a position given in the (4-field) FEN of the
+    opening files. """
+    return variant.chess.Position(fen + ' 0 1').hash
+
+class OpeningBook(object):
+    def __init__(self):
+        # each row is a tuple (hash, code, fen, long_), and
+        # the indexes map hashes to positions in the lists of rows
+        self._eco_rows = []
+        self._eco_index = {}
+        self._nic_rows = []
+        self._nic_index = {}
+        # map lower-case codes to lists of row numbers, for look_up_*()
+        self._eco_codes = {}
+        self._nic_codes = {}
+
+    def load(self, eco_path=eco_file, nic_path=nic_file):
+        for (fen, eco, long_) in read_eco_file(eco_path):
+            self._add(self._eco_rows, self._eco_index, self._eco_codes,
+                (fen_hash(fen), eco, fen, long_))
+        for (fen, nic) in read_nic_file(nic_path):
+            self._add(self._nic_rows, self._nic_index, self._nic_codes,
+                (fen_hash(fen), nic, fen, None))
+
+    def _add(self, rows, index, codes, row):
+        (hash_, code) = row[0:2]
+        if hash_ in index:
+            raise RuntimeError('duplicate position for %s' % code)
+        index[hash_] = len(rows)
+        codes.setdefault(code.lower(), []).append(len(rows))
+        rows.append(row)
+
+    def get_eco(self, hash_):
+        """ Return (eco, long_) for a position, or None. """
+        i = self._eco_index.get(hash_)
+        if i is None:
+            return None
+        row = self._eco_rows[i]
+        return (row[1], row[3])
+
+    def get_nic(self, hash_):
+        """ Return the NIC code for a position, or None. """
+        i = self._nic_index.get(hash_)
+        if i is None:
+            return None
+        return self._nic_rows[i][1]
+
+    def look_up_eco(self, eco):
+        """ Find the positions with an ECO code; a 3-character code
+        also matches all subvariations. """
+        eco = eco.lower()
+        if len(eco) == 3:
+            nums = []
+            for code in sorted(c for c in self._eco_codes
+                    if c.startswith(eco)):
+                nums += self._eco_codes[code]
+            nums.sort()
+        else:
+            nums = self._eco_codes.get(eco, [])
+        ret = []
+        for i in nums[:100]:
+            (hash_, code, fen, long_) = self._eco_rows[i]
+            ret.append({'eco': code, 'nic': self.get_nic(hash_),
+                'long_': long_, 'fen': fen})
+        return ret
+
+    def look_up_nic(self, nic):
+        """ Find the positions with a NIC code. """
+        ret = []
+        for i in self._nic_codes.get(nic.lower(), [])[:100]:
+            (hash_, code, fen, long_) = self._nic_rows[i]
+            eco = self.get_eco(hash_)
+            ret.append({'eco': eco[0] if eco else None, 'nic': code,
+                'long_': eco[1] if eco else None, 'fen': fen})
+        return ret
+
+class OpeningClassifier(object):
+    """ Follows the positions of one game and remembers which ones are
+    in the opening books, so the opening is known without searching
+    when the game ends.  Plies that are taken back or replaced are
+    noticed by comparing hashes. """
+    def __init__(self, book):
+        self.book = book
+        # map from ply to (hash, eco row or None, nic or None)
+        self.plies = {}
+
+    def update(self, pos):
+        last = min(pos.ply, MAX_PLY)
+        for ply in range(pos.start_ply, last + 1):
+            hash_ = pos.history.get_hash(ply)
+            ent = self.plies.get(ply)
+            if ent is None or ent[0] != hash_:
+                self.plies[ply] = (hash_, self.book.get_eco(hash_),
+                    self.book.get_nic(hash_))
+
+    def _deepest(self, pos, which):
+        self.update(pos)
+        ply = min(pos.ply, MAX_PLY)
+        while ply >= pos.start_ply:
+            val = self.plies[ply][which]
+            if val is not None:
+                return (ply, val)
+            ply -= 1
+        return None
+
+    def get_eco(self, pos):
+        """ Return (ply, eco, long_) for the deepest book position
+        of the game. """
+        ret = self._deepest(pos, 1)
+        if ret is None:
+            return (0, 'A00', 'Unknown')
+        (ply, (eco, long_)) = ret
+        return (ply, eco, long_)
+
+    def get_nic(self, pos):
+        """ Return (ply, nic) for the deepest book position of
+        the game. """
+        ret = self._deepest(pos, 2)
+        if ret is None:
+            return (0, '-----')
+        return ret
+
+try:
+    book
+except NameError:
+    book = OpeningBook()
+    book.load()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -17,14 +17,20 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import copy
 import datetime
 
 import speed_variant
 import clock
 
-from game import Game
+from game import Game, stored_moves
+from online import online
 from game_constants import *
 
+# plies between the snapshots of the position kept for jumping around
+# in a game
+SNAPSHOT_INTERVAL = 16
+
 class ExaminedGame(Game):
     def __init__(self, user, hist_game=None):
         self.gtype = EXAMINED
@@ -42,7 +48,11 @@ class ExaminedGame(Game):
             user, user)
         assert(user.session.game is None)
         user.session.game = self
+        online.update_seek_sets(user)
         self.when_started = datetime.datetime.utcnow()
+        # copies of the position after every SNAPSHOT_INTERVAL plies
+        # of self.moves, by ply, made as we first pass them
+        self.snapshots = {}
 
         if hist_game is None:
             self.speed_variant = speed_variant.from_names('untimed', 'chess')
@@ -60,7 +70,7 @@ class ExaminedGame(Game):
             self.speed_variant = speed_variant.from_names('untimed',
                 variant_name)
             self.variant = speed_variant.variant_class[self.speed_variant.variant.name](self)
-            self.moves = hist_game['movetext'].split(' ')
+            self.moves = stored_moves(hist_game)
             self.white_name = hist_game['white_name']
             self.black_name = hist_game['black_name']
             self.result_code = hist_game['result']
@@ -81,29 +91,55 @@ class ExaminedGame(Game):
             p.nwrite_('Game %d: %s goes forward %d move.\n',
                 'Game %d: %s goes forward %d moves.\n', n,
                 (self.number, conn.user.name, n))
-        for i in range(0, n):
-            san = self.moves[self.variant.pos.ply]
-            mv = self.variant.pos.move_from_castle(san)
-            if not mv:
-                mv = self.variant.pos.move_from_san(san)
-            if not mv:
-                print 'internal error: failed to parse move %s' % san
-            assert(mv)
-            mv.time = 0.0
-            self.variant.do_move(mv)
-            if self.variant.pos.ply >= len(self.moves):
-                # end of the game
-                break
+        self._goto_ply(min(self.variant.pos.ply + n, len(self.moves)))
+        self.send_boards()
+        self._check_end()
+
+    def goto(self, ply, conn):
+        if ply < 0 or ply > len(self.moves):
+            conn.write(_('There is no position after %(ply)d moves; the game has %(count)d moves.\n') %
+                {'ply': ply, 'count': len(self.moves)})
+            return
+        for p in self.players | self.observers:
+            p.write_('Game %d: %s goes to move %d.\n',
+                (self.number, conn.user.name, ply))
+        self._goto_ply(ply)
         self.send_boards()
+        self._check_end()
+
+    def _check_end(self):
         #self._check_result()
         # Trust the stored result, rather than using mates we detected,
         # ourselves, since we can't compute things like resignation and
         # agreed draws.
-        if self.variant.pos.ply >= len(self.moves):
-            assert(self.result_code)
+        if self.variant.pos.ply >= len(self.moves) and self.result_code:
             self.result(self._result_msg(self.result_reason, self.result_code),
                 self.result_code)
 
+    def _goto_ply(self, ply):
+        """ Set the position to the one after the given number of plies
+        of self.moves, without sending any boards.  Moves are undone
+        or replayed from the current position, or from the nearest
+        snapshot when that is closer. """
+        assert(0 <= ply <= len(self.moves))
+        snap_ply = ply - ply % SNAPSHOT_INTERVAL
+        if snap_ply in self.snapshots and (self.variant.pos.ply < snap_ply
+                or self.variant.pos.ply - ply > ply - snap_ply):
+            self.variant.pos = copy.deepcopy(self.snapshots[snap_ply])
+        while self.variant.pos.ply > ply:
+            self.variant.undo_move()
+        while self.variant.pos.ply < ply:
+            # stored moves are (code, SAN) pairs or SAN; see
+            # stored_moves()
+            mv = self.variant.parse_stored_move(
+                self.moves[self.variant.pos.ply])
+            mv.time = 0.0
+            self.variant.do_move(mv)
+            cur_ply = self.variant.pos.ply
+            if (cur_ply % SNAPSHOT_INTERVAL == 0 and
+                    cur_ply not in self.snapshots):
+                self.snapshots[cur_ply] = copy.deepcopy(self.variant.pos)
+
     def _result_msg(self, reason, result_code):
         """ Convert an abbreviation for a result (like "Res") to a reason
         ("White resigns") """
@@ -147,8 +183,7 @@ class ExaminedGame(Game):
             p.nwrite_('Game %d: %s backs up %d move.\n',
                 'Game %d: %s backs up %d moves.\n', n,
                 (self.number, conn.user.name, n))
-        for i in range(0, n):
-            self.variant.undo_move()
+        self._goto_ply(max(self.variant.pos.ply - n, 0))
         self.send_boards()
 
     def _check_result(self):
@@ -188,6 +223,7 @@ class ExaminedGame(Game):
 
         self.players.add(u)
         u.session.game = self
+        online.update_seek_sets(u)
         conn.write(_('%(name)s is now an examiner of game %(num)d.\n') %
             {'name': u.name, 'num': self.number})
         u.write_('\n%(name)s has made you an examiner of game %(num)d.\n',
@@ -213,8 +249,13 @@ class ExaminedGame(Game):
         return True
 
     def next_move(self, mv, conn):
-        self.moves = self.moves[0:self.variant.pos.ply]
-        self.moves.append(mv.to_san())
+        # the move has been made; the rest of the old line is gone
+        ply = self.variant.pos.ply
+        self.moves = self.moves[0:ply - 1]
+        self.moves.append((mv.to_compact(), mv.to_san()))
+        for snap_ply in self.snapshots.keys():
+            if snap_ply >= ply:
+                del self.snapshots[snap_ply]
         #self.variant.pos.get_last_move().time = 0.0
         assert(self.variant.pos.get_last_move() == mv)
         mv.time = 0.0
@@ -227,6 +268,7 @@ class ExaminedGame(Game):
         self.players.remove(user)
         assert(user.session.game == self)
         user.session.game = None
+        online.update_seek_sets(user)
         # user may be offline if he or she disconnected unexpectedly
         if user.is_online:
             user.write_('You are no longer examining game %d.\n', self.number)
@@ -246,5 +288,6 @@ class ExaminedGame(Game):
         for p in self.players:
             assert(user.session.game == self)
             p.session.game = None
+            online.update_seek_sets(p)
 
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
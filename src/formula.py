@@ -27,11 +27,18 @@ Terminology:
     led = left denotation
     lbp = left binding power
 
+Formulas are compiled once into a tree of closures, each taking the
+challenge being checked and returning a value, and the compiled formulas
+are cached by their text.  Changing a formula variable changes its text,
+so the old compiled form is simply no longer looked up.
+
 Kudos to Dave Herscovici for the excellent original FICS implementation
 of formulas, which I tried to emulate.
 """
 import re
 
+from game_constants import WHITE, BLACK
+
 all_tokens = {}
 
 class FormulaError(Exception):
@@ -41,10 +48,11 @@ class FormulaError(Exception):
 
 class Symbol(object):
     tokens = []
-    def nud(self):
+    lbp = 0
+    def nud(self, p):
         raise FormulaError('unexpected use as unary operator')
 
-    def led(self, left):
+    def led(self, p, left):
         raise FormulaError('unexpected use as binary operator')
 
 class Token(object):
@@ -55,273 +63,259 @@ class Token(object):
         for tok in self.tokens:
             all_tokens[tok] = cls
         cls.tokens = self.tokens
-        def new_cls(*args):
-            cls(*args)
-        return new_cls
+        return cls
 
 class NumSymbol(Symbol):
     def __init__(self, val):
         self.val = val
-    def nud(self):
-        return self.val
-
-def advance(sym):
-    global token
-    if sym not in token.tokens:
-        raise FormulaError('expected %s' % sym)
-    token = nextt()
+    def nud(self, p):
+        val = self.val
+        return lambda chal: val
 
 @Token(['!'])
 class NotSymbol(Symbol):
     lbp = 90
-    def nud(self):
-        return not expression(90)
+    def nud(self, p):
+        right = p.expression(90)
+        return lambda chal: not right(chal)
 
 @Token(['*'])
 class MultSymbol(Symbol):
     lbp = 80
-    def led(self, left):
-        right = expression(80)
-        return left * right
+    def led(self, p, left):
+        right = p.expression(80)
+        return lambda chal: left(chal) * right(chal)
 
 @Token(['/'])
 class DivSymbol(Symbol):
     lbp = 80
-    def led(self, left):
-        right = expression(80)
-        if right == 0:
-            right = .001 # fudge factor
-        return left // right
+    def led(self, p, left):
+        right = p.expression(80)
+        def div(chal):
+            l = left(chal)
+            r = right(chal)
+            if r == 0:
+                r = .001 # fudge factor
+            return l // r
+        return div
 
 @Token(['+'])
 class AddSymbol(Symbol):
     lbp = 70
-    def nud(self):
+    def nud(self, p):
         # unary + has higher precedence
-        return expression(90)
-    def led(self, left):
-        right = expression(70)
-        return left + right
+        return p.expression(90)
+    def led(self, p, left):
+        right = p.expression(70)
+        return lambda chal: left(chal) + right(chal)
 
 @Token(['-'])
 class SubSymbol(Symbol):
     lbp = 70
-    def nud(self):
+    def nud(self, p):
         # unary - has higher precedence
-        return -expression(90)
-    def led(self, left):
-        right = expression(70)
-        return left - right
+        right = p.expression(90)
+        return lambda chal: -right(chal)
+    def led(self, p, left):
+        right = p.expression(70)
+        return lambda chal: left(chal) - right(chal)
 
 @Token(['<'])
 class LTSymbol(Symbol):
     lbp = 60
-    def led(self, left):
-        right = expression(60)
-        return left < right
+    def led(self, p, left):
+        right = p.expression(60)
+        return lambda chal: left(chal) < right(chal)
 
 @Token(['<=', '=<'])
 class LTESymbol(Symbol):
     lbp = 60
-    def led(self, left):
-        right = expression(60)
-        return left <= right
+    def led(self, p, left):
+        right = p.expression(60)
+        return lambda chal: left(chal) <= right(chal)
 
 @Token(['>'])
 class GTSymbol(Symbol):
     lbp = 60
-    def led(self, left):
-        right = expression(60)
-        return left > right
+    def led(self, p, left):
+        right = p.expression(60)
+        return lambda chal: left(chal) > right(chal)
 
 @Token(['>=', '=>'])
 class GTESymbol(Symbol):
     lbp = 60
-    def led(self, left):
-        right = expression(60)
-        return left >= right
+    def led(self, p, left):
+        right = p.expression(60)
+        return lambda chal: left(chal) >= right(chal)
 
 @Token(['=', '=='])
 class EqSymbol(Symbol):
     lbp = 50
-    def led(self, left):
-        right = expression(50)
-        return left == right
+    def led(self, p, left):
+        right = p.expression(50)
+        return lambda chal: left(chal) == right(chal)
 
 @Token(['!=', '<>'])
 class NeqSymbol(Symbol):
     lbp = 40
-    def led(self, left):
-        right = expression(40)
-        return left != right
+    def led(self, p, left):
+        right = p.expression(40)
+        return lambda chal: left(chal) != right(chal)
 
 @Token(['&', '&&', 'and'])
 class AndSymbol(Symbol):
     lbp = 30
-    def led(self, left):
-        right = expression(30)
-        return left and right
+    def led(self, p, left):
+        right = p.expression(30)
+        return lambda chal: left(chal) and right(chal)
 
 @Token(['|', '||', 'or'])
 class OrSymbol(Symbol):
     lbp = 20
-    def led(self, left):
-        right = expression(20)
-        return left or right
+    def led(self, p, left):
+        right = p.expression(20)
+        return lambda chal: left(chal) or right(chal)
 
 @Token(['('])
 class LParenSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        expr = expression(0)
-        advance(')')
+    def nud(self, p):
+        expr = p.expression(0)
+        p.advance(')')
         return expr
 
 @Token([')'])
 class RParenSymbol(Symbol):
-    lbp = 0
+    pass
 
 class EndSymbol(Symbol):
-    lbp = 0
+    pass
 
 @Token(['abuser'])
 class AbuserSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.a.has_title('abuser') if chal else None
+    def nud(self, p):
+        return lambda chal: chal.a.has_title('abuser')
 
 @Token(['computer'])
 class ComputerSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.a.has_title('computer') if chal else None
+    def nud(self, p):
+        return lambda chal: chal.a.has_title('computer')
 
 @Token(['time'])
 class TimeSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.time if chal else None
+    def nud(self, p):
+        return lambda chal: chal.time
 
 @Token(['inc'])
 class IncSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.inc if chal else None
+    def nud(self, p):
+        return lambda chal: chal.inc
 
 @Token(['rating'])
 class RatingSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return int(chal.a.get_rating(chal.speed_variant)) if chal else None
+    def nud(self, p):
+        return lambda chal: int(chal.a.get_rating(chal.speed_variant))
 
 @Token(['myrating'])
 class MyratingSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return int(chal.b.get_rating(chal.speed_variant)) if chal else None
+    def nud(self, p):
+        return lambda chal: int(chal.b.get_rating(chal.speed_variant))
 
 @Token(['ratingdiff'])
 class RatingdiffSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return (int(chal.a.get_rating(chal.speed_variant)) -
-            int(chal.b.get_rating(chal.speed_variant))) if chal else None
+    def nud(self, p):
+        return lambda chal: (int(chal.a.get_rating(chal.speed_variant)) -
+            int(chal.b.get_rating(chal.speed_variant)))
 
 @Token(['white'])
 class WhiteSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.side == WHITE if chal else None
+    def nud(self, p):
+        return lambda chal: chal.side == WHITE
 
 @Token(['black'])
 class BlackSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.side == BLACK if chal else None
+    def nud(self, p):
+        return lambda chal: chal.side == BLACK
 
 @Token(['nocolor'])
 class NocolorSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return (chal.side not in [WHITE, BLACK]) if chal else None
+    def nud(self, p):
+        return lambda chal: chal.side not in [WHITE, BLACK]
 
 @Token(['slow'])
-class StandardSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.speed_name == 'slow' if chal else None
+class SlowSymbol(Symbol):
+    def nud(self, p):
+        return lambda chal: chal.speed_name == 'slow'
 
 @Token(['standard'])
 class StandardSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.speed_name == 'standard' if chal else None
+    def nud(self, p):
+        return lambda chal: chal.speed_name == 'standard'
 
 @Token(['blitz'])
 class BlitzSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.speed_name == 'blitz' if chal else None
+    def nud(self, p):
+        return lambda chal: chal.speed_name == 'blitz'
 
 @Token(['lightning'])
 class LightningSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.speed_name == 'lightning' if chal else None
+    def nud(self, p):
+        return lambda chal: chal.speed_name == 'lightning'
 
 @Token(['registered'])
 class RegisteredSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return (0 if chal.a.is_guest else 1) if chal else None
+    def nud(self, p):
+        return lambda chal: 0 if chal.a.is_guest else 1
 
 @Token(['timeseal'])
 class TimesealSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.a.has_timeseal() if chal else None
+    def nud(self, p):
+        return lambda chal: chal.a.has_timeseal()
 
 @Token(['crazyhouse'])
 class CrazyhouseSymbol(Symbol):
-    lbp = 0
-    def nud(self):
-        return chal.variant.name == 'crazyhouse' if chal else None
+    def nud(self, p):
+        return lambda chal: chal.variant.name == 'crazyhouse'
 
 class FSymbol(Symbol):
-    lbp = 0
     def __init__(self, num):
         self.num = num
-    def nud(self):
-        global token, nextt, chal, f_num
-        if self.num <= f_num:
+    def nud(self, p):
+        if self.num <= p.num:
             raise FormulaError('A formula variable may not refer to itself or an earlier formula variable')
-        if not chal:
-            # no need to evaluate
-            return None
-        old_token = token
-        old_nextt = nextt
-        ret = check_formula(chal, chal.b.vars['f' + str(self.num)], self.num)
-        token = old_token
-        nextt = old_nextt
-        return ret
-
-def expression(rbp = 0):
-    global token, nextt
-    t = token
-    try:
-        token = nextt()
-    except StopIteration:
-        # consider an empty formula to be 1
-        if rbp == 0:
-            return 1
-        else:
-            raise FormulaError('unexpected end of formula')
-    left = t.nud()
-    while rbp < token.lbp:
-        t = token
-        token = nextt()
-        left = t.led(left)
-    return left
+        # The variable is looked up when the formula is evaluated, since
+        # it belongs to the user whose formula is being checked.
+        num = self.num
+        name = 'f' + str(num)
+        return lambda chal: check_formula(chal, chal.b.vars[name], num)
+
+class Parser(object):
+    """ The state of parsing one formula. """
+    def __init__(self, s, num):
+        self.num = num
+        self.nextt = tokenize(s).next
+        self.token = self.nextt()
+
+    def advance(self, sym):
+        if sym not in self.token.tokens:
+            raise FormulaError('expected %s' % sym)
+        self.token = self.nextt()
+
+    def expression(self, rbp=0):
+        t = self.token
+        try:
+            self.token = self.nextt()
+        except StopIteration:
+            # consider an empty formula to be 1
+            if rbp == 0:
+                return lambda chal: 1
+            else:
+                raise FormulaError('unexpected end of formula')
+        left = t.nud(self)
+        while rbp < self.token.lbp:
+            t = self.token
+            self.token = self.nextt()
+            left = t.led(self, left)
+        return left
 
 escaped_re = re.compile(r'([*+()|])')
 def re_escape(s):
@@ -365,10 +359,33 @@ def tokenize(s):
         raise FormulaError('Error parsing formula')
     yield EndSymbol()
 
-def check_formula(chal_, s, num=0):
-    """ Check whether the challenge CHAL_ meets the formula described by S.
-    If chal_ is None, we parse the formula for validity but don't worry
-    about its evaulation.
+# compiled formulas, keyed by (text, num)
+_compiled = {}
+_max_compiled = 10000
+
+def compile_formula(s, num=0):
+    """ Compile the formula S into a function that takes a challenge and
+    returns the value of the formula for it.  NUM is 0 for the main
+    formula var, 1 for f1, 2 for f2, etc.
+
+    Raises FormulaError if the formula is not valid.
+    """
+    key = (s, num)
+    try:
+        return _compiled[key]
+    except KeyError:
+        pass
+    f = Parser(s, num).expression()
+    if len(_compiled) >= _max_compiled:
+        # formulas that are still in use will be compiled again
+        _compiled.clear()
+    _compiled[key] = f
+    return f
+
+def check_formula(chal, s, num=0):
+    """ Check whether the challenge CHAL meets the formula described by S.
+    If chal is None, we compile the formula to check its validity but
+    don't evaluate it.
 
     NUM is 0 for the main formula var, 1 for f1, 2 for f2, etc.
 
@@ -378,22 +395,17 @@ def check_formula(chal_, s, num=0):
         # no formula
         return 1
     assert(type(s) == str)
-    global token, nextt, chal, f_num
-    chal = chal_
-    try:
-        nextt = tokenize(s).next
-    except StopIteration:
-        raise FormulaError('got formula with no tokens')
-    f_num = num
-    token = nextt()
-    return expression()
+    f = compile_formula(s, num)
+    if chal is None:
+        return None
+    return f(chal)
 
 if __name__ == '__main__':
-    print(check_formula(None, '7 * (3 * (3 + 2) /  2) - 42 * 2'))
-    print(check_formula(None, '(2 + 5 * 5) - 1'))
-    print(check_formula(None, '(2 + 5 * 5) - 1'))
-    print(check_formula(None, '!lightning && !blitz'))
-    print(check_formula(None, '1000 <= 1500 and 1500 <= 2000'))
+    print(compile_formula('7 * (3 * (3 + 2) /  2) - 42 * 2')(None))
+    print(compile_formula('(2 + 5 * 5) - 1')(None))
+    print(compile_formula('(2 + 5 * 5) - 1')(None))
+    print(compile_formula('1000 <= 1500 and 1500 <= 2000')(None))
+    check_formula(None, '!lightning && !blitz')
     try:
         print(check_formula(None, '33-'))
     except FormulaError:
@@ -28,9 +28,13 @@ import clock
 import history
 import time_format
 import variant
+import eco
+
+from variant.base_variant import decode_compact
 
 from db import db
 from online import online
+from broadcast import Broadcast
 from game_constants import *
 
 games = {}
@@ -45,6 +49,18 @@ def find_free_slot():
             return i
         i += 1
 
+def stored_moves(row):
+    """ The moves of a stored game, from a game or adjourned_game row
+    or a history entry.  If it has compact moves, each is a (code, SAN)
+    pair; games stored before there were compact moves give just SAN.
+    Either kind can be passed to the variant's parse_stored_move(). """
+    sans = row['movetext'].split(' ') if row['movetext'] else []
+    if row.get('compact_moves') is not None:
+        codes = decode_compact(row['compact_moves'])
+        if len(codes) == len(sans):
+            return zip(codes, sans)
+    return sans
+
 def from_name_or_number(arg, conn):
     g = None
     try:
@@ -73,6 +89,7 @@ class Game(object):
         self.observers = set()
         self.pending_offers = []
         self.bug_link = None
+        self.opening = eco.OpeningClassifier(eco.book)
 
         # (silently) remove each player's seeks
         for p in self.players:
@@ -187,23 +204,40 @@ class Game(object):
                         off.decline(notify=False)
 
     def send_boards(self):
+        # users who see the board the same way share the rendered string
+        cache = {}
         for p in self.players:
-            self.send_board(p)
+            self.send_board(p, cache=cache)
         for u in self.observers:
-            self.send_board(u)
+            self.send_board(u, cache=cache)
 
-    def send_board(self, u, isolated=False):
+    def send_board(self, u, isolated=False, cache=None):
+        """ Send the current board to a user.  CACHE, if given, maps
+        the parts of a board that depend on the user to boards already
+        rendered for this position. """
         if u.vars['style'] == 12:
             if (self.gtype == PLAYED and self.variant.name == 'chess' and
                     u.session.ivars['compressmove'] and
                     self.variant.pos.get_last_move() is not None and
                     not isolated):
-                u.write_nowrap(self.variant.to_deltaboard(u))
+                key = ('d1',)
             else:
-                u.write_nowrap(self.variant.to_style12(u))
+                key = (12,) + self.variant.style12_view(u)
         else:
             # style 1, the default
-            u.write_nowrap(self.variant.to_style1(u))
+            key = (1,) + self.variant.style1_view(u)
+
+        s = cache.get(key) if cache is not None else None
+        if s is None:
+            if key[0] == 'd1':
+                s = self.variant.to_deltaboard(u)
+            elif key[0] == 12:
+                s = self.variant.render_style12(*key[1:])
+            else:
+                s = self.variant.render_style1(*key[1:])
+            if cache is not None:
+                cache[key] = s
+        u.write_nowrap(s)
 
     def __eq__(self, other):
         return self.number == other.number
@@ -212,6 +246,7 @@ class Game(object):
         return self.number
 
     def next_move(self, mv, conn):
+        self.opening.update(self.variant.pos)
         self.send_boards()
 
     def get_user_side(self, user):
@@ -267,34 +302,10 @@ class Game(object):
         del games[self.number]
 
     def get_eco(self):
-        i = min(self.variant.pos.ply, 36)
-        row = None
-        while i >= self.variant.pos.start_ply:
-            hash_ = self.variant.pos.history.get_hash(i)
-            row = db.get_eco(hash_)
-            if row:
-                break
-            i -= 1
-        if row:
-            ret = (i, row['eco'], row['long_'])
-        else:
-            ret = (0, 'A00', 'Unknown')
-        return ret
+        return self.opening.get_eco(self.variant.pos)
 
     def get_nic(self):
-        i = min(self.variant.pos.ply, 36)
-        row = None
-        while i >= self.variant.pos.start_ply:
-            hash_ = self.variant.pos.history.get_hash(i)
-            row = db.get_nic(hash_)
-            if row:
-                break
-            i -= 1
-        if row:
-            ret = (i, row['nic'])
-        else:
-            ret = (0, '-----')
-        return ret
+        return self.opening.get_nic(self.variant.pos)
 
     def get_movetext(self):
         i = self.variant.pos.start_ply
@@ -306,6 +317,9 @@ class Game(object):
         ret = ' '.join(moves)
         return ret
 
+    def get_compact_moves(self):
+        return self.variant.get_compact_moves()
+
     def get_ply_count(self):
         return self.variant.pos.ply - self.variant.pos.start_ply
 
@@ -493,10 +507,10 @@ class PlayedGame(Game):
         self.variant = speed_variant.variant_class[self.speed_variant.variant.name](self)
         # play the stored moves for an adjourned game
         if chal.adjourned:
-            moves = chal.adjourned['movetext'].split(' ')
+            moves = stored_moves(chal.adjourned)
             assert(len(moves) == chal.adjourned['ply_count'])
-            for san_mv in moves:
-                mv = self.variant.pos.move_from_san(san_mv)
+            for m in moves:
+                mv = self.variant.parse_stored_move(m)
                 mv.time = 0.0 # XXX
                 self.variant.do_move(mv)
 
@@ -504,6 +518,8 @@ class PlayedGame(Game):
         assert(self.black.session.game is None)
         self.white.session.game = self
         self.black.session.game = self
+        online.update_seek_sets(self.white)
+        online.update_seek_sets(self.black)
 
         self.white.session.last_opp = self.black
         self.black.session.last_opp = self.white
@@ -521,21 +537,23 @@ class PlayedGame(Game):
         gnotified -= set([p.name for p in self.players])
 
         # notify players, unless they are one of the players of this game
+        # using info_str doesn't quite work, since original
+        # fics inserts "vs." into the game notification
+        #u.write_('\nGame notification: %s: Game %d\n' % (
+        #    self.info_str, self.number))
+        b = Broadcast('\nGame notification: %s (%s) vs. %s (%s) %s %s %d %d: Game %d\n' % (
+            self.white_name, self.white_rating, self.black_name,
+            self.black_rating, self.rated_str, self.speed_variant,
+            self.white_time, self.inc, self.number), translate=False)
         for un in gnotified:
             u = online.find_exact(un)
             if u:
-                # using info_str doesn't quite work, since original
-                # fics inserts "vs." into the game notification
-                #u.write_('\nGame notification: %s: Game %d\n' % (
-                #    self.info_str, self.number))
-                u.write('\nGame notification: %s (%s) vs. %s (%s) %s %s %d %d: Game %d\n' % (
-                    self.white_name, self.white_rating, self.black_name,
-                    self.black_rating, self.rated_str, self.speed_variant,
-                    self.white_time, self.inc, self.number))
+                b.send(u)
 
         # notify users with the gin variable set
+        b = Broadcast(create_str_2, translate=False, wrap=False)
         for u in online.gin_var:
-            u.write_nowrap(create_str_2)
+            b.send(u)
 
         p = self.get_user_to_move()
         if p.has_timeseal():
@@ -636,7 +654,9 @@ class PlayedGame(Game):
         self.clock_name = chal.clock_name
         self.clock = clock.clock_names[chal.clock_name](self,
             self.initial_secs, self.initial_secs)
-        self.when_started = datetime.datetime.utcnow()
+        # whole seconds, as the database stores them, so that replaying
+        # the journal can find games that were already written
+        self.when_started = datetime.datetime.utcnow().replace(microsecond=0)
 
     def _pick_color(self, a, b):
         """ Choose the color allocation for two players by comparing the
@@ -790,15 +810,16 @@ class PlayedGame(Game):
             u.write(self.gameinfo_str)
 
     def result(self, msg, result_code):
-        self.when_ended = datetime.datetime.utcnow()
+        self.when_ended = datetime.datetime.utcnow().replace(microsecond=0)
         line = '\n{Game %d (%s vs. %s) %s} %s\n' % (self.number,
             self.white_name, self.black_name, msg, result_code)
-        self.white.write_nowrap(line)
-        self.black.write_nowrap(line)
+        b = Broadcast(line, translate=False, wrap=False)
+        b.send(self.white)
+        b.send(self.black)
         for u in self.observers:
-            u.write_nowrap(line)
+            b.send(u)
         for u in online.gin_var:
-            u.write_nowrap(line)
+            b.send(u)
 
         self.clock.stop()
         self.is_active = False
@@ -901,6 +922,7 @@ class PlayedGame(Game):
             #'black_rating': int(self.black_rating),
             'black_clock': self.clock.get_black_time(),
             'movetext': self.get_movetext(),
+            'compact_moves': self.get_compact_moves(),
             'eco': self.get_eco()[1],
             'ply_count': self.get_ply_count(),
             'variant_id': self.speed_variant.variant.id_,
@@ -930,6 +952,8 @@ class PlayedGame(Game):
         assert(self.black.session.game == self)
         self.white.session.game = None
         self.black.session.game = None
+        online.update_seek_sets(self.white)
+        online.update_seek_sets(self.black)
 
     '''def __getitem__(self, key):
         """ Used to make game objects subscriptable, so they can
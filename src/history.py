@@ -16,7 +16,7 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from db import db
+from journal import journal
 
 class History(object):
     def save_game(self, game, msg, result_code):
@@ -55,16 +55,20 @@ class History(object):
         white_rating = str(game.white_rating)
         black_rating = str(game.black_rating)
         movetext = game.get_movetext()
+        compact_moves = game.get_compact_moves()
 
         (i, eco, longeco) = game.get_eco()
-        game_id = db.game_add(game.white.name, white_rating, game.black.name,
-            black_rating, eco, game.speed_variant.variant.id_,
-            game.speed_variant.speed.id_, game.white_time, game.inc,
-            game.rated, result_code, result_reason, game.get_ply_count(),
-            movetext, game.when_started, game.when_ended)
-
-        if game.idn is not None:
-            db.game_add_idn(game_id, game.idn)
+        (game_seq, d) = journal.add_game({'white_name': game.white.name,
+            'white_rating': white_rating, 'black_name': game.black.name,
+            'black_rating': black_rating, 'eco': eco,
+            'variant_id': game.speed_variant.variant.id_,
+            'speed_id': game.speed_variant.speed.id_,
+            'time': game.white_time, 'inc': game.inc, 'rated': game.rated,
+            'result': result_code, 'result_reason': result_reason,
+            'ply_count': game.get_ply_count(), 'movetext': movetext,
+            'compact_moves': compact_moves,
+            'when_started': game.when_started,
+            'when_ended': game.when_ended}, game.idn)
 
         flags = '%s%s' % (game.speed_variant.speed.abbrev,
             game.speed_variant.variant.abbrev)
@@ -81,14 +85,27 @@ class History(object):
             assert(result_code == '1/2-1/2')
             white_result_char = '='
             black_result_char = '='
-        game.white.save_history(game_id, white_result_char,
+        # The history entries are added right away, so they are visible
+        # before the game has been written; the game id is filled in
+        # once the journal has written the game.
+        white_entry = game.white.save_history(None, white_result_char,
             white_rating, 'W', game.black.name, black_rating,
             eco[0:3], flags, game.white_time, game.inc, result_reason,
-            game.when_ended, movetext, game.idn)
-        game.black.save_history(game_id, black_result_char,
+            game.when_ended, movetext, compact_moves, game.idn)
+        black_entry = game.black.save_history(None, black_result_char,
             black_rating, 'B', game.white.name, white_rating,
             eco[0:3], flags, game.white_time, game.inc, result_reason,
-            game.when_ended, movetext, game.idn)
+            game.when_ended, movetext, compact_moves, game.idn)
+
+        for (u, entry) in [(game.white, white_entry),
+                (game.black, black_entry)]:
+            if not u.is_guest:
+                journal.add_history(u.id, entry, game_seq)
+            d.addCallback(self._game_added, entry)
+        return d
+
+    def _game_added(self, game_id, entry):
+        entry['game_id'] = game_id
         return game_id
 
 def show_for_user(user, conn):
@@ -0,0 +1,271 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" A write-behind journal for the database writes done when a game
+ends: the game itself, history entries, and ratings.
+
+Records are appended to a local file as soon as they are made, and
+written to the database in batches every so often.  The in-memory
+history and ratings are updated by the callers right away, so nobody
+waits for the database.  If the server dies before a batch is written,
+the records left in the file are written when it starts again. """
+
+import os
+import json
+import base64
+import datetime
+
+from twisted.internet import reactor, defer
+
+from config import config
+from db import adb, log_error
+
+_datetime_fmt = '%Y-%m-%d %H:%M:%S.%f'
+
+def _encode(o):
+    if isinstance(o, datetime.datetime):
+        return {'__datetime__': o.strftime(_datetime_fmt)}
+    raise TypeError('cannot journal %r' % o)
+
+def _decode(d):
+    if '__datetime__' in d:
+        return datetime.datetime.strptime(d['__datetime__'], _datetime_fmt)
+    return d
+
+# the columns of the history table; the in-memory entries have more
+_history_keys = ['num', 'result_char', 'user_rating', 'color_char',
+    'opp_name', 'opp_rating', 'eco', 'flags', 'time', 'inc',
+    'result_reason', 'when_ended']
+
+def _game_row(g):
+    """ The game table row for a journalled game.  The compact moves
+    are journalled in base64, since json cannot hold raw bytes. """
+    row = dict(g)
+    if row.get('compact_moves') is not None:
+        row['compact_moves'] = base64.b64decode(row['compact_moves'])
+    else:
+        # journalled before there were compact moves
+        row['compact_moves'] = None
+    return row
+
+def _write_batch(db_, batch):
+    """ Write a batch of records to the database.  This runs in a
+    database pool thread.  Returns a dict mapping the seq of each
+    game record to the game's id. """
+    game_ids = {}
+    new_games = []
+    for rec in batch:
+        if rec['type'] != 'game':
+            continue
+        if rec.get('replay'):
+            # the game may have been written before we crashed
+            game_id = db_.game_find(rec['game'])
+            if game_id is not None:
+                game_ids[rec['seq']] = game_id
+                continue
+        new_games.append(rec)
+    if new_games:
+        first_id = db_.game_add_many([_game_row(rec['game'])
+            for rec in new_games])
+        for (i, rec) in enumerate(new_games):
+            game_ids[rec['seq']] = first_id + i
+
+    idns = []
+    entries = []
+    ratings = []
+    for rec in batch:
+        if rec['type'] == 'game':
+            if rec['idn'] is not None:
+                idns.append((game_ids[rec['seq']], rec['idn']))
+        elif rec['type'] == 'history':
+            if rec['game_seq'] not in game_ids:
+                print('journal: no game for history record %d' % rec['seq'])
+                continue
+            entry = dict(rec['entry'])
+            entry['user_id'] = rec['user_id']
+            entry['game_id'] = game_ids[rec['game_seq']]
+            entries.append(entry)
+        elif rec['type'] == 'rating':
+            ratings.append(rec['rating'])
+        else:
+            raise RuntimeError('unknown journal record type %s' % rec['type'])
+
+    if idns:
+        db_.game_add_idn_many(idns)
+    if entries:
+        db_.user_add_history_many(entries)
+    if ratings:
+        db_.user_set_rating_many(ratings)
+    return game_ids
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self.seq = 0
+        # records that have not been sent to the database yet
+        self.pending = []
+        # Deferreds waiting for the ids of games, by seq
+        self.game_waiters = {}
+        # the Deferred for the batch being written, if any
+        self.flushing = None
+        self.flush_call = None
+        self._replay()
+        self.f = open(self.path, 'a')
+        reactor.addSystemEventTrigger('before', 'shutdown', self.flush_all)
+        if self.pending:
+            print('journal: replaying %d records' % len(self.pending))
+            self._schedule_flush(0)
+
+    def _replay(self):
+        """ Read records left over from the last run. """
+        if not os.path.exists(self.path):
+            return
+        done = 0
+        recs = []
+        for line in open(self.path):
+            try:
+                rec = json.loads(line, object_hook=_decode)
+            except ValueError:
+                # probably a partial write when the server died
+                print('journal: ignoring bad line %r' % line)
+                continue
+            if 'done' in rec:
+                done = max(done, rec['done'])
+            else:
+                recs.append(rec)
+                self.seq = max(self.seq, rec['seq'])
+        for rec in recs:
+            if rec['seq'] > done:
+                rec['replay'] = True
+                self.pending.append(rec)
+
+    def _append(self, rec):
+        self.seq += 1
+        rec['seq'] = self.seq
+        self.f.write(json.dumps(rec, default=_encode) + '\n')
+        self.f.flush()
+        self.pending.append(rec)
+        if len(self.pending) >= config.journal_batch_size:
+            self._schedule_flush(0)
+        else:
+            self._schedule_flush(config.journal_flush_interval)
+        return self.seq
+
+    def add_game(self, g, idn):
+        """ Add a game, given as a dict of game table columns.  Returns
+        a (seq, Deferred) pair; the Deferred fires with the game id once
+        the game is in the database. """
+        g = dict(g)
+        if g['compact_moves'] is not None:
+            g['compact_moves'] = base64.b64encode(g['compact_moves'])
+        seq = self._append({'type': 'game', 'game': g, 'idn': idn})
+        d = defer.Deferred()
+        self.game_waiters[seq] = d
+        return (seq, d)
+
+    def add_history(self, user_id, entry, game_seq):
+        """ Add a history entry for the game added with the given seq. """
+        self._append({'type': 'history', 'user_id': user_id,
+            'entry': dict((k, entry[k]) for k in _history_keys),
+            'game_seq': game_seq})
+
+    def add_rating(self, user_id, speed_id, variant_id, rating, rd,
+            volatility, win, loss, draw, ltime):
+        self._append({'type': 'rating', 'rating': {'user_id': user_id,
+            'speed_id': speed_id, 'variant_id': variant_id,
+            'rating': rating, 'rd': rd, 'volatility': volatility,
+            'win': win, 'loss': loss, 'draw': draw,
+            'total': win + loss + draw, 'ltime': ltime}})
+
+    def _schedule_flush(self, secs):
+        if self.flush_call and self.flush_call.active():
+            if self.flush_call.getTime() - reactor.seconds() <= secs:
+                return
+            self.flush_call.cancel()
+        self.flush_call = reactor.callLater(secs, self.flush)
+
+    def flush(self):
+        """ Send the pending records to the database in one batch.  Only
+        one batch is written at a time. """
+        if self.flush_call and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        if self.flushing or not self.pending:
+            return
+        batch = self.pending
+        self.pending = []
+        # make sure the records are on disk before we count on them
+        os.fsync(self.f.fileno())
+        self.flushing = adb.run_interaction(_write_batch, batch)
+        self.flushing.addCallbacks(self._flushed, self._flush_failed,
+            callbackArgs=(batch,), errbackArgs=(batch,))
+
+    def _flushed(self, game_ids, batch):
+        self.flushing = None
+        if self.pending:
+            self.f.write(json.dumps({'done': batch[-1]['seq']}) + '\n')
+            self.f.flush()
+            self._schedule_flush(config.journal_flush_interval)
+        else:
+            # everything is written, so start a new file
+            self.f.close()
+            self.f = open(self.path, 'w')
+        for (seq, game_id) in game_ids.iteritems():
+            d = self.game_waiters.pop(seq, None)
+            if d:
+                d.callback(game_id)
+
+    def _flush_failed(self, failure, batch):
+        log_error(failure, 'journal flush')
+        self.flushing = None
+        # The games may have been written before whatever failed, since
+        # the tables are not transactional; the other writes replace
+        # their rows, so only the games need to be looked for.
+        for rec in batch:
+            rec['replay'] = True
+        # try again later, without losing the order of records
+        self.pending = batch + self.pending
+        self._schedule_flush(config.journal_retry_interval)
+
+    def flush_all(self):
+        """ Try to write everything before shutting down.  Anything that
+        can't be written stays in the journal for the next run.  Returns
+        a Deferred. """
+        if self.flushing:
+            d = self._wait_for_flush()
+            d.addCallback(lambda r: self._flush_once())
+            return d
+        return self._flush_once()
+
+    def _flush_once(self):
+        self.flush()
+        if self.flushing:
+            return self._wait_for_flush()
+        return defer.succeed(None)
+
+    def _wait_for_flush(self):
+        d = defer.Deferred()
+        self.flushing.addBoth(lambda r: d.callback(None))
+        return d
+
+try:
+    journal
+except NameError:
+    journal = Journal(config.journal_path)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
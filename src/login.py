@@ -16,68 +16,122 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import time
+
 import user
 import filter_
 import online
 
+from twisted.internet import defer
+
 from config import config
-from db import db
+from db import adb
+
+# The time taken by each phase of logging in, over all logins, for the
+# uptime command: [count, total seconds, longest].  The phases are
+# looking up the name, checking the password, reading what the user
+# needs from the database, and logging on.
+PHASES = ['lookup', 'passwd', 'fetch', 'log_on']
+stats = dict([(phase, [0, 0.0, 0.0]) for phase in PHASES])
+
+def add_phase_time(phase, start):
+    """ Count the time since start toward a phase of logging in. """
+    secs = time.time() - start
+    st = stats[phase]
+    st[0] += 1
+    st[1] += secs
+    st[2] = max(st[2], secs)
+
+def timed(d, phase):
+    """ Count the time until the Deferred d fires toward a phase of
+    logging in.  Returns d. """
+    start = time.time()
+    def done(result):
+        add_phase_time(phase, start)
+        return result
+    return d.addBoth(done)
+
+# Logins whose names, passwords or data are being looked up.  When many
+# clients connect at once, as after a restart, the rest wait their turn
+# here, so that the players already online are not starved.
+admission = defer.DeferredSemaphore(config.max_logins_in_progress)
+
+def admit(conn, f, *args):
+    """ Call f, which returns a Deferred, when there is room for
+    another login in progress.  Returns a Deferred that fires with
+    f's result, or with None if the connection was closed while it
+    waited its turn. """
+    def run():
+        if conn.state == 'quitting':
+            return None
+        return f(*args)
+    return admission.run(run)
 
 class Login(object):
-    # return a user object if one exists; otherwise make a
-    # guest user
     def get_user(self, name, conn):
-        u = None
+        """ Find the user for a name given at the login prompt.  Returns
+        a Deferred that fires with a user object if one exists, a new
+        guest user if not, or None if the login should not proceed. """
         if name.lower() == 'g' or name.lower() == 'guest':
             u = user.GuestUser(None)
             conn.write(_('\nLogging you in as "%s"; you may use this name to play unrated games.\n(After logging in, do "help register" for more info on how to register.)\n\nPress return to enter the server as "%s":\n') % (u.name, u.name))
+            return self._check_user(u, conn)
         elif name != '':
             try:
-                u = user.find_by_name_exact(name)
+                d = timed(user.find_by_name_exact_d(name), 'lookup')
             except user.UsernameException as e:
                 conn.write('\n' + e.reason + '\n')
-            else:
-                if u:
-                    if u.is_guest:
-                        # It's theoretically possible that
-                        # a new user registers but is blocked
-                        # from logging in by a guest with the
-                        # same name.  We ignore that case.
-                        conn.write(_('Sorry, %s is already logged in. Try again.\n') % name)
-                        u = None
-                    else:
-                        conn.write(_('\n"%s" is a registered name.  If it is yours, type the password.\nIf not, just hit return to try another name.\n\npassword: ') % u.name)
-                else:
-                    u = user.GuestUser(name)
-                    conn.write(_('\n"%s" is not a registered name.  You may play unrated games as a guest.\n(After logging in, do "help register" for more info on how to register.)\n\nPress return to enter the server as "%s":\n') % (name, name))
+                return defer.succeed(None)
+            d.addCallback(self._got_user, name, conn)
+            return d
+        return defer.succeed(None)
 
+    def _got_user(self, u, name, conn):
         if u:
             if u.is_guest:
-                if filter_.check_filter(conn.ip):
-                    # not translated, since the player hasn't logged on
-                    conn.write('Due to abuse, guest logins are blocked from your address.\n')
-                    conn.loseConnection('filtered')
-                    u = None
-                if u and online.online.guest_count >= config.maxguest:
-                    conn.write(db.get_server_message('full_unreg'))
-                    conn.loseConnection('guests full')
-                    u = None
+                # It's theoretically possible that
+                # a new user registers but is blocked
+                # from logging in by a guest with the
+                # same name.  We ignore that case.
+                conn.write(_('Sorry, %s is already logged in. Try again.\n') % name)
+                return None
             else:
-                if u.is_banned:
-                    # not translated, since the player hasn't logged on
-                    conn.write('Player "%s" is banned.\n' % u.name)
-                    conn.loseConnection('banned')
-                    u = None
+                conn.write(_('\n"%s" is a registered name.  If it is yours, type the password.\nIf not, just hit return to try another name.\n\npassword: ') % u.name)
+        else:
+            u = user.GuestUser(name)
+            conn.write(_('\n"%s" is not a registered name.  You may play unrated games as a guest.\n(After logging in, do "help register" for more info on how to register.)\n\nPress return to enter the server as "%s":\n') % (name, name))
+        return self._check_user(u, conn)
 
-        if u:
-            pmax = config.maxplayer if u.is_admin() else (config.maxplayer -
-                config.admin_reserve)
-            if len(online.online) >= pmax:
-                conn.write(db.get_server_message('full'))
-                conn.loseConnection('players full')
-                u = None
-
-        return u
+    def _check_user(self, u, conn):
+        if u.is_guest:
+            if filter_.check_filter(conn.ip):
+                # not translated, since the player hasn't logged on
+                conn.write('Due to abuse, guest logins are blocked from your address.\n')
+                conn.loseConnection('filtered')
+                return defer.succeed(None)
+            if online.online.guest_count >= config.maxguest:
+                return self._refuse(conn, 'full_unreg', 'guests full')
+        else:
+            if u.is_banned:
+                # not translated, since the player hasn't logged on
+                conn.write('Player "%s" is banned.\n' % u.name)
+                conn.loseConnection('banned')
+                return defer.succeed(None)
+
+        pmax = config.maxplayer if u.is_admin() else (config.maxplayer -
+            config.admin_reserve)
+        if len(online.online) >= pmax:
+            return self._refuse(conn, 'full', 'players full')
+
+        return defer.succeed(u)
+
+    def _refuse(self, conn, message_name, reason):
+        """ Send a server message and close the connection. """
+        def refuse(msg):
+            conn.write(msg)
+            conn.loseConnection(reason)
+            return None
+        return adb.get_server_message(message_name).addCallback(refuse)
 
 login = Login()
 
@@ -16,20 +16,25 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import connection
+from twisted.internet import reactor
 
 from online import online
 from db import db
+from broadcast import Broadcast
 
-def notify_users(user, arrived):
-    """ Send a message to all users notified about the given user. """
+def notify_users(user, arrived, adjourned=None):
+    """ Send a message to all users notified about the given user.  On
+    arrival, adjourned can be the user's adjourned games if they have
+    been read already. """
 
     assert(not user.is_guest)
     name = user.name
     # notify of adjourned games
     adjourned_opps = []
     if arrived:
-        for adj in db.get_adjourned(user.id):
+        if adjourned is None:
+            adjourned = db.get_adjourned(user.id)
+        for adj in adjourned:
             if adj['white_user_id'] == user.id:
                 opp_name = adj['black_name']
             else:
@@ -46,16 +51,17 @@ def notify_users(user, arrived):
             len(adjourned_opps), (len(adjourned_opps), ' '.join(adjourned_opps)))
 
     nlist = []
+    if arrived:
+        b = Broadcast("\nNotification: %s has arrived.\n", name)
+    else:
+        b = Broadcast("\nNotification: %s has departed.\n", name)
     for nname in user.notified:
         u = online.find_exact(nname)
         if u:
-            if arrived:
-                if u.name not in adjourned_opps:
-                    u.write_("\nNotification: %s has arrived.\n", name)
-                    nlist.append(u.name)
-            else:
-                u.write_("\nNotification: %s has departed.\n", name)
-                nlist.append(u.name)
+            if arrived and u.name in adjourned_opps:
+                continue
+            b.send(u)
+            nlist.append(u.name)
 
     if nlist and user.vars['notifiedby']:
         if arrived:
@@ -63,32 +69,58 @@ def notify_users(user, arrived):
         else:
             user.write(_('The following players were notified of your departure: %s\n') % ' '.join(nlist))
 
+    if arrived:
+        b = Broadcast("\nNotification: %s has arrived and isn't on your notify list.\n", name)
+    else:
+        b = Broadcast("\nNotification: %s has departed and isn't on your notify list.\n", name)
     for nname in user.notifiers:
         u = online.find_exact(nname)
         if u and u.vars['notifiedby'] and u.name not in nlist:
-            if arrived:
-                u.write_("\nNotification: %s has arrived and isn't on your notify list.\n", name)
-            else:
-                u.write_("\nNotification: %s has departed and isn't on your notify list.\n", name)
+            b.send(u)
+
+# Arrivals and departures for the pin variable and ivariable are sent
+# at the end of the reactor iteration, so that when many users log on at
+# once, as after a restart, each watcher gets one message listing them
+# instead of one message for each.
+_pin_pending = []
+_pin_call = None
 
 def notify_pin(user, arrived):
     """ Notify users who have the pin variable or ivariable set. """
-    if online.pin_ivar:
-        if arrived:
-            pin_ivar_str = '\n<wa> %s 001222 1326P1169P0P0P0P0P0P0P\n' % user.name
-        else:
-            pin_ivar_str = '\n<wd> %s\n' % user.name
-        for u in online.pin_ivar:
-            u.write_nowrap(pin_ivar_str)
-            connection.written_users.add(u)
+    global _pin_call
+    if online.pin_ivar or online.pin_var:
+        _pin_pending.append((user.name, arrived))
+        if _pin_call is None:
+            _pin_call = reactor.callLater(0, flush_pin)
+
+def flush_pin():
+    global _pin_call
+    _pin_call = None
+    pending = _pin_pending[:]
+    del _pin_pending[:]
 
+    if online.pin_ivar:
+        _send_pin(online.pin_ivar, pending,
+            '<wa> %s 001222 1326P1169P0P0P0P0P0P0P\n', '<wd> %s\n', False)
     if online.pin_var:
         # XXX fics displays the IP address to admins
-        if arrived:
-            pin_var_str = '\n[%s has connected.]\n' % user.name
+        _send_pin(online.pin_var, pending, '[%s has connected.]\n',
+            '[%s has disconnected.]\n', True)
+
+def _send_pin(users, pending, arrived_fmt, departed_fmt, wrap):
+    def make(events):
+        return Broadcast('\n' + ''.join([(arrived_fmt if arrived else
+            departed_fmt) % name for (name, arrived) in events]),
+            translate=False, wrap=wrap)
+    b = make(pending)
+    names = set([name for (name, arrived) in pending])
+    for u in users:
+        if u.name in names:
+            # don't tell a user about their own arrival
+            events = [e for e in pending if e[0] != u.name]
+            if events:
+                make(events).send(u)
         else:
-            pin_var_str = '\n[%s has disconnected.]\n' % user.name
-        for u in online.pin_var:
-            u.write(pin_var_str)
+            b.send(u)
 
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
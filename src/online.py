@@ -33,6 +33,11 @@ class Online(object):
         self.pin_var = set()
         self.gin_var = set()
         #self.shouts_var = set()
+        # users who are not playing or examining a game and who
+        # want seeks announced in each form
+        self.seek_var = set()
+        self.seekinfo_ivar = set()
+        self.seekremove_ivar = set()
 
     def add(self, u):
         self.online[u.name.lower()] = u
@@ -41,8 +46,11 @@ class Online(object):
             self.pin_var.add(u)
         if u.vars['gin']:
             self.gin_var.add(u)
+        if u.session.ivars['pin']:
+            self.pin_ivar.add(u)
         if u.is_guest:
             self.guest_count += 1
+        self.update_seek_sets(u)
 
     def remove(self, u):
         if u in self.pin_ivar:
@@ -53,6 +61,9 @@ class Online(object):
             self.gin_var.remove(u)
         #if u in shouts_var:
         #    shouts_var.remove(u)
+        self.seek_var.discard(u)
+        self.seekinfo_ivar.discard(u)
+        self.seekremove_ivar.discard(u)
         try:
             del self.online[u.name.lower()]
             del self.online_names[u.name.lower()]
@@ -61,6 +72,20 @@ class Online(object):
         else:
             self.guest_count -= int(u.is_guest)
 
+    def update_seek_sets(self, u):
+        """ Add or remove a user from the sets of users who hear about
+        seeks.  This is called when the user's seek var or seekinfo or
+        seekremove ivars change, and when the user starts or stops
+        playing or examining a game. """
+        free = u.is_online and not u.session.game
+        for (s, val) in [(self.seek_var, u.vars['seek']),
+                (self.seekinfo_ivar, u.session.ivars['seekinfo']),
+                (self.seekremove_ivar, u.session.ivars['seekremove'])]:
+            if free and val:
+                s.add(u)
+            else:
+                s.discard(u)
+
     def is_online(self, name):
         return name.lower() in self.online_names
 
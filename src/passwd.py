@@ -0,0 +1,74 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Hashing and checking passwords.  bcrypt is slow by design, so it is
+run in a pool of threads of its own, where neither the reactor nor the
+database pool waits for it.  bcrypt releases the GIL while it works, so
+the threads can use more than one CPU. """
+
+import bcrypt
+
+from twisted.internet import reactor, threads
+from twisted.python import threadpool
+
+from config import config
+
+class PasswdService(object):
+    def __init__(self, maxthreads, work_factor):
+        """ At most maxthreads passwords are hashed at once; the others
+        wait their turn.  New hashes take 2**work_factor rounds. """
+        self.threadpool = threadpool.ThreadPool(0, maxthreads, 'passwd')
+        self.work_factor = work_factor
+        self.running = False
+        reactor.callWhenRunning(self.start)
+
+    def start(self):
+        if not self.running:
+            self.threadpool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+            self.running = True
+
+    def stop(self):
+        if self.running:
+            self.threadpool.stop()
+            self.running = False
+
+    def hash(self, passwd):
+        """ Returns a Deferred that fires with a new hash of passwd. """
+        return threads.deferToThreadPool(reactor, self.threadpool,
+            self._hash, passwd)
+
+    def check(self, passwd, pwhash):
+        """ Returns a Deferred that fires with whether passwd matches
+        pwhash. """
+        return threads.deferToThreadPool(reactor, self.threadpool,
+            self._check, passwd, pwhash)
+
+    def _hash(self, passwd):
+        return bcrypt.hashpw(passwd, bcrypt.gensalt(self.work_factor))
+
+    def _check(self, passwd, pwhash):
+        return bcrypt.hashpw(passwd, pwhash) == pwhash
+
+try:
+    passwd_service
+except NameError:
+    passwd_service = PasswdService(config.passwd_threads,
+        config.passwd_work_factor)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
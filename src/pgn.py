@@ -16,10 +16,9 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-# At present this is only used for tests.
+# Used by the tests, for importing games and for exporting them.
 
 import re
-import copy
 
 tag_re = re.compile(r'''\[(\w+)\s+"([^\n]*?)"\]\s*$''')
 space_re = re.compile(r'''\s+''')
@@ -37,8 +36,8 @@ nomaterial_re = re.compile(r'''[nN]either\s+player\s+has\s+mating\s+material\s*$
 
 class PgnError(Exception):
     def __init__(self, reason):
+        Exception.__init__(self, reason)
         self.reason = reason
-        print reason
 
 class PgnMove(object):
     def __init__(self, text, decorator):
@@ -49,66 +48,71 @@ class PgnMove(object):
     def add_comment(self, com):
         self.comments.append(com)
 
-class Pgn(object):
-    def __init__(self, f):
-        self.f = f
+def read_games(f):
+    """ Read the games of a PGN file one at a time, yielding (tags,
+    movetext, line_num) for each, where line_num is the line the game
+    starts on.  Nothing is kept from one game to the next and the
+    movetext is not parsed, so a file of any size can be read in
+    constant memory, and the parsing can be done elsewhere. """
+    skip_blank = True
+    tags = {}
+    movetext = []
+    in_tag_section = True
+    start_line = None
 
-    def __iter__(self):
-        skip_blank = True
-        line_num = 0
-        tags = {}
-        in_tag_section = True
-
-        for line in self.f:
-            line = line.rstrip('\r\n')
-            if skip_blank:
-                if line == '' or line[0:6] == '{ FEN ':
-                    line_num += 1
-                    continue
-                else:
-                    skip_blank = False
+    for (line_num, line) in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if skip_blank:
+            if line == '' or line[0:6] == '{ FEN ':
+                continue
+            else:
+                skip_blank = False
+                start_line = line_num
 
-            if in_tag_section:
-                if line == '':
-                    movetext = []
-                    in_tag_section = False
-                else:
-                    if len(line) > 0 and line[0] == ';':
-                        # skip comment
-                        line_num += 1
-                        continue
-                    m = tag_re.match(line)
-                    if not m:
-                        raise PgnError('missing tag section at line %d' % line_num)
-                    tags[m.group(1)] = m.group(2).replace(r'\"', '"')
+        if in_tag_section:
+            if line == '':
+                in_tag_section = False
             else:
-                if line == '':
-                    # Search for the result to try to handle blank lines
-                    # within the movetext.  This doesn't account for
-                    # results within user comments, but works for now.
-                    movetext_str = '\n'.join(movetext)
-                    if not result_re.search(movetext_str):
-                        movetext.append(line)
-                        line_num += 1
-                        continue
-                    yield PgnGame(tags, movetext_str)
-                    tags.clear()
-                    skip_blank = True
-                    in_tag_section = True
-                else:
+                if line[0] == ';':
+                    # skip comment
+                    continue
+                m = tag_re.match(line)
+                if not m:
+                    raise PgnError('missing tag section at line %d' %
+                        line_num)
+                tags[m.group(1)] = m.group(2).replace(r'\"', '"')
+        else:
+            if line == '':
+                # Search for the result to try to handle blank lines
+                # within the movetext.  This doesn't account for
+                # results within user comments, but works for now.
+                movetext_str = '\n'.join(movetext)
+                if not result_re.search(movetext_str):
                     movetext.append(line)
+                    continue
+                yield (tags, movetext_str, start_line)
+                tags = {}
+                movetext = []
+                skip_blank = True
+                in_tag_section = True
+            else:
+                movetext.append(line)
 
-            line_num += 1
+    if len(tags) > 0:
+        yield (tags, '\n'.join(movetext), start_line)
 
-        if len(tags) > 0:
-            movetext_str = '\n'.join(movetext)
-            yield PgnGame(tags, movetext_str)
+class Pgn(object):
+    def __init__(self, f):
+        self.f = f
 
+    def __iter__(self):
+        for (tags, movetext, line_num) in read_games(self.f):
+            yield PgnGame(tags, movetext)
         self.f.close()
 
 class PgnGame(object):
     def __init__(self, tags, movetext):
-        self.tags = copy.copy(tags)
+        self.tags = tags
         self.movetext = movetext
         self.is_checkmate = False
         self.is_stalemate = False
@@ -186,4 +190,105 @@ class PgnGame(object):
     def __str__(self):
         return '%s vs. %s' % (self.tags['White'], self.tags['Black'])
 
+# the comments at the end of exported games, by result reason; they
+# are worded like the server's result messages, so they can be read
+# back by PgnGame and scripts/import-pgn.py
+_result_comments = {
+    'Res': '%(loser)s resigns',
+    'Mat': '%(loser)s checkmated',
+    'Fla': '%(loser)s forfeits on time',
+    'Dis': '%(loser)s forfeits by disconnection',
+    'Agr': 'Game drawn by agreement',
+    'Sta': 'Game drawn by stalemate',
+    'Rep': 'Game drawn by repetition',
+    '50': 'Game drawn by the 50 move rule',
+    'NM': 'Neither player has mating material',
+    'TM': 'A player ran out of time and the other has no material to mate'
+}
+
+def _result_comment(row):
+    if row['result'] == '1-0':
+        names = {'winner': row['white_name'], 'loser': row['black_name']}
+    elif row['result'] == '0-1':
+        names = {'winner': row['black_name'], 'loser': row['white_name']}
+    else:
+        names = None
+    if row['result_reason'] == 'Adj':
+        if names:
+            return '%(winner)s wins by adjudication' % names
+        return 'Game drawn by adjudication'
+    com = _result_comments.get(row['result_reason'])
+    if com is None or ('%' in com) != bool(names):
+        return None
+    return com % names if names else com
+
+_wrap_res = {}
+def _wrap_re(width):
+    """ A regex whose matches are the lines of text wrapped to the
+    given width, breaking at spaces. """
+    if width not in _wrap_res:
+        _wrap_res[width] = re.compile(r'(\S.{0,%d})(?: |$)' % (width - 1))
+    return _wrap_res[width]
+
+def game_to_pgn(row, width=79):
+    """ Format a row of the game table (as read by DB.game_iter()) as
+    a PGN game.  The movetext is the stored SAN, numbered and wrapped
+    to the given width. """
+    variant_name = row['variant_name']
+    if variant_name == 'chess':
+        kind = row['speed_name']
+    else:
+        kind = '%s %s' % (row['speed_name'], variant_name)
+    if row['speed_name'] == 'untimed':
+        tc = '-'
+    else:
+        tc = '%d+%d' % (row['time'] * 60, row['inc'])
+    tags = [('Event', 'FatICS %s %s game' % (
+            'rated' if row['rated'] else 'unrated', kind)),
+        ('Site', 'FatICS'),
+        ('Date', row['when_started'].strftime('%Y.%m.%d')),
+        ('Time', row['when_started'].strftime('%H:%M:%S')),
+        ('Round', '-'),
+        ('White', row['white_name']),
+        ('Black', row['black_name']),
+        ('Result', row['result'])]
+    for (tag, col) in [('WhiteElo', 'white_rating'),
+            ('BlackElo', 'black_rating')]:
+        if row[col] and row[col] != '0':
+            tags.append((tag, row[col]))
+    tags += [('ECO', row['eco']), ('TimeControl', tc),
+        ('PlyCount', str(row['ply_count']))]
+    if variant_name != 'chess':
+        tags.append(('Variant', variant_name))
+    if row.get('fen'):
+        tags += [('SetUp', '1'), ('FEN', row['fen'])]
+
+    s = ['[%s "%s"]\n' % (tag, val.replace('"', r'\"'))
+        for (tag, val) in tags]
+    s.append('\n')
+
+    words = []
+    if row['movetext']:
+        for (i, san) in enumerate(row['movetext'].split(' ')):
+            if i % 2 == 0:
+                words.append('%d.' % (i // 2 + 1))
+            words.append(san)
+    com = _result_comment(row)
+    if com:
+        words.append('{%s}' % com)
+    words.append(row['result'])
+
+    s.append('\n'.join(_wrap_re(width).findall(' '.join(words))))
+    s.append('\n\n')
+    return ''.join(s)
+
+def write_games(f, rows):
+    """ Write games as PGN as they are read, returning how many
+    were written. """
+    count = 0
+    for row in rows:
+        f.write(game_to_pgn(row))
+        count += 1
+    return count
+
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,79 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Exporting the game archive as PGN.  The games are written as they
+are read from the database, so an export of any size runs in constant
+memory. """
+
+import os
+import gzip
+import time
+
+from twisted.internet import threads
+
+import pgn
+from db import DB
+
+def export_games(db, path, name=None):
+    """ Write all the stored games, or the games of one user, to a
+    file, which is gzipped if its name ends in .gz.  Returns (count,
+    secs). """
+    start = time.time()
+    f = gzip.open(path, 'wb') if path.endswith('.gz') else open(path, 'w')
+    try:
+        count = pgn.write_games(f, db.game_iter(name))
+    finally:
+        f.close()
+    return (count, time.time() - start)
+
+class PgnExport(object):
+    """ Runs exports for the server, one at a time. """
+    def __init__(self):
+        self.running = None
+
+    def start(self, path, name=None):
+        """ Start an export in the background.  It runs in a thread with
+        a database connection of its own, so neither the reactor nor
+        the query pool waits for it.  Returns a Deferred that fires
+        with (count, secs), or None if an export is already running. """
+        if self.running:
+            return None
+        self.running = threads.deferToThread(self._run, path, name)
+        self.running.addBoth(self._done)
+        return self.running
+
+    def _run(self, path, name):
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        db = DB()
+        try:
+            return export_games(db, path, name)
+        finally:
+            db.db.close()
+
+    def _done(self, result):
+        self.running = None
+        return result
+
+try:
+    pgn_export
+except NameError:
+    pgn_export = PgnExport()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -19,7 +19,7 @@ import sys
 
 import twisted.python.rebuild
 
-modules = ['lang','online','config','server','channel','block','bpgn','connection','variant.base_variant','variant.crazyhouse','variant.__init__','variant.chess','variant.chess960','variant.bughouse','notify','user','var','timer','utf8','match','glicko2','offer','speed_variant','partner','email','game_constants','login','history','db','seek','examine','command_parser','command.td_command','command.__init__','command.game_command','command.command','command.match_command','command.help_command','command.bug_command','command.offer_command','command.date_command','command.who_command','command.channel_command','command.message_command','command.seek_command','command.notify_command','command.news_command','command.observe_command','command.shout_command','command.examine_command','command.list_command','command.kibitz_command','command.user_command','command.admin_command','command.tell_command','command.light_command','command.var_command','admin','clock','session','timeseal','formula','game','filter_','list_','alias','telnet','reload','rating','time_format','game_list','pgn']
+modules = ['lang','online','config','server','channel','block','bpgn','connection','variant.base_variant','variant.crazyhouse','variant.__init__','variant.chess','variant.chess960','variant.bughouse','notify','user','var','timer','utf8','match','glicko2','offer','speed_variant','partner','email','game_constants','login','history','db','seek','seek_book','examine','command_parser','command.td_command','command.__init__','command.game_command','command.command','command.match_command','command.help_command','command.bug_command','command.offer_command','command.date_command','command.who_command','command.channel_command','command.message_command','command.seek_command','command.notify_command','command.news_command','command.observe_command','command.shout_command','command.examine_command','command.list_command','command.kibitz_command','command.user_command','command.admin_command','command.tell_command','command.light_command','command.var_command','admin','clock','session','timeseal','formula','game','filter_','list_','alias','telnet','reload','rating','time_format','game_list','pgn','journal','eco','broadcast']
 # left out: trie (seems to break things)
 for mod in modules:
     __import__(mod)
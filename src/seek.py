@@ -24,6 +24,7 @@ import speed_variant
 import online
 import game
 import formula
+import seek_book
 
 from match import MatchStringParser, MatchError
 from game_constants import *
@@ -37,19 +38,12 @@ EXPIRE_DELAY = 90
 LIMIT = 3
 
 
-seeks = {}
-
-def find_free_slot():
-    """ Find the first available seek number. """
-    # This is O(n) in the number of games, but it's simple and should
-    # be more than efficient enough.
-    i = 1
-    expiration_time = time.time() - EXPIRE_DELAY
-    while True:
-        if i not in seeks or (seeks[i].expired
-                and seeks[i].expired_time <= expiration_time):
-            return i
-        i += 1
+try:
+    book
+except NameError:
+    book = seek_book.SeekBook(EXPIRE_DELAY)
+# map from seek number to seek
+seeks = book.seeks
 
 def find_matching(seek):
     """ Find all seeks that match a given seek.  Returns a list of
@@ -58,7 +52,7 @@ def find_matching(seek):
     # Would that lead to starvation of seeks with a high number?
     auto_matches = []
     manual_matches = []
-    for s in seeks.values():
+    for s in book.candidates(seek):
         if seek.matches(s):
             if (not seek.a.censor_or_noplay(s.a) and
                     s.check_formula(seek.a) and seek.check_formula(s.a)):
@@ -191,8 +185,7 @@ class Seek(MatchStringParser):
         assert(not self.expired)
 
         self.when_posted = time.time()
-        self.num = find_free_slot()
-        seeks[self.num] = self
+        book.add(self, self.when_posted)
         self.a.session.seeks.append(self)
 
         # build the seek string
@@ -238,30 +231,25 @@ class Seek(MatchStringParser):
             self.speed_variant.variant.name, color_char, 0, 9999, auto_char,
             formula_char)
 
+        for u in online.online.seekinfo_ivar:
+            u.write_nowrap(seekinfo_str)
+
         count = 0
-        for u in online.online:
-            assert(u.is_online)
-            assert('formula' in u.vars)
-            if not u.session.game:
-                # seekinfo
-                if u.session.ivars['seekinfo']:
-                    u.write_nowrap(seekinfo_str)
-
-                if u.vars['seek']:
-                    # showownseek is both a variable and an ivariable
-                    if self.rated and (u.is_guest or u.is_ratedbanned):
-                        continue
-                    if not self.meets_formula_for(u):
-                        continue
-                    if not self.check_formula(u):
-                        continue
-                    if u.censor_or_noplay(self.a):
-                        continue
-                    if u == self.a and not (u.vars['showownseek']
-                            and u.session.ivars['showownseek']):
-                        continue
-                    count += 1
-                    u.write(seek_str)
+        for u in online.online.seek_var:
+            # showownseek is both a variable and an ivariable
+            if self.rated and (u.is_guest or u.is_ratedbanned):
+                continue
+            if not self.meets_formula_for(u):
+                continue
+            if not self.check_formula(u):
+                continue
+            if u.censor_or_noplay(self.a):
+                continue
+            if u == self.a and not (u.vars['showownseek']
+                    and u.session.ivars['showownseek']):
+                continue
+            count += 1
+            u.write(seek_str)
 
         # set the string for use in the "sought" display
         self._str = '%3d %4s %-17s %3d %3d %-7s %-10s%-9s %4d-%4d%s' % (
@@ -312,11 +300,12 @@ class Seek(MatchStringParser):
         self.expired = True
         self.a.session.seeks.remove(self)
         self.expired_time = time.time()
+        book.remove(self)
 
         # seekremove
-        for u in online.online:
-            if u.session.ivars['seekremove'] and not u.session.game:
-                u.write_nowrap('<sr> %d\n' % self.num)
+        seekremove_str = '<sr> %d\n' % self.num
+        for u in online.online.seekremove_ivar:
+            u.write_nowrap(seekremove_str)
 
     def __str__(self):
         return self._str
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" An index of open seeks, so that finding the seeks compatible with
+a new one doesn't mean looking at every seek, and a free list of seek
+numbers. """
+
+import heapq
+import collections
+
+from game_constants import opp
+
+def _tags_key(tags):
+    # seeks only match when all their tags are equal, so the tags
+    # (speed, variant, rated, clock, time, inc and idn) are the key
+    return tuple(sorted(tags.items()))
+
+class SeekBook(object):
+    def __init__(self, expire_delay):
+        self.expire_delay = expire_delay
+        # map from number to seek, including expired seeks whose
+        # numbers have not been reused yet
+        self.seeks = {}
+        # map from (tags key, side) to the set of open seeks with
+        # those parameters
+        self._index = {}
+        # seek numbers that can be reused, as a heap
+        self._free = []
+        # (expired time, number) of removed seeks, oldest first
+        self._expiring = collections.deque()
+        # the lowest number that has never been used
+        self._next_num = 1
+
+    def _get_num(self, now):
+        """ Find the first available seek number. """
+        expiration_time = now - self.expire_delay
+        while self._expiring and self._expiring[0][0] <= expiration_time:
+            heapq.heappush(self._free, self._expiring.popleft()[1])
+        if self._free:
+            return heapq.heappop(self._free)
+        num = self._next_num
+        self._next_num += 1
+        return num
+
+    def add(self, s, now):
+        """ Give an open seek a number and add it to the book. """
+        assert(not s.expired)
+        s.num = self._get_num(now)
+        self.seeks[s.num] = s
+        key = (_tags_key(s.tags), s.side)
+        self._index.setdefault(key, set()).add(s)
+
+    def remove(self, s):
+        """ Remove a seek that has just expired.  Its number can be
+        reused after the expire delay. """
+        assert(s.expired)
+        assert(self.seeks[s.num] is s)
+        key = (_tags_key(s.tags), s.side)
+        bucket = self._index[key]
+        bucket.remove(s)
+        if not bucket:
+            del self._index[key]
+        self._expiring.append((s.expired_time, s.num))
+
+    def candidates(self, s):
+        """ Return the open seeks whose parameters are compatible with
+        the seek S.  The caller still has to check the players. """
+        tags_key = _tags_key(s.tags)
+        # a seek for a color matches only a seek for the opposite color
+        side = opp(s.side) if s.side is not None else None
+        return self._index.get((tags_key, side), ())
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._index.itervalues())
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -54,6 +54,9 @@ class Session(object):
         self.followed_by = set()
         self.idlenotifying = set()
         self.idlenotified_by = set()
+        # timed events; see timer.py
+        self.idle_call = None
+        self.ping_call = None
 
     def set_user(self, user):
         self.user = user
@@ -31,6 +31,7 @@
 protocol.  Since the the goal is to be compatible with FICS clients,
 followed the server and not the RFC."""
 
+import re
 import textwrap
 
 from zope.interface import implements
@@ -57,13 +58,95 @@ IAC = chr(255) # interpret as command
 
 BS = chr(8) # backspace
 
+# counters for all connections, to see how well output is coalesced
+stats = {
+    # calls to write()
+    'writes': 0,
+    # writes to the socket
+    'sends': 0,
+    # bytes sent, after escaping and before any zipseal encoding
+    'bytes_in': 0,
+    # bytes sent, after any zipseal encoding
+    'bytes_out': 0,
+}
+
+# TextWrappers by width, and recently wrapped text by (width, text),
+# shared by all transports
+_wrappers = {}
+_wrapped = {}
+_max_wrapped = 1000
+# don't bother remembering longer text, which is not likely to be
+# the same message sent to many users
+_max_wrapped_len = 2048
+# Text that can be wrapped without decoding it from UTF-8: ASCII,
+# except for the characters that unicode strings treat as line breaks
+# or whitespace but byte strings don't.
+_plain_re = re.compile(r'[\x00-\x0a\x0d-\x1b\x20-\x7f]*\Z')
+
+def _get_wrapper(width):
+    try:
+        return _wrappers[width]
+    except KeyError:
+        # XXX this doesn't remove whitespace at the beginning of
+        # indented lines like original FICS
+        w = textwrap.TextWrapper(
+            width=width, expand_tabs=True,
+            replace_whitespace=False, drop_whitespace=False,
+            break_long_words=True,
+            subsequent_indent=r'\   ')
+        _wrappers[width] = w
+        return w
+
+def wrap_text(data, width):
+    """ Word-wrap the UTF-8 string DATA to WIDTH characters. """
+    if len(data) <= width and '\t' not in data:
+        # It all fits on one line; a UTF-8 string never has
+        # fewer bytes than characters.
+        return data
+    key = (width, data)
+    try:
+        return _wrapped[key]
+    except KeyError:
+        pass
+    ret = _wrap(data, width)
+    if len(data) <= _max_wrapped_len:
+        if len(_wrapped) >= _max_wrapped:
+            _wrapped.clear()
+        _wrapped[key] = ret
+    return ret
+
+def _wrap(data, width):
+    if _plain_re.match(data):
+        text = data
+    else:
+        text = data.decode('utf-8')
+    # we have to split the text into lines before
+    # wrapping
+    # relevant: http://bugs.python.org/issue1859
+    wrapper = _get_wrapper(width)
+    lines = []
+    for line in text.splitlines(True):
+        if len(line) <= width and '\t' not in line:
+            lines.append(line)
+        else:
+            lines.append(wrapper.fill(line))
+    text = ''.join(lines)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return text
+
 class TelnetTransport(protocol.Protocol):
     implements(interfaces.ITransport)
     protocolFactory = None
     protocol = None
     disconnecting = False
     encoder = None
-    _wrapper = None
+    # the width to wrap to, or None for no wrapping
+    wrap_width = None
+    # output waiting for flush(), or None when not buffering output
+    _out = None
+    # called when output is first buffered, so that it gets flushed
+    on_output = None
 
     def __init__(self, protocolFactory=None, *a, **kw):
         self.commandMap = {
@@ -80,10 +163,36 @@ class TelnetTransport(protocol.Protocol):
             self.protocolKwArgs = kw
 
     def _write(self, bytes):
+        if self._out is None:
+            self._send(bytes)
+        else:
+            if not self._out:
+                self.on_output(self)
+            self._out.append(bytes)
+
+    def _send(self, bytes):
+        stats['sends'] += 1
+        stats['bytes_in'] += len(bytes)
         if self.encoder is not None:
             bytes = self.encoder(bytes)
+        stats['bytes_out'] += len(bytes)
         self.transport.write(bytes)
 
+    def bufferOutput(self, on_output):
+        """ Hold output until flush() is called, so it can be sent and
+        encoded in one piece.  ON_OUTPUT is called with this transport
+        when output is first held after a flush. """
+        self.on_output = on_output
+        if self._out is None:
+            self._out = []
+
+    def flush(self):
+        """ Send any output being held. """
+        if self._out:
+            bytes = ''.join(self._out)
+            del self._out[:]
+            self._send(bytes)
+
     def do(self, option):
         self._write(IAC + DO + option)
 
@@ -198,6 +307,7 @@ class TelnetTransport(protocol.Protocol):
             self.protocol.makeConnection(self)
 
     def connectionLost(self, reason):
+        self._out = None
         if self.protocol is not None:
             try:
                 self.protocol.connectionLost(reason)
@@ -219,34 +329,35 @@ class TelnetTransport(protocol.Protocol):
 
     def enableWrapping(self, width):
         """ Enable automatic word wrapping for this transport. """
-        # XXX this doesn't remove whitespace at the beginning of
-        # indented lines like original FICS
-        self._wrapper = textwrap.TextWrapper(
-            width=width, expand_tabs=True,
-            replace_whitespace=False, drop_whitespace=False,
-            break_long_words=True,
-            subsequent_indent=r'\   ')
+        self.wrap_width = width
 
     def disableWrapping(self):
-        self._wrapper = None
+        self.wrap_width = None
+
+    def render(self, data, wrap=True):
+        """ Wrap and escape data the way write() does.  Transports with
+        the same wrap_width and compatibility render data the same. """
+        if wrap and self.wrap_width:
+            data = wrap_text(data, self.wrap_width)
+        return self._escape(data)
 
     def write(self, data, wrap=True):
-        if wrap and self._wrapper:
-            # we have to split the text into lines before
-            # wrapping
-            # relevant: http://bugs.python.org/issue1859
-            udata = data.decode('utf-8')
-            wrapped_lines = [self._wrapper.fill(line)
-                for line in udata.splitlines(True)]
-            udata = ''.join(wrapped_lines)
-            data = udata.encode('utf-8')
-        data = self._escape(data)
+        stats['writes'] += 1
+        self._write(self.render(data, wrap))
+
+    def write_rendered(self, data):
+        """ Write data already rendered by render(). """
+        stats['writes'] += 1
         self._write(data)
 
     def writeSequence(self, seq):
         self.transport.writeSequence(seq)
 
     def loseConnection(self):
+        # send what we have, and stop buffering so that anything
+        # written from now on goes out before the connection is closed
+        self.flush()
+        self._out = None
         self.transport.loseConnection()
 
     def getHost(self):
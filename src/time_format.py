@@ -32,10 +32,15 @@ def hms_words(secs):
     return ret
 
 def hms(secs, user=None):
+    return hms_ms(secs, not user or user.session.ivars['ms'])
+
+def hms_ms(secs, ms):
+    """ Like hms(), but showing milliseconds if MS is set rather than
+    according to a user's ivar. """
     (hours, secs) = divmod(secs, 3600)
     (mins, secs) = divmod(secs, 60)
 
-    if not user or user.session.ivars['ms']:
+    if ms:
         if hours != 0:
             ret = '%d:%02d:%06.3f' % (hours, mins, secs)
         else:
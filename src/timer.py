@@ -16,44 +16,65 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import time
-from gettext import ngettext
 
-import online
-import game
-import connection
+""" Timed events for users: idle timeouts and pings to zipseal clients.
+Each is a call scheduled with the reactor, which keeps its timed calls
+in a heap, so the work done at any moment depends on the events due
+then, not on how many users are online.  Clocks schedule their own
+flag checks in the same way; see clock.py. """
+
+import random
+
+from twisted.internet import reactor
 
 from config import config
 
-heartbeat_timeout = 5
-def heartbeat():
-    # idle timeout
+# seconds between pings to each zipseal client
+ping_interval = 5
+
+def start_user(u):
+    """ Schedule the timed events for a user who has just logged on. """
+    sess = u.session
     if config.idle_timeout:
-        now = time.time()
-        for u in online.online:
-            if (now - u.session.last_command_time > config.idle_timeout and
-                    not u.is_admin() and
-                    not u.has_title('TD')):
-                u.session.conn.idle_timeout(config.idle_timeout // 60)
-
-    # ping all zipseal clients
-    # I wonder if it would be better to spread out the pings in time,
-    # rather than sending a large number of ping requests all at once.
-    # However, this method is simple, and FICS timeseal 2 seems to do it
-    # this way (pinging all capable clients every 10 seconds).
-    for u in online.online:
-        if u.session.use_zipseal:
-            u.session.ping()
-
-    # forfeit games on time
-    for g in game.games.values():
-        if g.gtype == game.PLAYED and g.clock.is_ticking:
-            u = g.get_user_to_move()
-            opp = g.get_opp(u)
-            if opp.vars['autoflag']:
-                # TODO: send auto-flagging message a la original fics.
-                g.clock.check_flag(g, g.get_user_side(u))
-
-    connection.send_prompts()
+        sess.idle_call = reactor.callLater(config.idle_timeout,
+            _idle_timeout, u)
+    if sess.use_zipseal:
+        # FICS timeseal 2 pings all capable clients at once every 10
+        # seconds, but we spread the pings over the interval
+        sess.ping_call = reactor.callLater(
+            random.uniform(0, ping_interval), _ping, u)
+
+def stop_user(u):
+    """ Cancel the timed events for a user who is logging off. """
+    sess = u.session
+    for call in [sess.idle_call, sess.ping_call]:
+        if call is not None and call.active():
+            call.cancel()
+    sess.idle_call = None
+    sess.ping_call = None
+
+def reset_idle(u):
+    """ Start the idle timeout over, after the user entered a
+    command. """
+    call = u.session.idle_call
+    if call is not None and call.active():
+        call.reset(config.idle_timeout)
+
+def _idle_timeout(u):
+    sess = u.session
+    sess.idle_call = None
+    if not u.is_online:
+        return
+    if u.is_admin() or u.has_title('TD'):
+        # check again later, in case that changes
+        sess.idle_call = reactor.callLater(config.idle_timeout,
+            _idle_timeout, u)
+        return
+    sess.conn.idle_timeout(config.idle_timeout // 60)
+
+def _ping(u):
+    sess = u.session
+    sess.ping_call = reactor.callLater(ping_interval, _ping, u)
+    sess.ping()
 
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -16,62 +16,144 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+""" Timeseal and zipseal codecs.
+
+This used to be done by piping every line through the helper programs
+in timeseal/, which serialized all connections through three pipes.
+The same algorithms are now done in-process; the helpers are only
+kept around for testing. """
+
 import re
-import subprocess
+import binascii
 
 TIMESEAL_1_PING = '[G]\n'
 ZIPSEAL_PING = '[G]\x00'
-REPLY = '\x02\x39' # also known as "\x29" or "9"
+REPLY = '\x02\x39' # also known as "\x29" or "9"
+
+# the key used by openseal/timeseal 1
+_timeseal_key = 'Timestamp (FICS) v1.0 - programmed by Henrik Gram.'
+
+# Huffman code lengths used by zipseal; this table is copied from
+# timeseal/codes.c and must match the one compiled into the clients.
+_code_lens = [
+    19, 17, 19, 19, 19, 19, 19, 10, 19, 19,  6, 19, 19,  6, 19, 19,
+    19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19,
+     2, 11,  9, 12, 16,  7, 16, 10,  7,  7, 12, 10, 10,  4,  8,  8,
+     5,  5,  6,  7,  7,  7,  7,  7,  7,  7,  7, 13,  8,  8,  8, 11,
+    15, 11,  8,  8,  9,  9, 10,  8, 12, 10,  9,  9, 10,  9,  8, 11,
+     6,  9,  7,  9,  9, 12, 10,  9, 11, 12, 12, 10,  9, 10, 15,  8,
+    17,  5,  7,  6,  6,  5,  6,  7,  6,  5,  9,  8,  6,  7,  5,  5,
+     6,  9,  6,  5,  5,  6,  8,  8,  9,  7, 11, 13, 11, 13, 15, 19,
+    19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19,
+    19, 19, 19, 19, 18, 18, 18, 18, 18, 14, 18, 18, 18, 18, 18, 17,
+    19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19,
+    19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 18, 17, 19, 19, 17,
+    19, 19, 19, 16, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19,
+    19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19,
+    19, 19, 14, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19,
+    19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19, 19,
+    18,
+]
+_EOF_CHAR = 256
+
+# The encoder in timeseal/ had a fixed-size buffer, so longer output
+# is split into chunks, each terminated by its own EOF code.
+_MAX_CHUNK = 1023
+
+def _make_codes(code_lens):
+    """ Assign canonical Huffman codes the same way timeseal/chuffman.c
+    does, returning a list of bit strings indexed by symbol. """
+    syms = sorted(range(len(code_lens)), key=lambda c: (code_lens[c], c))
+    codes = [None] * len(code_lens)
+    code = 0
+    length = code_lens[syms[-1]]
+    for c in reversed(syms):
+        if code_lens[c] < length:
+            code >>= length - code_lens[c]
+            length = code_lens[c]
+        codes[c] = bin(code)[2:].zfill(length)
+        code += 1
+    return codes
+
+_codes = _make_codes(_code_lens)
+# map from a byte to its code
+_byte_codes = dict((chr(c), _codes[c]) for c in range(256))
+_eof_code = _codes[_EOF_CHAR]
+
+def _encode_chunk(chunk):
+    bits = ''.join(map(_byte_codes.__getitem__, chunk)) + _eof_code
+    nbytes = (len(bits) + 7) // 8
+    bits += '0' * (8 * nbytes - len(bits))
+    return binascii.unhexlify('%0*x' % (2 * nbytes, int(bits, 2)))
+
+def _decrypt_timeseal(s):
+    """ Undo the timeseal 1 encryption.  Returns the decrypted
+    string, or None if the line is malformed. """
+    l = len(s)
+    if l % 12 != 1:
+        return None
+    offset = ord(s[-1]) - 0x80
+    key = _timeseal_key
+    tmp = [chr(((ord(c) + 32) ^ ord(key[(n + offset) % 50]) ^ 0x80) & 0xff)
+        for (n, c) in enumerate(s)]
+    for n in range(0, l - 1, 12):
+        (tmp[n], tmp[n + 11]) = (tmp[n + 11], tmp[n])
+        (tmp[n + 2], tmp[n + 9]) = (tmp[n + 9], tmp[n + 2])
+        (tmp[n + 4], tmp[n + 7]) = (tmp[n + 7], tmp[n + 4])
+    # the C decoder treats the result as a NUL-terminated string
+    return ''.join(tmp).split('\x00', 1)[0]
 
 class Timeseal(object):
-    _timeseal_pat = re.compile(r'''^(\d+): (.*)\n$''')
-    _zipseal_pat = re.compile(r'''^([0-9a-f]+): (.*)\n$''')
-    zipseal_in = 0
-    zipseal_out = 0
+    """ The timeseal and zipseal state for a single connection.  The
+    Huffman tables are shared, so this just keeps statistics, but
+    it gives each connection its own codec to call without going
+    through a shared helper process. """
+    _timeseal_pat = re.compile(r'''^(\d+)$''')
+    _zipseal_pat = re.compile(r'''^[0-9a-f]+$''')
+
     def __init__(self):
-        self.timeseal = subprocess.Popen(['timeseal/openseal_decoder'], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-        self.zipseal_decoder = subprocess.Popen(['timeseal/zipseal_decoder'], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-        self.zipseal_encoder = subprocess.Popen(['timeseal/zipseal_encoder'], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+        self.zipseal_in = 0
+        self.zipseal_out = 0
 
     def decode_timeseal(self, line):
-        self.timeseal.stdin.write(line + '\n')
-        dec = self.timeseal.stdout.readline()
-        m = self._timeseal_pat.match(dec)
+        dec = _decrypt_timeseal(line)
+        if dec is None:
+            # malformed; pass the line through with a timestamp of 0
+            return (0, line)
+        i = dec.find('\x18')
+        if i == -1:
+            return (0, line)
+        j = dec.find('\x19', i + 1)
+        if j == -1:
+            return (0, line)
+        ts = dec[i + 1:j]
+        msg = dec[:i]
+        m = self._timeseal_pat.match(ts)
         if not m:
             print('timeseal failed to match: {{%r}}' % dec)
             return (-1, None)
-        return (int(m.group(1), 10), m.group(2))
+        return (int(ts, 10), msg)
 
     def decode_zipseal(self, line):
-        self.zipseal_decoder.stdin.write(line + '\n')
-        dec = self.zipseal_decoder.stdout.readline()
-        m = self._zipseal_pat.match(dec)
-        if not m or int(m.group(1), 16) == 0:
-            print('zipseal failed to match: {{%r}}' % dec)
+        i = line.rfind('\x18')
+        ts = line[i + 1:] if i != -1 else ''
+        if (i == -1 or not self._zipseal_pat.match(ts)
+                or int(ts, 16) == 0):
+            print('zipseal failed to match: {{%r}}' % line)
             return (-1, None)
-        return (int(m.group(1), 16), m.group(2))
+        return (int(ts, 16), line[:i])
 
     def compress_zipseal(self, line):
-        try:
-            line = line[0:1023] # XXX
-            self.zipseal_encoder.stdin.write('%04x%s' % (len(line),line))
-            count_str = self.zipseal_encoder.stdout.read(4)
-            count = int(count_str, 16)
-            ret = self.zipseal_encoder.stdout.read(count)
-        except IOError:
-            ret = None
-        else:
-            self.zipseal_in += len(line)
-            self.zipseal_out += len(ret)
+        ret = ''.join([_encode_chunk(line[i:i + _MAX_CHUNK])
+            for i in range(0, len(line), _MAX_CHUNK)])
+        self.zipseal_in += len(line)
+        self.zipseal_out += len(ret)
         return ret
 
     def print_stats(self):
-        return
         if self.zipseal_in > 0:
             print("compression statistics: %d in, %d out, ratio = %.3f" %
                 (self.zipseal_in, self.zipseal_out,
                     float(self.zipseal_out) / self.zipseal_in))
 
-timeseal = Timeseal()
-
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -17,12 +17,13 @@
 #
 
 import re
-import bcrypt
 import random
 import string
 import datetime
 import pytz
 
+from twisted.internet import defer, reactor
+
 import admin
 import var
 import channel
@@ -31,9 +32,12 @@ import connection
 import rating
 import speed_variant
 import lang
+import timer
 
 from server import server
-from db import db
+from passwd import passwd_service
+from db import db, adb, log_error
+from journal import journal
 from online import online
 from config import config
 
@@ -55,7 +59,9 @@ class BaseUser(object):
     def __hash__(self):
         return hash(self.name)
 
-    def log_on(self, conn):
+    def log_on(self, conn, data):
+        """ Log the user on.  data is what get_log_on_data() fetched
+        from the database, so that nothing here waits for a query. """
         self.vars.update(var.varlist.get_transient_vars())
         self.aliases = {}
         self.notifiers = set()
@@ -65,24 +71,28 @@ class BaseUser(object):
         self.noplay = set()
         self.session = conn.session
         self.session.set_user(self)
-        db.user_log(self.name, login=True, ip=conn.ip)
+        adb.serial(self.name).user_log(self.name, login=True,
+            ip=conn.ip).addErrback(log_error, 'user_log')
         notify.notify_pin(self, arrived=True)
         self.is_online = True
         online.add(self)
+        timer.start_user(self)
         if not self.session.ivars['nowrap']:
             conn.transport.enableWrapping(self.vars['width'])
         self.write(server.get_copyright_notice())
-        self.write(db.get_server_message('motd'))
+        self.write(data['motd'])
         for ch in self.channels:
             channel.chlist[ch].log_on(self)
 
     def log_off(self):
         assert(self.is_online)
 
-        db.user_log(self.name, login=False, ip=self.session.conn.ip)
+        adb.serial(self.name).user_log(self.name, login=False,
+            ip=self.session.conn.ip).addErrback(log_error, 'user_log')
 
         for ch in self.channels:
             channel.chlist[ch].log_off(self)
+        timer.stop_user(self)
         self.session.close()
         self.is_online = False
         online.remove(self)
@@ -232,7 +242,7 @@ class BaseUser(object):
 
     def save_history(self, game_id, result_char, user_rating, color_char,
             opp_name, opp_rating, eco, flags, initial_time, inc,
-            result_reason, when_ended, movetext, idn):
+            result_reason, when_ended, movetext, compact_moves, idn):
         assert(self._history is not None)
         if len(self._history) == 0:
             num = 0
@@ -245,7 +255,7 @@ class BaseUser(object):
             'opp_name': opp_name, 'opp_rating': opp_rating, 'eco': eco,
             'flags' : flags, 'time': initial_time, 'inc' : inc,
             'result_reason': result_reason, 'when_ended': when_ended,
-            'movetext': movetext, 'idn': idn
+            'movetext': movetext, 'compact_moves': compact_moves, 'idn': idn
         }
         self._history.append(entry)
         return entry
@@ -343,21 +353,22 @@ class RegUser(BaseUser):
         self.is_muzzled = u['user_muzzled']
         self.is_muted = u['user_muted']
         self.is_guest = False
-        self.channels = db.user_get_channels(self.id)
-        self.vars = db.user_get_vars(self.id,
-            var.varlist.get_persistent_var_names())
+        if 'vars' not in u:
+            _load_profile(db, u, var.varlist.get_persistent_var_names())
+        self.channels = u['channels']
+        self.vars = u['vars']
 
         self.vars['formula'] = None
         for num in range(1, 10):
             self.vars['f' + str(num)] = None
 
-        for f in db.user_get_formula(self.id):
+        for f in u['formula']:
             if f['num'] == 0:
                 self.vars['formula'] = f['f']
             else:
                 self.vars['f' + str(f['num'])] = f['f']
         assert('formula' in self.vars)
-        for note in db.user_get_notes(self.id):
+        for note in u['notes']:
             self.notes[note['num']] = note['txt']
         self._rating = None
         self.tz = pytz.timezone(self.vars['tzone'])
@@ -377,11 +388,13 @@ class RegUser(BaseUser):
             self._load_titles()
         return BaseUser.get_display_name(self)
 
-    def _load_titles(self):
+    def _load_titles(self, rows=None):
+        if rows is None:
+            rows = db.user_get_titles(self.id)
         disp_list = []
         self._titles = set()
         self._on_duty_titles = set()
-        for t in db.user_get_titles(self.id):
+        for t in rows:
             if t['title_flag'] and t['title_light']:
                 disp_list.append('(%s)' % t['title_flag'])
                 self._on_duty_titles.add(t['title_name'])
@@ -392,7 +405,12 @@ class RegUser(BaseUser):
         db.toggle_title_light(self.id, title_id)
         self._load_titles()
 
-    def log_on(self, conn):
+    def get_log_on_data(self):
+        """ Fetch everything log_on() needs from the database in one
+        round trip, without blocking.  Returns a Deferred. """
+        return log_on_batch.get(self)
+
+    def log_on(self, conn, data):
         if online.is_online(self.name):
             conn.write(_("**** %s is already logged in; closing the other connection. ****\n" % self.name))
             u = online.find_exact(self.name)
@@ -400,9 +418,14 @@ class RegUser(BaseUser):
             #u.session.conn.write(_("**** %s has arrived - you can't both be logged in. ****\n\n") % self.name)
             u.session.conn.loseConnection('logged in again')
 
-        BaseUser.log_on(self, conn)
+        # these are loaded lazily otherwise, but we have them already
+        self._load_titles(data['titles'])
+        self._load_ratings(data['ratings'])
+        self._censor = set([dbu['user_name'] for dbu in data['censored']])
 
-        news = db.get_news_since(self.last_logout, is_admin=False)
+        BaseUser.log_on(self, conn, data)
+
+        news = data['news']
         if news:
             conn.write(ngettext('There is %d new news item since your last login:\n',
                 'There are %d new news items since your last login:\n', len(news))
@@ -414,7 +437,7 @@ class RegUser(BaseUser):
             conn.write(_('There are no new news items.\n'))
         conn.write('\n')
 
-        (mcount, ucount) = db.get_message_count(self.id)
+        (mcount, ucount) = data['message_count']
         assert(mcount >= 0)
         assert(ucount >= 0)
         conn.write(ngettext('You have %(mcount)d message (%(ucount)d unread).\n',
@@ -422,59 +445,63 @@ class RegUser(BaseUser):
             {'mcount': mcount, 'ucount': ucount})
         conn.write(_('Use "messages u" to view unread messages and "clearmessages *" to clear all.\n'))
 
-        for dbu in db.user_get_notified(self.id):
+        for dbu in data['notified']:
             name = dbu['user_name']
             self.notified.add(name)
 
         nlist = []
-        for dbu in db.user_get_notifiers(self.id):
+        for dbu in data['notifiers']:
             name = dbu['user_name']
             self.notifiers.add(name)
             if online.is_online(name):
                 nlist.append(name)
-        notify.notify_users(self, arrived=True)
+        notify.notify_users(self, arrived=True, adjourned=data['adjourned'])
 
         if nlist:
             self.write(_('Present company includes: %s\n') % ' '.join(nlist))
 
         # gnotify
         self.gnotifiers = set([dbu['user_name']
-            for dbu in db.user_get_gnotifiers(self.id)])
+            for dbu in data['gnotifiers']])
         self.gnotified = set([dbu['user_name']
-            for dbu in db.user_get_gnotified(self.id)])
+            for dbu in data['gnotified']])
 
-        for a in db.user_get_aliases(self.id):
+        for a in data['aliases']:
             self.aliases[a['name']] = a['val']
 
-        #for dbu in db.user_get_censored(self.id):
-        #    self.censor.add(dbu['user_name'])
-        for dbu in db.user_get_noplayed(self.id):
+        for dbu in data['noplayed']:
             self.noplay.add(dbu['user_name'])
 
-        self.get_history()
+        if self._history is None:
+            self._history = list(data['history'])
 
     def log_off(self):
         notify.notify_users(self, arrived=False)
         BaseUser.log_off(self)
-        db.user_set_last_logout(self.id)
+        adb.serial(self.name).user_set_last_logout(self.id).addErrback(
+            log_error, 'user_set_last_logout')
 
     def get_log(self):
         return db.user_get_log(self.name)
 
     def set_passwd(self, passwd):
-        self.passwd_hash = bcrypt.hashpw(passwd, bcrypt.gensalt())
-        db.user_set_passwd(self.id, self.passwd_hash)
+        """ Returns a Deferred that fires once the password is set. """
+        def hashed(pwhash):
+            self.passwd_hash = pwhash
+            db.user_set_passwd(self.id, self.passwd_hash)
+        return passwd_service.hash(passwd).addCallback(hashed)
 
     def set_admin_level(self, level):
         BaseUser.set_admin_level(self, level)
         db.user_set_admin_level(self.id, level)
 
-    # check if an unencrypted password is correct
+    # check if an unencrypted password is correct; returns a Deferred
+    # that fires with True or False
     def check_passwd(self, passwd):
         # don't perform expensive computation on arbitrarily long data
         if not is_legal_passwd(passwd):
-            return False
-        return bcrypt.hashpw(passwd, self.passwd_hash) == self.passwd_hash
+            return defer.succeed(False)
+        return passwd_service.check(passwd, self.passwd_hash)
 
     def remove(self):
         return db.user_delete(self.id)
@@ -572,14 +599,6 @@ class RegUser(BaseUser):
             self._load_titles()
         return BaseUser.get_titles(self)
 
-    def save_history(self, game_id, result_char, user_rating, color_char,
-            opp_name, opp_rating, eco, flags, initial_time, inc,
-            result_reason, when_ended, movetext, idn):
-        entry = BaseUser.save_history(self, game_id, result_char, user_rating,
-            color_char, opp_name, opp_rating, eco, flags, initial_time, inc,
-            result_reason, when_ended, movetext, idn)
-        db.user_add_history(entry, self.id)
-
     def clear_history(self):
         BaseUser.clear_history(self)
         db.user_del_history(self.id)
@@ -593,20 +612,30 @@ class RegUser(BaseUser):
             return rating.NoRating(is_guest=False)
 
     def set_rating(self, speed_variant,
-            rating, rd, volatility, win, loss, draw, ltime):
-        db.user_set_rating(self.id, speed_variant.speed.id_,
-            speed_variant.variant.id_, rating, rd, volatility, win, loss,
-            draw, win + loss + draw, ltime)
-        self._load_ratings() # TODO: don't reload all ratings
+            urating, rd, volatility, win, loss, draw, ltime):
+        journal.add_rating(self.id, speed_variant.speed.id_,
+            speed_variant.variant.id_, urating, rd, volatility, win, loss,
+            draw, ltime)
+
+        # update our copy rather than reading back what we just wrote
+        if self._rating is None:
+            self._load_ratings()
+        old = self._rating.get(speed_variant)
+        (best, when_best) = (old.best, old.when_best) if old else (None, None)
+        # the rating column is an integer
+        self._rating[speed_variant] = rating.Rating(int(round(urating)), rd,
+            volatility, ltime, win, loss, draw, best, when_best)
 
     def del_rating(self, sv):
         db.user_del_rating(self.id, sv.speed.id_, sv.variant.id_)
         if self._rating is not None and sv in self._rating:
             del self._rating[sv]
 
-    def _load_ratings(self):
+    def _load_ratings(self, rows=None):
+        if rows is None:
+            rows = db.user_get_all_ratings(self.id)
         self._rating = {}
-        for row in db.user_get_all_ratings(self.id):
+        for row in rows:
             sv = speed_variant.from_ids(row['speed_id'],
                 row['variant_id'])
             self._rating[sv] = rating.Rating(row['rating'],
@@ -674,10 +703,16 @@ class GuestUser(BaseUser):
         self.is_playbanned = False
         self.tz = pytz.timezone(self.vars['tzone'])
 
-    def log_on(self, conn):
+    def get_log_on_data(self):
+        """ Fetch what log_on() needs from the database without
+        blocking.  Returns a Deferred. """
+        return adb.get_server_message('motd').addCallback(
+            lambda motd: {'motd': motd})
+
+    def log_on(self, conn, data):
         self._titles = set(['unregistered'])
         self._title_str = '(U)'
-        BaseUser.log_on(self, conn)
+        BaseUser.log_on(self, conn, data)
         self._history = []
 
     def get_log(self):
@@ -707,6 +742,12 @@ def _check_name(name, min_len):
     elif not username_re.match(name):
         raise UsernameException(_('Names should only consist of lower and upper case letters.  Try again.\n'))
 
+def _load_profile(db_, u, vnames):
+    """ Add the rest of what RegUser needs to the row u from the
+    user table. """
+    u.update(db_.user_get_profile(u['user_name'], vnames))
+    return u
+
 username_re = re.compile('^[a-zA-Z_]+$')
 def find_by_name_exact(name,
         min_len=config.min_login_name_len, online_only=False):
@@ -714,11 +755,31 @@ def find_by_name_exact(name,
     _check_name(name, min_len)
     u = online.find_exact(name)
     if not u and not online_only:
-        dbu = db.user_get(name)
+        dbu = db.user_get_profile(name,
+            var.varlist.get_persistent_var_names())
         if dbu:
             u = RegUser(dbu)
     return u
 
+def find_by_name_exact_d(name,
+        min_len=config.min_login_name_len, online_only=False):
+    """ Like find_by_name_exact(), but offline users are looked up
+    without blocking.  Returns a Deferred that fires with the user,
+    or None.  Raises UsernameException for invalid names. """
+    _check_name(name, min_len)
+    u = online.find_exact(name)
+    if u or online_only:
+        return defer.succeed(u)
+    d = adb.user_get_profile(name, var.varlist.get_persistent_var_names())
+    def got_user(dbu):
+        # the user may have logged on while we were waiting
+        u = online.find_exact(name)
+        if not u and dbu:
+            u = RegUser(dbu)
+        return u
+    d.addCallback(got_user)
+    return d
+
 def _find_by_prefix(name, online_only=False):
     """ Find a user but allow the name to abbreviated if
     it is unambiguous; if the name is not an exact match, prefer
@@ -799,6 +860,41 @@ def find_by_name_exact_for_user(name, conn, min_len=config.min_login_name_len,
             conn.write(_('There is no player matching the name "%s".\n') % name)
     return u
 
+class LogOnBatch(object):
+    """ Registered users who log on in the same reactor iteration, as
+    many do when clients reconnect after a restart, have their data
+    read together in one round trip to the database.  There are no
+    more of them than config.max_logins_in_progress. """
+    def __init__(self):
+        self.pending = []
+        self.call = None
+
+    def get(self, u):
+        """ Returns a Deferred that fires with the data log_on()
+        needs for u. """
+        d = defer.Deferred()
+        self.pending.append((u.id, u.last_logout, d))
+        if self.call is None:
+            self.call = reactor.callLater(0, self.flush)
+        return d
+
+    def flush(self):
+        self.call = None
+        (batch, self.pending) = (self.pending, [])
+        def got(results):
+            for ((user_id, last_logout, d), data) in zip(batch, results):
+                d.callback(data)
+        def failed(failure):
+            for (user_id, last_logout, d) in batch:
+                d.errback(failure)
+        adb.user_get_log_on_many([(user_id, last_logout)
+            for (user_id, last_logout, d) in batch]).addCallbacks(got, failed)
+
+try:
+    log_on_batch
+except NameError:
+    log_on_batch = LogOnBatch()
+
 # test whether a string meets the requirements for a password
 def is_legal_passwd(passwd):
     if len(passwd) > 32:
@@ -820,10 +916,13 @@ def make_passwd():
     return ret
 
 def add_user(name, email, passwd, real_name):
-    pwhash = bcrypt.hashpw(passwd, bcrypt.gensalt())
-    user_id = db.user_add(name, email, pwhash, real_name, admin.Level.user)
-    for chid in channel.chlist.get_default_channels():
-        db.channel_add_user(chid, user_id)
-    return user_id
+    """ Returns a Deferred that fires with the new user's id. """
+    def hashed(pwhash):
+        user_id = db.user_add(name, email, pwhash, real_name,
+            admin.Level.user)
+        for chid in channel.chlist.get_default_channels():
+            db.channel_add_user(chid, user_id)
+        return user_id
+    return passwd_service.hash(passwd).addCallback(hashed)
 
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -65,6 +65,11 @@ def _set_gin_var(user, val):
         if user in online.online.gin_var:
             online.online.gin_var.remove(user)
 
+def _set_seek_var(user, val):
+    """ Called when the seek var or the seekinfo or seekremove ivars
+    are set. """
+    online.online.update_seek_sets(user)
+
 class Var(object):
     """This class represents the form of a variable but does not hold
     a specific value.  For example, the server has one global instance of
@@ -169,7 +174,7 @@ class FormulaVar(Var):
             if len(val) > self.max_len:
                 raise BadVarError()
             try:
-                formula.check_formula(None, val, self.num)
+                formula.compile_formula(val, self.num)
             except formula.FormulaError:
                 raise BadVarError()
             user.set_formula(self, val)
@@ -296,7 +301,7 @@ class VarList(object):
         BoolVar("notifiedby", True, N_("You will now hear if people notify you, but you don't notify them.\n"), N_("You will not hear if people notify you, but you don't notify them.\n")).persist().add_as_var()
         BoolVar("minmovetime", True, N_("You will request minimum move time when games start.\n"), N_("You will not request minimum move time when games start.\n")).persist().add_as_var()
         BoolVar("noescape", True, N_("You will request noescape when games start..\n"), N_("You will not request noescape when games start.\n")).persist().add_as_var()
-        BoolVar("seek", True, N_("You will now see seek ads.\n"), N_("You will not see seek ads.\n")).persist().add_as_var()
+        BoolVar("seek", True, N_("You will now see seek ads.\n"), N_("You will not see seek ads.\n")).persist().add_as_var().set_hook(_set_seek_var)
         #BoolVar("echo", True, N_("You will not hear communications echoed.\n"), N_("You will now not hear communications echoed.\n")).persist().add_as_var()
         BoolVar("examine", False, N_("You will now enter examine mode after a game.\n"), N_("You will now not enter examine mode after a game.\n")).persist().add_as_var()
         BoolVar("mailmess", False, N_("Your messages will be mailed to you.\n"), N_("Your messages will not be mailed to you.\n")).persist().add_as_var()
@@ -344,7 +349,7 @@ class VarList(object):
         # "help iv_list" on original FICS has this list
         BoolVar("compressmove", False).add_as_ivar(0)
         BoolVar("audiochat", False).add_as_ivar(1)
-        BoolVar("seekremove", False).add_as_ivar(2)
+        BoolVar("seekremove", False).add_as_ivar(2).set_hook(_set_seek_var)
         BoolVar("defprompt", False).add_as_ivar(3)
         BoolVar("lock", False).add_as_ivar(4)
         BoolVar("startpos", False).add_as_ivar(5)
@@ -353,7 +358,7 @@ class VarList(object):
         BoolVar("xdr", False).add_as_ivar(8) # ignored
         BoolVar("pendinfo", False).add_as_ivar(9)
         BoolVar("graph", False).add_as_ivar(10)
-        BoolVar("seekinfo", False).add_as_ivar(11)
+        BoolVar("seekinfo", False).add_as_ivar(11).set_hook(_set_seek_var)
         BoolVar("extascii", False).add_as_ivar(12)
         BoolVar("nohighlight", False).add_as_ivar(13)
         BoolVar("highlight", False).add_as_ivar(14)
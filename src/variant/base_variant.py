@@ -16,6 +16,9 @@
 # along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import sys
+from array import array
+
 import time_format
 
 from game_constants import *
@@ -24,17 +27,108 @@ class IllegalMoveError(Exception):
     def __init__(self, reason):
         self.reason = reason
 
+# Stored games keep their moves in a compact form as well as SAN, so
+# they can be replayed without parsing.  Each move is 16 bits: the
+# destination square in bits 0-5, the source square (or for a drop,
+# the index of the piece in COMPACT_DROP_PCS) in bits 6-11, and the
+# kind of move in bits 12-15.  Squares are numbered 0-63 as rank * 8 +
+# file.  Moves are packed two bytes each, little-endian.
+COMPACT_NORMAL = 0
+# kinds 1 to 4 are promotions to the pieces of COMPACT_PROM_PCS
+COMPACT_PROM_PCS = 'nbrq'
+COMPACT_OO = 5
+COMPACT_OOO = 6
+COMPACT_DROP = 7
+COMPACT_DROP_PCS = 'pnbrq'
+
+def compact_code(fr, to, prom=None, is_oo=False, is_ooo=False,
+        drop=None):
+    """ Pack a move.  Squares are 0x88 squares; prom and drop are
+    piece letters of either case. """
+    if is_oo:
+        return COMPACT_OO << 12
+    if is_ooo:
+        return COMPACT_OOO << 12
+    to = rank(to) << 3 | file(to)
+    if drop:
+        return (COMPACT_DROP << 12 |
+            COMPACT_DROP_PCS.index(drop.lower()) << 6 | to)
+    code = (rank(fr) << 3 | file(fr)) << 6 | to
+    if prom:
+        code |= (COMPACT_PROM_PCS.index(prom.lower()) + 1) << 12
+    return code
+
+def split_compact(code):
+    """ Unpack a move packed by compact_code(), returning (kind, fr,
+    to, pc).  The kind is COMPACT_NORMAL for promotions too; pc is the
+    lowercase promotion or drop piece, or None.  fr is None for drops
+    and castling, as is to for castling. """
+    kind = code >> 12
+    if kind == COMPACT_OO or kind == COMPACT_OOO:
+        return (kind, None, None, None)
+    to = (code & 0x38) << 1 | code & 0x7
+    if kind == COMPACT_DROP:
+        return (kind, None, to, COMPACT_DROP_PCS[(code >> 6) & 0x3f])
+    fr = (code & 0xe00) >> 5 | (code >> 6) & 0x7
+    if kind == COMPACT_NORMAL:
+        return (kind, fr, to, None)
+    return (COMPACT_NORMAL, fr, to, COMPACT_PROM_PCS[kind - 1])
+
+def encode_compact(codes):
+    """ Pack a list of move codes into a string of bytes. """
+    a = array('H', codes)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tostring()
+
+def decode_compact(s):
+    """ Unpack a string of bytes made by encode_compact(). """
+    a = array('H')
+    a.fromstring(s)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tolist()
+
 class BaseVariant(object):
     """ Methods common to all variants. """
-    def to_style1(self, user):
-        """ A human-readable board. """
+    def get_compact_moves(self):
+        """ The moves played so far, packed by encode_compact(). """
+        pos = self.pos
+        return encode_compact([pos.history.get_move(i).to_compact()
+            for i in xrange(pos.start_ply, pos.ply)])
+
+    def parse_stored_move(self, m):
+        """ Make a Move from a move of a stored game: either a (code,
+        SAN) pair from its compact moves, or for games stored before
+        there were compact moves, SAN to be parsed. """
+        if isinstance(m, tuple):
+            (code, san) = m
+            mv = self.pos.move_from_compact(code)
+            # saves working out the SAN again in do_move(), which adds
+            # the check or mate sign back
+            mv._san = san.rstrip('+#')
+            return mv
+        mv = self.parse_move(m, None)
+        if not mv:
+            raise IllegalMoveError('bad stored move %s' % m)
+        return mv
+
+    def style1_view(self, user):
+        """ The parts of a style 1 board that depend on the user: the
+        side at the bottom and whether to show milliseconds. """
         if self.game.gtype == PLAYED and user == self.game.black:
             side = BLACK
         else:
             side = WHITE
         if user.vars['flip']:
             side = opp(side)
+        return (side, bool(user.session.ivars['ms']))
 
+    def to_style1(self, user):
+        """ A human-readable board. """
+        return self.render_style1(*self.style1_view(user))
+
+    def render_style1(self, side, ms):
         s = []
         s.append('\nGame %d: ' % self.game.number)
         s.append(self.game.info_str + '\n')
@@ -58,7 +152,7 @@ class BaseVariant(object):
             s.append('    %d  |' % rank)
             for f in range(0,  8):
                 file_ = f + 1 if side == WHITE else 8 - f
-                piece_char = self.pos.board[0x10 * (rank - 1) + file_ - 1]
+                piece_char = self.pos.piece_at(0x10 * (rank - 1) + file_ - 1)
                 if piece_char == '-':
                     piece_char = ' '
                 elif piece_char.islower():
@@ -71,7 +165,7 @@ class BaseVariant(object):
             elif r == 1:
                 last_mv = self.pos.get_last_move()
                 if last_mv is not None:
-                    last_move_time_str = time_format.hms(last_mv.time, user)
+                    last_move_time_str = time_format.hms_ms(last_mv.time, ms)
                     side_str = 'Black' if self.pos.wtm else 'White'
                     s.append("     %s Moves : '%-7s (%s)'" % (side_str,
                         last_mv.to_san(), last_move_time_str))
@@ -80,13 +174,13 @@ class BaseVariant(object):
                     black_time = 0
                 else:
                     black_time = self.game.clock.get_black_time()
-                s.append('     Black Clock : %s' % time_format.hms(black_time, user))
+                s.append('     Black Clock : %s' % time_format.hms_ms(black_time, ms))
             elif r == 4:
                 if self.game.gtype == EXAMINED:
                     white_time = 0
                 else:
                     white_time = self.game.clock.get_white_time()
-                s.append('     White Clock : %s' % time_format.hms(white_time, user))
+                s.append('     White Clock : %s' % time_format.hms_ms(white_time, ms))
             elif r == 5:
                 s.append('     Black Strength : %d' % self.pos.material[0])
             elif r == 6:
@@ -109,20 +203,10 @@ class BaseVariant(object):
         s.append('\n')
         return ''.join(s)
 
-    def to_style12(self, user):
-        """ returns a style12 string for a given user """
-        # <12> rnbqkbnr pppppppp -------- -------- -------- -------- PPPPPPPP RNBQKBNR W -1 1 1 1 1 0 473 GuestPPMD GuestCWVQ -1 1 0 39 39 60000 60000 1 none (0:00.000) none 1 0 0
-        board_str = ''
-        for r in range(7, -1, -1):
-            board_str += ' '
-            for f in range(8):
-                board_str += self.pos.board[0x10 * r + f]
-        side_str = 'W' if self.pos.wtm else 'B'
-        ep = -1 if not self.pos.ep else file(self.pos.ep)
-        w_oo = int(self.pos.check_castle_flags(True, True))
-        w_ooo = int(self.pos.check_castle_flags(True, False))
-        b_oo = int(self.pos.check_castle_flags(False, True))
-        b_ooo = int(self.pos.check_castle_flags(False, False))
+    def style12_view(self, user):
+        """ The parts of a style 12 board that depend on the user:
+        the relation to the game, whether the board is flipped, and
+        whether to show milliseconds. """
         if self.game.gtype == EXAMINED:
             flip = 0
             if user in self.game.players:
@@ -131,11 +215,6 @@ class BaseVariant(object):
                 relation = -2
             else:
                 relation = -3
-            white_clock = 0
-            black_clock = 0
-            white_name = list(self.game.players)[0].name
-            black_name = list(self.game.players)[0].name
-            clock_is_ticking = 0
         elif self.game.gtype == PLAYED:
             if self.game.white == user:
                 relation = 1 if self.pos.wtm else -1
@@ -149,7 +228,35 @@ class BaseVariant(object):
             else:
                 relation = -3
                 flip = 0
-            if user.session.ivars['ms']:
+        else:
+            assert(False)
+        return (relation, flip, bool(user.session.ivars['ms']))
+
+    def to_style12(self, user):
+        """ returns a style12 string for a given user """
+        return self.render_style12(*self.style12_view(user))
+
+    def render_style12(self, relation, flip, ms):
+        # <12> rnbqkbnr pppppppp -------- -------- -------- -------- PPPPPPPP RNBQKBNR W -1 1 1 1 1 0 473 GuestPPMD GuestCWVQ -1 1 0 39 39 60000 60000 1 none (0:00.000) none 1 0 0
+        board_str = ''
+        for r in range(7, -1, -1):
+            board_str += ' '
+            for f in range(8):
+                board_str += self.pos.piece_at(0x10 * r + f)
+        side_str = 'W' if self.pos.wtm else 'B'
+        ep = -1 if not self.pos.ep else file(self.pos.ep)
+        w_oo = int(self.pos.check_castle_flags(True, True))
+        w_ooo = int(self.pos.check_castle_flags(True, False))
+        b_oo = int(self.pos.check_castle_flags(False, True))
+        b_ooo = int(self.pos.check_castle_flags(False, False))
+        if self.game.gtype == EXAMINED:
+            white_clock = 0
+            black_clock = 0
+            white_name = list(self.game.players)[0].name
+            black_name = list(self.game.players)[0].name
+            clock_is_ticking = 0
+        else:
+            if ms:
                 white_clock = int(round(1000 * self.game.clock.get_white_time()))
                 black_clock = int(round(1000 * self.game.clock.get_black_time()))
             else:
@@ -158,18 +265,16 @@ class BaseVariant(object):
             white_name = self.game.white.name
             black_name = self.game.black.name
             clock_is_ticking = int(self.game.clock.is_ticking)
-        else:
-            assert(False)
         full_moves = self.pos.ply // 2 + 1
         last_mv = self.pos.get_last_move()
         if last_mv is None:
-            last_move_time_str = time_format.hms(0.0, user)
+            last_move_time_str = time_format.hms_ms(0.0, ms)
             last_move_san = 'none'
             last_move_verbose = 'none'
             last_move_lag = 0
         else:
             assert(last_mv.time is not None)
-            last_move_time_str = time_format.hms(last_mv.time, user)
+            last_move_time_str = time_format.hms_ms(last_mv.time, ms)
             last_move_san = last_mv.to_san()
             last_move_verbose = last_mv.to_verbose_alg()
             last_move_lag = last_mv.lag
@@ -22,7 +22,8 @@ import random
 from array import array
 
 from game_constants import *
-from base_variant import BaseVariant, IllegalMoveError
+from base_variant import (BaseVariant, IllegalMoveError,
+    compact_code, split_compact, COMPACT_OO, COMPACT_OOO, COMPACT_DROP)
 
 """
 0x88 board representation; pieces are represented as ASCII,
@@ -126,6 +127,10 @@ class Zobrist(object):
 zobrist = Zobrist()
 
 class Move(object):
+    __slots__ = ['pos', 'fr', 'to', 'pc', 'prom', 'is_oo', 'is_ooo',
+        'capture', 'is_capture', 'is_ep', 'new_ep', 'drop', 'time',
+        '_san', '_verbose_alg', 'lag', 'undo']
+
     def __init__(self, pos, fr, to, prom=None, is_oo=False,
             is_ooo=False, is_ep=False, new_ep=None, drop=None):
         self.pos = pos
@@ -232,6 +237,7 @@ class Move(object):
             if (self.pos.in_check
                     or not self.pos.check_castle_flags(self.pos.wtm, True)
                     or self.pos.board[self.fr + 1] != '-'
+                    or self.pos.board[self.to] != '-'
                     or self.pos.under_attack(self.fr + 1, not self.pos.wtm)
                     or self.pos.under_attack(self.to, not self.pos.wtm)):
                 raise IllegalMoveError('illegal castling')
@@ -241,6 +247,8 @@ class Move(object):
             if (self.pos.in_check
                     or not self.pos.check_castle_flags(self.pos.wtm, False)
                     or self.pos.board[self.fr - 1] != '-'
+                    or self.pos.board[self.to] != '-'
+                    or self.pos.board[self.to - 1] != '-'
                     or self.pos.under_attack(self.fr - 1, not self.pos.wtm)
                     or self.pos.under_attack(self.to, not self.pos.wtm)):
                 raise IllegalMoveError('illegal castling')
@@ -329,9 +337,15 @@ class Move(object):
         else:
             return True
 
+    def to_compact(self):
+        """ The move packed by compact_code(). """
+        return compact_code(self.fr, self.to, self.prom, self.is_oo,
+            self.is_ooo, self.drop)
+
 class Undo(object):
     """information needed to undo a move"""
-    pass
+    __slots__ = ['ep', 'in_check', 'castle_flags', 'material', 'hash',
+        'holding_pc', 'capture_was_promoted']
 
 class PositionHistory(object):
     """keeps past of past positions for repetition detection"""
@@ -355,6 +369,15 @@ class PositionHistory(object):
     def get_move(self, ply):
         return self.moves[ply]
 
+    def __deepcopy__(self, memo):
+        # Moves are not changed once they have been made, so a copy of
+        # a position, such as a snapshot in examine mode, shares them.
+        # Copying every move and its undo information is slow.
+        ret = PositionHistory()
+        ret.hashes = self.hashes[:]
+        ret.moves = self.moves[:]
+        return ret
+
 class Position(object):
     def __init__(self, fen):
         self.board = array('c', 0x80 * ['-'])
@@ -504,6 +527,10 @@ class Position(object):
                 sq = 0x10 * r + f
                 yield (sq, self.board[sq])
 
+    def piece_at(self, sq):
+        """ The FEN character for the piece on a square, or '-'. """
+        return self.board[sq]
+
     def add_to_holding(self, pc, update_hash):
         count = self.holding[pc]
         assert(0 <= count <= 15)
@@ -516,6 +543,10 @@ class Position(object):
             self.hash ^= zobrist.holding_hash(pc, count + 1)
             self.material[pc.isupper()] += piece_material[pc.lower()]
 
+    def add_holding(self, pc):
+        """ Put a piece in holding, for setting up a position. """
+        self.add_to_holding(pc, True)
+
     def remove_from_holding(self, pc, update_hash):
         count = self.holding[pc]
         assert(1 <= count <= 16)
@@ -720,7 +751,8 @@ class Position(object):
             self.board[mv.fr] = mv.pc
         self.in_check = mv.undo.in_check
         self.castle_flags = mv.undo.castle_flags
-        self.material = mv.undo.material
+        # a copy, since a snapshot may share the move
+        self.material = mv.undo.material[:]
         self.hash = mv.undo.hash
 
         if mv.pc == 'k':
@@ -816,8 +848,8 @@ class Position(object):
     def detect_check(self):
         """detect whether the player to move is in check, checkmated,
         or stalemated"""
-        self.in_check = self.under_attack(self.king_pos[self.wtm],
-            not self.wtm)
+        self.checkers = self._get_checkers()
+        self.in_check = bool(self.checkers)
 
         self.is_checkmate = False
         self.is_stalemate = False
@@ -828,24 +860,15 @@ class Position(object):
             return
 
         # try drops
-        # get the first piece in holding, if any
         if self.in_check:
-            # first, see if any drop will ever be possible to block the check,
-            # and only then check if we currently have a piece capable
-            # of blocking it
-
-            for (pc, count) in self.holding.items():
-                if pc.isupper() == self.wtm and count > 0:
-                    # we have at least one piece in holding
-                    # try dropping at all empty sqares adjacent to king;
-                    # note that trying drops farther away is superfluous
-                    for d in piece_moves['k']:
-                        if self._is_pc_at('-', ksq + d):
-                            if pc in ['p', 'P'] and rank(ksq + d) in [0, 7]:
-                                # can't drop a pawn on the first or last rank
-                                continue
-                            if Move(self, None, ksq + d, drop=pc).is_legal():
-                                return
+            block_sq = self._get_drop_block_sq()
+            if block_sq is not None:
+                for (pc, count) in self.holding.iteritems():
+                    if pc.isupper() == self.wtm and count > 0:
+                        if pc in ['p', 'P'] and rank(block_sq) in [0, 7]:
+                            # can't drop a pawn on the first or last rank
+                            continue
+                        return
         else:
             # if the player has any pieces in holding, then there
             # is a legal move
@@ -863,22 +886,59 @@ class Position(object):
         # there are no legal moves
         if self.in_check:
             self.is_checkmate = True
-            # check whether we can ever block the checkmate by dropping
-            # a piece
-            self.is_contact_or_knight_mate = True
-            # any piece would work
-            drop_pc = 'N' if self.wtm else 'n'
-            self.add_to_holding(drop_pc, True)
-            for d in piece_moves['k']:
-                if self._is_pc_at('-', ksq + d):
-                    if Move(self, None, ksq + d, drop=drop_pc).is_legal():
-                        self.is_contact_or_knight_mate = False
-                        break
-            self.material[self.wtm] -= piece_material[drop_pc.lower()]
-            self.remove_from_holding(drop_pc, True)
+            # whether a piece from the partner's game could ever
+            # be dropped to block the checkmate
+            self.is_contact_or_knight_mate = self._get_drop_block_sq() is None
         else:
             self.is_stalemate = True
 
+    def _get_checkers(self):
+        """Find the squares of the pieces giving check to the side to
+        move."""
+        ksq = self.king_pos[self.wtm]
+        if self.wtm:
+            (ppc, npc, bpcs, rpcs) = ('p', 'n', ['b', 'q'], ['r', 'q'])
+            pawn_dirs = [0xf, 0x11]
+        else:
+            (ppc, npc, bpcs, rpcs) = ('P', 'N', ['B', 'Q'], ['R', 'Q'])
+            pawn_dirs = [-0x11, -0xf]
+        ret = []
+        for d in pawn_dirs:
+            if self._is_pc_at(ppc, ksq + d):
+                ret.append(ksq + d)
+        for d in piece_moves['n']:
+            if self._is_pc_at(npc, ksq + d):
+                ret.append(ksq + d)
+        for (dirs, pcs) in [(piece_moves['b'], bpcs),
+                (piece_moves['r'], rpcs)]:
+            for d in dirs:
+                cur_sq = ksq + d
+                while valid_sq(cur_sq):
+                    if self.board[cur_sq] != '-':
+                        if self.board[cur_sq] in pcs:
+                            ret.append(cur_sq)
+                        # square blocked
+                        break
+                    cur_sq += d
+        return ret
+
+    def _get_drop_block_sq(self):
+        """If a dropped piece can stop the check, return the square next
+        to the king where it should go, or None otherwise.  That is only
+        possible when a single sliding piece gives check from a
+        distance, and the square next to the king then blocks it no
+        matter what else is on the board."""
+        if len(self.checkers) != 1:
+            return None
+        sq = self.checkers[0]
+        if self.board[sq] not in sliding_pieces:
+            return None
+        ksq = self.king_pos[self.wtm]
+        block_sq = ksq + dir(ksq, sq)
+        if block_sq == sq:
+            return None
+        return block_sq
+
     def _pawn_cap_at(self, sq):
         if not valid_sq(sq):
             return False
@@ -1204,6 +1264,32 @@ class Position(object):
 
         return mv
 
+    def move_from_compact(self, code):
+        """ Make a Move from a code packed by compact_code().  The code
+        comes from a stored game, so the move is not checked for
+        legality. """
+        (kind, fr, to, pc) = split_compact(code)
+        if kind == COMPACT_OO:
+            if self.wtm:
+                return Move(self, E1, G1, is_oo=True)
+            return Move(self, E8, G8, is_oo=True)
+        if kind == COMPACT_OOO:
+            if self.wtm:
+                return Move(self, E1, C1, is_ooo=True)
+            return Move(self, E8, C8, is_ooo=True)
+        if pc and self.wtm:
+            pc = pc.upper()
+        if kind == COMPACT_DROP:
+            return Move(self, None, to, drop=pc)
+        is_ep = False
+        new_ep = None
+        if self.board[fr] in ['p', 'P']:
+            if to == self.ep:
+                is_ep = True
+            elif abs(to - fr) == 0x20:
+                new_ep = (fr + to) >> 1
+        return Move(self, fr, to, prom=pc, is_ep=is_ep, new_ep=new_ep)
+
     def get_from_sqs(self, pc, sq):
         '''given a piece (not including a pawn) and a destination square,
         return a list of all legal source squares'''
@@ -1222,6 +1308,70 @@ class Position(object):
                     break
         return ret
 
+    def get_legal_moves(self):
+        """ Get a list of every legal move in the position.  Each
+        candidate is tested by making and undoing it, so in_check
+        must be up to date, as it is after detect_check(). """
+        return [mv for mv in self._get_pseudo_legal_moves()
+            if mv.is_legal()]
+
+    def _get_pseudo_legal_moves(self):
+        ret = []
+        for (sq, pc) in self:
+            if pc == '-' or piece_is_white(pc) != self.wtm:
+                continue
+            if pc in ['P', 'p']:
+                self._add_pawn_moves(sq, pc, ret)
+                continue
+            for d in piece_moves[pc.lower()]:
+                cur_sq = sq + d
+                while valid_sq(cur_sq):
+                    topc = self.board[cur_sq]
+                    if topc == '-' or piece_is_white(topc) != self.wtm:
+                        ret.append(Move(self, sq, cur_sq))
+                    if topc != '-' or pc not in sliding_pieces:
+                        break
+                    cur_sq += d
+
+        # check_legal() tests everything else about castling
+        ksq = self.king_pos[self.wtm]
+        if self.check_castle_flags(self.wtm, True):
+            ret.append(Move(self, ksq, ksq + 2, is_oo=True))
+        if self.check_castle_flags(self.wtm, False):
+            ret.append(Move(self, ksq, ksq - 2, is_ooo=True))
+
+        # drops
+        for pc in 'PNBRQ' if self.wtm else 'pnbrq':
+            if self.holding[pc] == 0:
+                continue
+            for (sq, topc) in self:
+                if topc == '-' and not (pc in ['P', 'p'] and
+                        rank(sq) in [0, 7]):
+                    ret.append(Move(self, None, sq, drop=pc))
+        return ret
+
+    def _add_pawn_moves(self, sq, pc, ret):
+        if pc == 'P':
+            (d, start_rank, proms) = (0x10, 1, 'QRBN')
+        else:
+            (d, start_rank, proms) = (-0x10, 6, 'qrbn')
+        tos = []
+        if self.board[sq + d] == '-':
+            tos.append(sq + d)
+            if rank(sq) == start_rank and self.board[sq + 2 * d] == '-':
+                ret.append(Move(self, sq, sq + 2 * d, new_ep=sq + d))
+        for to in [sq + d - 1, sq + d + 1]:
+            if to == self.ep:
+                ret.append(Move(self, sq, to, is_ep=True))
+            elif self._pawn_cap_at(to):
+                tos.append(to)
+        for to in tos:
+            if rank(to) in [0, 7]:
+                for prom in proms:
+                    ret.append(Move(self, sq, to, prom=prom))
+            else:
+                ret.append(Move(self, sq, to))
+
     def is_draw_fifty(self):
         # never in bughouse
         return False
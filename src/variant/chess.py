@@ -27,40 +27,90 @@ import random
 from array import array
 
 from game_constants import *
-from variant.base_variant import BaseVariant, IllegalMoveError
+from variant.base_variant import (BaseVariant, IllegalMoveError,
+    compact_code, split_compact, COMPACT_OO, COMPACT_OOO)
 """
-0x88 board representation; pieces are represented as ASCII,
-the same as FEN. A blank square is '-'.
+0x88 board representation.  Pieces are coded as small integers: the
+piece type in the low three bits, and WHITE_PC set for white pieces.
+An empty square is 0.  FEN characters are only used for input and
+output.
 """
 
 class BadFenError(Exception):
     def __init__(self, reason=None):
         self.reason = reason
 
-piece_moves = {
-    'n': [-0x21, -0x1f, -0xe, -0x12, 0x12, 0xe, 0x1f, 0x21],
-    'b': [-0x11, -0xf, 0xf, 0x11],
-    'r': [-0x10, -1, 1, 0x10],
-    'q': [-0x11, -0xf, 0xf, 0x11, -0x10, -1, 1, 0x10],
-    'k': [-0x11, -0xf, 0xf, 0x11, -0x10, -1, 1, 0x10]
-}
+EMPTY = 0
+(PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING) = range(1, 7)
+WHITE_PC = 8
+TYPE_MASK = 7
+
+# map between piece codes and FEN characters
+pc_chars = '-pnbrqk--PNBRQK-'
+pc_codes = {}
+for (code, c) in enumerate(pc_chars):
+    if c != '-':
+        pc_codes[c] = code
+pc_codes['-'] = EMPTY
+
+piece_dirs = [
+    None,
+    None,
+    [-0x21, -0x1f, -0xe, -0x12, 0x12, 0xe, 0x1f, 0x21],
+    [-0x11, -0xf, 0xf, 0x11],
+    [-0x10, -1, 1, 0x10],
+    [-0x11, -0xf, 0xf, 0x11, -0x10, -1, 1, 0x10],
+    [-0x11, -0xf, 0xf, 0x11, -0x10, -1, 1, 0x10]
+]
+# indexed by piece type
+is_slider = [False, False, False, True, True, True, False]
+
 direction_table = array('i', [0 for i in range(0, 0x100)])
 def dir(fr, to):
     """Returns the direction a queen needs to go to get from TO to FR,
     or 0 if it's not possible."""
     return direction_table[to - fr + 0x7f]
 
-sliding_pieces = frozenset(['b', 'r', 'q', 'B', 'R', 'Q'])
-
-piece_material = {
-    '-': 0,
-    'p': 1,
-    'n': 3,
-    'b': 3,
-    'r': 5,
-    'q': 9,
-    'k': 0
-}
+def _make_step_table(dirs):
+    """ For each square, the squares one step away in each direction. """
+    table = []
+    for sq in range(0x80):
+        table.append([sq + d for d in dirs
+            if valid_sq(sq) and valid_sq(sq + d)])
+    return table
+
+def _make_ray_table(dirs):
+    """ For each square, a list of rays, each a list of the squares
+    going out in one direction up to the edge of the board. """
+    table = []
+    for sq in range(0x80):
+        rays = []
+        if valid_sq(sq):
+            for d in dirs:
+                ray = []
+                cur_sq = sq + d
+                while valid_sq(cur_sq):
+                    ray.append(cur_sq)
+                    cur_sq += d
+                if ray:
+                    rays.append(ray)
+        table.append(rays)
+    return table
+
+# indexed by piece type, then square
+piece_steps = [None, None, _make_step_table(piece_dirs[KNIGHT]), None,
+    None, None, _make_step_table(piece_dirs[KING])]
+piece_rays = [None, None, None, _make_ray_table(piece_dirs[BISHOP]),
+    _make_ray_table(piece_dirs[ROOK]), _make_ray_table(piece_dirs[QUEEN]),
+    None]
+
+# pawn_attackers[wtm][sq] is the squares from which a pawn of that side
+# attacks sq
+pawn_attackers = [_make_step_table([0xf, 0x11]),
+    _make_step_table([-0x11, -0xf])]
+
+# indexed by piece code
+piece_material = [0, 1, 3, 3, 5, 9, 0, 0] * 2
 
 def to_castle_flags(w_oo, w_ooo, b_oo, b_ooo):
     return (w_oo << 3) + (w_ooo << 2) + (b_oo << 1) + b_ooo
@@ -73,16 +123,31 @@ castle_mask[A1] = to_castle_flags(True, False, True, True)
 castle_mask[E1] = to_castle_flags(False, False, True, True)
 castle_mask[H1] = to_castle_flags(False, True, True, True)
 
+# the rook's move when castling, by the king's destination
+castle_rook_sqs = {G1: (H1, F1), C1: (A1, D1), G8: (H8, F8), C8: (A8, D8)}
+
+# A move code packs a legal move into an int: the from square, the to
+# square, the type of any promotion piece, and flags for special moves.
+MV_TO_SHIFT = 7
+MV_PROM_SHIFT = 14
+# the bits for the squares and the promotion
+MV_SQS_MASK = (1 << 17) - 1
+MV_EP = 1 << 17
+MV_OO = 1 << 18
+MV_OOO = 1 << 19
+# a pawn's two-square advance
+MV_DOUBLE = 1 << 20
+# PositionHistory adds the moving piece and the captured piece
+MV_PC_SHIFT = 21
+MV_CAPTURE_SHIFT = 25
+
 def str_to_sq(s):
     return 'abcdefgh'.index(s[0]) + 0x10 * '12345678'.index(s[1])
 
+sq_names = [('abcdefgh'[file(sq)] + '12345678'[rank(sq)]
+    if valid_sq(sq) else None) for sq in range(0x80)]
 def sq_to_str(sq):
-    return 'abcdefgh'[file(sq)] + '12345678'[rank(sq)]
-
-def piece_is_white(pc):
-    assert(len(pc) == 1)
-    assert(pc in 'pnbrqkPNBRQK')
-    return pc.isupper()
+    return sq_names[sq]
 
 class Zobrist(object):
     """Zobrist keys for low-overhead repetition detection"""
@@ -99,15 +164,19 @@ class Zobrist(object):
     def __init__(self):
         random.seed(2010)
         self.side_hash = random.getrandbits(64)
-        self._piece = self._rand_list(0x10 * 0x80)
+        keys = self._rand_list(0x10 * 0x80)
         self._ep = self._rand_list(8)
         self._castle = self._rand_list(0x10)
         random.seed()
+        # index the keys by piece code; the keys themselves are the
+        # same as when the board held FEN characters
+        self._piece = [0] * (0x10 * 0x80)
+        for (c, i) in self._piece_index.iteritems():
+            for sq in range(0x80):
+                self._piece[(pc_codes[c] << 7) | sq] = keys[(i << 7) | sq]
 
     def piece_hash(self, sq, pc):
-        assert((0xf << 7) & sq == 0)
-        assert(valid_sq(sq))
-        return self._piece[(self._piece_index[pc] << 7) | sq]
+        return self._piece[(pc << 7) | sq]
 
     def ep_hash(self, ep):
         return self._ep[file(ep)]
@@ -122,6 +191,10 @@ class Zobrist(object):
 zobrist = Zobrist()
 
 class Move(object):
+    __slots__ = ['pos', 'fr', 'to', 'pc', 'prom', 'is_oo', 'is_ooo',
+        'capture', 'is_capture', 'is_ep', 'new_ep', 'time', '_san',
+        '_verbose_alg', 'lag', 'undo']
+
     def __init__(self, pos, fr, to, prom=None, is_oo=False,
             is_ooo=False, is_ep=False, new_ep=None):
         self.pos = pos
@@ -132,7 +205,7 @@ class Move(object):
         self.is_oo = is_oo
         self.is_ooo = is_ooo
         self.capture = pos.board[to]
-        self.is_capture = self.capture != '-'
+        self.is_capture = self.capture != EMPTY
         self.is_ep = is_ep
         self.new_ep = new_ep
         self.time = None
@@ -142,15 +215,15 @@ class Move(object):
 
         # if a promotion piece is not given, assume queen
         if not self.prom:
-            if self.pc == 'p' and rank(to) == 0:
-                self.prom = 'q'
-            elif self.pc == 'P' and rank(to) == 7:
-                self.prom = 'Q'
+            if self.pc == PAWN and rank(to) == 0:
+                self.prom = QUEEN
+            elif self.pc == PAWN | WHITE_PC and rank(to) == 7:
+                self.prom = QUEEN | WHITE_PC
 
     def __str__(self):
         s = '%s%s' % (sq_to_str(self.fr), sq_to_str(self.to))
         if self.prom:
-            s += '=%s' % self.prom
+            s += '=%s' % pc_chars[self.prom]
         return s
 
     def check_pseudo_legal(self):
@@ -159,23 +232,24 @@ class Move(object):
         flags for this move. This is used for long algebraic moves,
         but not san, which does these checks implicitly."""
 
-        if self.pc == '-' or piece_is_white(self.pc) != self.pos.wtm:
+        color = WHITE_PC if self.pos.wtm else 0
+        if self.pc == EMPTY or self.pc & WHITE_PC != color:
             raise IllegalMoveError('can only move own pieces')
 
-        if self.is_capture and piece_is_white(self.capture) == self.pos.wtm:
+        if self.is_capture and self.capture & WHITE_PC == color:
             raise IllegalMoveError('cannot capture own piece')
 
         if self.is_oo or self.is_ooo:
             return
 
         diff = self.to - self.fr
-        if self.pc == 'p':
-            if self.pos.board[self.to] == '-':
+        if self.pc == PAWN:
+            if self.pos.board[self.to] == EMPTY:
                 if diff == -0x10:
                     pass
                 elif diff == -0x20 and rank(self.fr) == 6:
                     self.new_ep = self.fr - 0x10
-                    if self.pos.board[self.new_ep] != '-':
+                    if self.pos.board[self.new_ep] != EMPTY:
                         raise IllegalMoveError('bad en passant')
                 elif diff in [-0x11, -0xf] and self.to == self.pos.ep:
                     self.is_ep = True
@@ -184,13 +258,13 @@ class Move(object):
             else:
                 if not diff in [-0x11, -0xf]:
                     raise IllegalMoveError('bad pawn capture')
-        elif self.pc == 'P':
-            if self.pos.board[self.to] == '-':
+        elif self.pc == PAWN | WHITE_PC:
+            if self.pos.board[self.to] == EMPTY:
                 if diff == 0x10:
                     pass
                 elif diff == 0x20 and rank(self.fr) == 1:
                     self.new_ep = self.fr + 0x10
-                    if self.pos.board[self.new_ep] != '-':
+                    if self.pos.board[self.new_ep] != EMPTY:
                         raise IllegalMoveError('bad en passant')
                 elif diff in [0x11, 0xf] and self.to == self.pos.ep:
                     self.is_ep = True
@@ -200,19 +274,20 @@ class Move(object):
                 if not diff in [0x11, 0xf]:
                     raise IllegalMoveError('bad pawn capture')
         else:
-            if self.pc in sliding_pieces:
+            pc_type = self.pc & TYPE_MASK
+            if is_slider[pc_type]:
                 d = dir(self.fr, self.to)
-                if d == 0 or not d in piece_moves[self.pc.lower()]:
+                if d == 0 or not d in piece_dirs[pc_type]:
                     raise IllegalMoveError('piece cannot make that move')
                 # now check if there are any pieces in the way
                 cur_sq = self.fr + d
                 while cur_sq != self.to:
                     assert(valid_sq(cur_sq))
-                    if self.pos.board[cur_sq] != '-':
+                    if self.pos.board[cur_sq] != EMPTY:
                         raise IllegalMoveError('sliding piece blocked')
                     cur_sq += d
             else:
-                if not diff in piece_moves[self.pc.lower()]:
+                if not diff in piece_dirs[pc_type]:
                     raise IllegalMoveError('piece cannot make that move')
 
     def check_legal(self):
@@ -223,7 +298,8 @@ class Move(object):
         if self.is_oo:
             if (self.pos.in_check
                     or not self.pos.check_castle_flags(self.pos.wtm, True)
-                    or self.pos.board[self.fr + 1] != '-'
+                    or self.pos.board[self.fr + 1] != EMPTY
+                    or self.pos.board[self.to] != EMPTY
                     or self.pos.under_attack(self.fr + 1, not self.pos.wtm)
                     or self.pos.under_attack(self.to, not self.pos.wtm)):
                 raise IllegalMoveError('illegal castling')
@@ -232,19 +308,35 @@ class Move(object):
         if self.is_ooo:
             if (self.pos.in_check
                     or not self.pos.check_castle_flags(self.pos.wtm, False)
-                    or self.pos.board[self.fr - 1] != '-'
+                    or self.pos.board[self.fr - 1] != EMPTY
+                    or self.pos.board[self.to] != EMPTY
+                    or self.pos.board[self.to - 1] != EMPTY
                     or self.pos.under_attack(self.fr - 1, not self.pos.wtm)
                     or self.pos.under_attack(self.to, not self.pos.wtm)):
                 raise IllegalMoveError('illegal castling')
             return
 
-        self.pos.make_move(self)
-        try:
-            if self.pos.under_attack(self.pos.king_pos[not self.pos.wtm],
-                    self.pos.wtm):
-                raise IllegalMoveError('leaves king in check')
-        finally:
-            self.pos.undo_move(self)
+        # Only the board matters for whether the king is attacked, so
+        # try the move there rather than with make_move().
+        pos = self.pos
+        board = pos.board
+        board[self.fr] = EMPTY
+        board[self.to] = self.pc
+        if self.is_ep:
+            cap_sq = self.to - 0x10 if pos.wtm else self.to + 0x10
+            cap_pc = board[cap_sq]
+            board[cap_sq] = EMPTY
+        if self.pc & TYPE_MASK == KING:
+            ksq = self.to
+        else:
+            ksq = pos.king_pos[pos.wtm]
+        in_check = pos.under_attack(ksq, not pos.wtm)
+        board[self.fr] = self.pc
+        board[self.to] = self.capture
+        if self.is_ep:
+            board[cap_sq] = cap_pc
+        if in_check:
+            raise IllegalMoveError('leaves king in check')
 
     def to_san(self):
         if self._san is None:
@@ -263,16 +355,16 @@ class Move(object):
             san = 'O-O'
         elif self.is_ooo:
             san = 'O-O-O'
-        elif self.pc in ['P', 'p']:
+        elif self.pc & TYPE_MASK == PAWN:
             san = ''
             if self.is_capture or self.is_ep:
                 san += 'abcdefgh'[file(self.fr)] + 'x'
             san += sq_to_str(self.to)
             if self.prom:
-                san += '=' + self.prom.upper()
+                san += '=' + pc_chars[self.prom].upper()
         else:
             assert(not self.is_ep)
-            san = self.pc.upper()
+            san = pc_chars[self.pc].upper()
             ambigs = self.pos.get_from_sqs(self.pc, self.to)
             assert(len(ambigs) >= 1)
             if len(ambigs) > 1:
@@ -303,12 +395,12 @@ class Move(object):
         elif self.is_ooo:
             ret = 'o-o-o'
         else:
-            ret = self.pc.upper() + '/'
+            ret = pc_chars[self.pc].upper() + '/'
             ret += sq_to_str(self.fr)
             ret += '-'
             ret += sq_to_str(self.to)
             if self.prom:
-                ret += '=' + self.prom.upper()
+                ret += '=' + pc_chars[self.prom].upper()
         return ret
 
     def to_smith(self):
@@ -317,9 +409,9 @@ class Move(object):
         ret.append(sq_to_str(self.fr))
         ret.append(sq_to_str(self.to))
         if self.is_capture:
-            ret.append(self.capture.lower())
+            ret.append(pc_chars[self.capture].lower())
         if self.prom:
-            ret.append(self.prom.upper())
+            ret.append(pc_chars[self.prom].upper())
         if self.is_oo:
             ret.append('c')
         elif self.is_ooo:
@@ -336,38 +428,330 @@ class Move(object):
         else:
             return True
 
+    def get_code(self):
+        """ The move code for this move. """
+        code = self.fr | self.to << MV_TO_SHIFT
+        if self.prom:
+            code |= (self.prom & TYPE_MASK) << MV_PROM_SHIFT
+        if self.is_ep:
+            code |= MV_EP
+        elif self.is_oo:
+            code |= MV_OO
+        elif self.is_ooo:
+            code |= MV_OOO
+        elif self.new_ep is not None:
+            code |= MV_DOUBLE
+        return code
+
+    def to_compact(self):
+        """ The move packed by compact_code(). """
+        return compact_code(self.fr, self.to,
+            pc_chars[self.prom] if self.prom else None, self.is_oo,
+            self.is_ooo)
+
+class PastMove(Move):
+    """A move rebuilt from PositionHistory.  Its SAN is computed only
+    if it is asked for and was not saved when the move was made."""
+    __slots__ = ['ply']
+
+    def to_san(self):
+        if self._san is None:
+            self._san = self.pos.get_past_san(self.ply)
+        return self._san
+
 class Undo(object):
     """information needed to undo a move"""
-    pass
+    __slots__ = ['ep', 'in_check', 'checkers', 'castle_flags',
+        'fifty_count', 'hash']
 
 class PositionHistory(object):
-    """keeps past of past positions for repetition detection"""
-    def __init__(self):
-        self.hashes = [None] * 40
-        self.moves = [None] * 40
+    """Keeps the hashes of past positions, for repetition detection,
+    and the moves played.  Games can be thousands of plies long, so
+    each move is packed into integers in arrays rather than kept as a
+    Move object.  The exception is the last move, because the game
+    sets its time after making it; its time, lag and SAN are saved when
+    the next move is made.  get_move() rebuilds older moves."""
+    def __init__(self, pos):
+        self.pos = pos
+        # the hashes are 64 bits, but an unsigned long may be only 32,
+        # so each is kept as two halves, the low half first
+        self.hashes = array('L')
+        # move codes with the moving and captured pieces added, or 0
+        # where no move is known
+        self.moves = array('l')
+        # the en passant square, castling flags and whether the side to
+        # move was in check, before each move
+        self.states = array('l')
+        self.fifty_counts = array('l')
+        self.times = array('d')
+        self.lags = array('l')
+        # SAN is saved where it was computed; the strings are interned,
+        # since the same few moves occur in every game
+        self.sans = []
+        self.last_ply = None
+        self.last_move = None
 
     def set_hash(self, ply, hash):
-        if ply >= len(self.hashes):
-            self.hashes.extend([None] * (ply - len(self.hashes) + 1))
-        self.hashes[ply] = hash
+        i = 2 * ply
+        if i >= len(self.hashes):
+            self.hashes.extend([0] * (i - len(self.hashes) + 2))
+        self.hashes[i] = hash & 0xffffffff
+        self.hashes[i + 1] = hash >> 32
 
     def set_move(self, ply, mv):
+        if self.last_ply is not None and self.last_ply < ply:
+            self._save_last_move()
         if ply >= len(self.moves):
-            self.moves.extend([None] * (ply - len(self.moves) + 1))
-        self.moves[ply] = mv
+            n = ply - len(self.moves) + 1
+            self.moves.extend([0] * n)
+            self.states.extend([0] * n)
+            self.fifty_counts.extend([0] * n)
+            self.times.extend([-1.0] * n)
+            self.lags.extend([0] * n)
+            self.sans.extend([None] * n)
+        self.moves[ply] = (mv.get_code() | mv.pc << MV_PC_SHIFT |
+            mv.capture << MV_CAPTURE_SHIFT)
+        undo = mv.undo
+        self.states[ply] = ((undo.ep or 0) | undo.castle_flags << 7 |
+            bool(undo.in_check) << 11)
+        self.fifty_counts[ply] = undo.fifty_count
+        self.last_ply = ply
+        self.last_move = mv
+
+    def _save_last_move(self):
+        ply = self.last_ply
+        mv = self.last_move
+        self.times[ply] = -1.0 if mv.time is None else mv.time
+        self.lags[ply] = mv.lag
+        self.sans[ply] = None if mv._san is None else intern(mv._san)
 
     def get_hash(self, ply):
-        return self.hashes[ply]
+        return self.hashes[2 * ply] | self.hashes[2 * ply + 1] << 32
+
+    def __deepcopy__(self, memo):
+        # the arrays copy quickly; the SAN strings can be shared
+        ret = PositionHistory.__new__(PositionHistory)
+        memo[id(self)] = ret
+        ret.pos = copy.deepcopy(self.pos, memo)
+        for k in ['hashes', 'moves', 'states', 'fifty_counts', 'times',
+                'lags', 'sans']:
+            setattr(ret, k, getattr(self, k)[:])
+        ret.last_ply = self.last_ply
+        ret.last_move = copy.deepcopy(self.last_move, memo)
+        return ret
 
     def get_move(self, ply):
-        return self.moves[ply]
+        if ply == self.last_ply:
+            return self.last_move
+        if ply < 0 or ply >= len(self.moves) or not self.moves[ply]:
+            return None
+
+        code = self.moves[ply]
+        mv = PastMove.__new__(PastMove)
+        mv.pos = self.pos
+        mv.ply = ply
+        mv.fr = code & 0x7f
+        mv.to = (code >> MV_TO_SHIFT) & 0x7f
+        mv.pc = (code >> MV_PC_SHIFT) & 0xf
+        mv.capture = (code >> MV_CAPTURE_SHIFT) & 0xf
+        mv.is_capture = mv.capture != EMPTY
+        prom = (code >> MV_PROM_SHIFT) & TYPE_MASK
+        mv.prom = prom | mv.pc & WHITE_PC if prom else None
+        mv.is_ep = bool(code & MV_EP)
+        mv.is_oo = bool(code & MV_OO)
+        mv.is_ooo = bool(code & MV_OOO)
+        mv.new_ep = (mv.fr + mv.to) >> 1 if code & MV_DOUBLE else None
+        mv.time = self.times[ply] if self.times[ply] >= 0 else None
+        mv.lag = self.lags[ply]
+        mv._san = self.sans[ply]
+        mv._verbose_alg = None
+
+        state = self.states[ply]
+        mv.undo = Undo()
+        mv.undo.ep = (state & 0x7f) or None
+        mv.undo.castle_flags = (state >> 7) & 0xf
+        mv.undo.in_check = bool(state & (1 << 11))
+        # undo_move() finds the checkers again
+        mv.undo.checkers = None
+        mv.undo.fifty_count = self.fifty_counts[ply]
+        mv.undo.hash = self.get_hash(ply)
+        return mv
+
+class MoveTable(object):
+    """The legal moves in one position, for looking up moves by SAN
+    (without check decorators), long algebraic or Smith notation.  The
+    moves are kept as move codes, and a Move is only made for a move
+    that is looked up.  SAN is only computed for the moves that could
+    match a lookup, and the index of moves by their squares is built
+    the first time it is used."""
+    def __init__(self, pos, codes, objs):
+        self.pos = pos
+        self.codes = codes
+        # Moves already made for some of the codes
+        self._objs = objs
+        self._sans = {}
+        self._by_sqs = None
+
+    def __deepcopy__(self, memo):
+        # the table is only a cache, so a copy of the position, such
+        # as a snapshot in examine mode, makes its own when needed
+        return None
+
+    def get_moves(self):
+        return [self._get_move(code) for code in self.codes]
+
+    def get_froms(self, pc, to):
+        """The legal source squares of a piece other than a pawn moving
+        to the given square."""
+        board = self.pos.board
+        return [code & 0x7f for code in self.codes
+            if code >> MV_TO_SHIFT == to and board[code & 0x7f] == pc]
+
+    def get_san(self, s):
+        if s in ['O-O', 'OO', 'o-o']:
+            flag = MV_OO
+        elif s in ['O-O-O', 'OOO', 'o-o-o']:
+            flag = MV_OOO
+        else:
+            flag = 0
+        if flag:
+            for code in self.codes:
+                if code & flag:
+                    return self._get_move(code)
+            return None
+
+        if len(s) < 2:
+            return None
+        prom = 0
+        if s[-2:-1] == '=':
+            prom = pc_codes.get(s[-1].lower(), 0)
+            s_to = s[-4:-2]
+        else:
+            s_to = s[-2:]
+        if (len(s_to) != 2 or s_to[0] not in 'abcdefgh'
+                or s_to[1] not in '12345678'):
+            return None
+        to = str_to_sq(s_to)
+        pc_type = pc_codes.get(s[0].lower(), PAWN) if s[0].isupper() \
+            else PAWN
+        pc = pc_type | (WHITE_PC if self.pos.wtm else 0)
+
+        board = self.pos.board
+        key = to | prom << (MV_PROM_SHIFT - MV_TO_SHIFT)
+        for code in self.codes:
+            if ((code >> MV_TO_SHIFT) & 0x3ff == key and
+                    board[code & 0x7f] == pc and self._get_san(code) == s):
+                mv = self._get_move(code)
+                if mv._san is None:
+                    mv._san = self._sans[code]
+                return mv
+        return None
+
+    def get_lalg(self, s):
+        """Look up a long algebraic move, in any case and with or
+        without a hyphen between the squares."""
+        s = s.lower()
+        if s[2:3] == '-':
+            s = s[:2] + s[3:]
+        if len(s) == 6 and s[4] == '=' and s[5] in 'nbrq':
+            prom = pc_codes[s[5]]
+        elif len(s) == 4:
+            prom = 0
+        else:
+            return None
+        code = self._find(s, prom)
+        if code is None and not prom:
+            # a promotion without a piece is to a queen
+            code = self._find(s, QUEEN)
+        if code is None:
+            return None
+        return self._get_move(code)
+
+    def get_smith(self, s):
+        if len(s) < 4:
+            return None
+        prom = 0
+        for c in s[4:]:
+            if c in 'NBRQ':
+                prom = pc_codes[c.lower()]
+        code = self._find(s, prom)
+        if code is None:
+            return None
+        mv = self._get_move(code)
+        if mv.to_smith() != s:
+            return None
+        return mv
+
+    def _find(self, s, prom):
+        """Find a move by the squares at the start of s, and the type
+        of the promotion piece, if any."""
+        if self._by_sqs is None:
+            self._by_sqs = dict([(code & MV_SQS_MASK, code)
+                for code in self.codes])
+        try:
+            key = (str_to_sq(s[0:2]) | str_to_sq(s[2:4]) << MV_TO_SHIFT |
+                prom << MV_PROM_SHIFT)
+        except ValueError:
+            return None
+        return self._by_sqs.get(key)
+
+    def _get_move(self, code):
+        mv = self._objs.get(code)
+        if mv is None:
+            mv = self.pos.move_from_code(code)
+            self._objs[code] = mv
+        return mv
+
+    def _get_san(self, code):
+        """The same as Move._to_san(), but using the table to
+        disambiguate piece moves."""
+        if code in self._sans:
+            return self._sans[code]
+
+        board = self.pos.board
+        fr = code & 0x7f
+        to = (code >> MV_TO_SHIFT) & 0x7f
+        pc = board[fr]
+        if code & MV_OO:
+            san = 'O-O'
+        elif code & MV_OOO:
+            san = 'O-O-O'
+        elif pc & TYPE_MASK == PAWN:
+            if file(fr) != file(to):
+                san = 'abcdefgh'[file(fr)] + 'x' + sq_names[to]
+            else:
+                san = sq_names[to]
+            prom = (code >> MV_PROM_SHIFT) & TYPE_MASK
+            if prom:
+                san += '=' + pc_chars[prom | WHITE_PC]
+        else:
+            san = pc_chars[pc | WHITE_PC]
+            ambigs = self.get_froms(pc, to)
+            if len(ambigs) > 1:
+                r = rank(fr)
+                f = file(fr)
+                # try disambiguating with file
+                if len(filter(lambda sq: file(sq) == f, ambigs)) == 1:
+                    san += 'abcdefgh'[f]
+                elif len(filter(lambda sq: rank(sq) == r, ambigs)) == 1:
+                    san += '12345678'[r]
+                else:
+                    san += sq_names[fr]
+            if board[to] != EMPTY:
+                san += 'x'
+            san += sq_names[to]
+        self._sans[code] = san
+        return san
 
 class Position(object):
     def __init__(self, fen):
-        self.board = array('c', 0x80 * ['-'])
+        self.board = array('B', 0x80 * [EMPTY])
+        # the squares of each side's pieces, indexed by wtm
+        self.pieces = [set(), set()]
         self.castle_flags = 0
         self.king_pos = [None, None]
-        self.history = PositionHistory()
+        self.history = PositionHistory(self)
+        self._move_table = None
         self.set_pos(fen)
 
     set_pos_re = re.compile(r'''^([1-8rnbqkpRNBQKP/]+) ([wb]) ([kqKQ]+|-) ([a-h][36]|-) (\d+) (\d+)$''')
@@ -385,6 +769,7 @@ class Position(object):
 
             ranks = pos.split('/')
             ranks.reverse()
+            self._move_table = None
             self.hash = 0
             self.material = [0, 0]
             for (r, rank_str) in enumerate(ranks):
@@ -395,21 +780,18 @@ class Position(object):
                         sq += d + 1
                     else:
                         assert(valid_sq(sq))
-                        self.board[sq] = c
-                        self.hash ^= zobrist.piece_hash(sq, c)
-                        self.material[piece_is_white(c)] += \
-                            piece_material[c.lower()]
-                        if c == 'k':
-                            if self.king_pos[0] != None:
+                        pc = pc_codes[c]
+                        is_white = bool(pc & WHITE_PC)
+                        self.board[sq] = pc
+                        self.pieces[is_white].add(sq)
+                        self.hash ^= zobrist.piece_hash(sq, pc)
+                        self.material[is_white] += piece_material[pc]
+                        if pc & TYPE_MASK == KING:
+                            if self.king_pos[is_white] != None:
                                 # multiple kings
                                 raise BadFenError()
-                            self.king_pos[0] = sq
-                        elif c == 'K':
-                            if self.king_pos[1] != None:
-                                # multiple kings
-                                raise BadFenError()
-                            self.king_pos[1] = sq
-                        elif c.lower() == 'p':
+                            self.king_pos[is_white] = sq
+                        elif pc & TYPE_MASK == PAWN:
                             if rank(sq) in [0, 7]:
                                 # pawn on 1st or 8th rank
                                 raise BadFenError()
@@ -426,31 +808,38 @@ class Position(object):
             if self.wtm:
                 self.hash ^= zobrist.side_hash
 
+            self.checkers = self._find_checkers()
+            self.in_check = bool(self.checkers)
+
             if castle_flags == '-':
                 self.castle_flags = 0
             else:
                 (w_oo, w_ooo, b_oo, b_ooo) = (False, False, False, False)
                 for c in castle_flags:
                     if c == 'K':
-                        if self.board[E1] != 'K' or self.board[H1] != 'R':
+                        if (self.board[E1] != pc_codes['K'] or
+                                self.board[H1] != pc_codes['R']):
                             raise BadFenError()
                         if w_oo:
                             raise BadFenError()
                         w_oo = True
                     elif c == 'Q':
-                        if self.board[E1] != 'K' or self.board[A1] != 'R':
+                        if (self.board[E1] != pc_codes['K'] or
+                                self.board[A1] != pc_codes['R']):
                             raise BadFenError()
                         if w_ooo:
                             raise BadFenError()
                         w_ooo = True
                     elif c == 'k':
-                        if self.board[E8] != 'k' or self.board[H8] != 'r':
+                        if (self.board[E8] != pc_codes['k'] or
+                                self.board[H8] != pc_codes['r']):
                             raise BadFenError()
                         if b_oo:
                             raise BadFenError()
                         b_oo = True
                     elif c == 'q':
-                        if self.board[E8] != 'k' or self.board[A8] != 'r':
+                        if (self.board[E8] != pc_codes['k'] or
+                                self.board[A8] != pc_codes['r']):
                             raise BadFenError()
                         if b_ooo:
                             raise BadFenError()
@@ -476,8 +865,6 @@ class Position(object):
                 if rank(self.ep) not in (2, 5):
                     raise BadFenError('bad en passant square')
                 self.hash ^= zobrist.ep_hash(self.ep)
-                # legality checking needs a value for in_check
-                self.in_check = None
                 if not self._is_legal_ep(self.ep):
                     # undo the en passant square
                     self.ep = None
@@ -505,98 +892,112 @@ class Position(object):
         for r in range(0, 8):
             for f in range(0, 8):
                 sq = 0x10 * r + f
-                yield (sq, self.board[sq])
+                yield (sq, pc_chars[self.board[sq]])
+
+    def piece_at(self, sq):
+        """ The FEN character for the piece on a square, or '-'. """
+        return pc_chars[self.board[sq]]
 
     def make_move(self, mv):
         """make the move"""
+        self._move_table = None
         self.ply += 1
+        board = self.board
+        wtm = self.wtm
+        own = self.pieces[wtm]
 
         mv.undo = Undo()
         mv.undo.ep = self.ep
         mv.undo.in_check = self.in_check
+        mv.undo.checkers = self.checkers
         mv.undo.castle_flags = self.castle_flags
         mv.undo.fifty_count = self.fifty_count
-        mv.undo.material = self.material[:]
         mv.undo.hash = self.hash
 
         if self.ep:
             # clear old en passant hash
             self.hash ^= zobrist.ep_hash(self.ep)
             self.ep = None
-        self.board[mv.fr] = '-'
+        board[mv.fr] = EMPTY
+        own.remove(mv.fr)
+        own.add(mv.to)
         if not mv.prom:
-            self.board[mv.to] = mv.pc
+            board[mv.to] = mv.pc
             self.hash ^= zobrist.piece_hash(mv.fr, mv.pc) ^ \
                 zobrist.piece_hash(mv.to, mv.pc)
         else:
-            self.board[mv.to] = mv.prom
+            board[mv.to] = mv.prom
             self.hash ^= zobrist.piece_hash(mv.fr, mv.pc) ^\
                 zobrist.piece_hash(mv.to, mv.prom)
-            self.material[self.wtm] += piece_material[mv.prom.lower()] \
-                - piece_material['p']
+            self.material[wtm] += piece_material[mv.prom] \
+                - piece_material[PAWN]
 
-        if mv.pc == 'k':
-            self.king_pos[0] = mv.to
-        elif mv.pc == 'K':
-            self.king_pos[1] = mv.to
+        pc_type = mv.pc & TYPE_MASK
+        if pc_type == KING:
+            self.king_pos[wtm] = mv.to
 
-        if mv.pc in ['p', 'P'] or mv.is_capture:
+        if pc_type == PAWN or mv.is_capture:
             self.fifty_count = 0
         else:
             self.fifty_count += 1
 
         if mv.is_capture:
             self.hash ^= zobrist.piece_hash(mv.to, mv.capture)
-            self.material[not self.wtm] -= piece_material[mv.capture.lower()]
+            self.material[not wtm] -= piece_material[mv.capture]
+            self.pieces[not wtm].remove(mv.to)
 
+        cap_sq = None
+        (rook_fr, rook_to) = (None, None)
         if mv.is_ep:
-            self.material[not self.wtm] -= piece_material['p']
+            self.material[not wtm] -= piece_material[PAWN]
             # remove the captured pawn
-            if self.wtm:
-                assert(self.board[mv.to - 0x10] == 'p')
-                self.hash ^= zobrist.piece_hash(mv.to - 0x10, 'p')
-                self.board[mv.to - 0x10] = '-'
+            if wtm:
+                cap_sq = mv.to - 0x10
+                assert(board[cap_sq] == PAWN)
             else:
-                assert(self.board[mv.to + 0x10] == 'P')
-                self.hash ^= zobrist.piece_hash(mv.to + 0x10, 'P')
-                self.board[mv.to + 0x10] = '-'
-        elif mv.is_oo:
+                cap_sq = mv.to + 0x10
+                assert(board[cap_sq] == PAWN | WHITE_PC)
+            self.hash ^= zobrist.piece_hash(cap_sq, board[cap_sq])
+            board[cap_sq] = EMPTY
+            self.pieces[not wtm].remove(cap_sq)
+        elif mv.is_oo or mv.is_ooo:
             # move the rook
-            if self.wtm:
-                assert(self.board[H1] == 'R')
-                self.board[F1] = 'R'
-                self.board[H1] = '-'
-                self.hash ^= zobrist.piece_hash(F1, 'R') ^ \
-                    zobrist.piece_hash(H1, 'R')
-            else:
-                assert(self.board[H8] == 'r')
-                self.board[F8] = 'r'
-                self.board[H8] = '-'
-                self.hash ^= zobrist.piece_hash(F8, 'r') ^ \
-                    zobrist.piece_hash(H8, 'r')
-        elif mv.is_ooo:
-            # move the rook
-            if self.wtm:
-                assert(self.board[A1] == 'R')
-                self.board[D1] = 'R'
-                self.board[A1] = '-'
-                self.hash ^= zobrist.piece_hash(D1, 'R') ^ \
-                    zobrist.piece_hash(A1, 'R')
-            else:
-                assert(self.board[A8] == 'r')
-                self.board[D8] = 'r'
-                self.board[A8] = '-'
-                self.hash ^= zobrist.piece_hash(A8, 'r') ^ \
-                    zobrist.piece_hash(D8, 'r')
+            (rook_fr, rook_to) = castle_rook_sqs[mv.to]
+            rook = board[rook_fr]
+            assert(rook == ROOK | (WHITE_PC if wtm else 0))
+            board[rook_to] = rook
+            board[rook_fr] = EMPTY
+            own.remove(rook_fr)
+            own.add(rook_to)
+            self.hash ^= zobrist.piece_hash(rook_to, rook) ^ \
+                zobrist.piece_hash(rook_fr, rook)
 
         self.castle_flags &= castle_mask[mv.fr] & castle_mask[mv.to]
         if self.castle_flags != mv.undo.castle_flags:
             self.hash ^= zobrist.castle_hash(self.castle_flags) ^ \
                 zobrist.castle_hash(mv.undo.castle_flags)
-        self.wtm = not self.wtm
+        self.wtm = not wtm
         self.hash ^= zobrist.side_hash
         #self._check_material()
 
+        # The side to move could not have been in check before this
+        # move, so a check can only come from the piece that moved (or
+        # the rook, when castling), or be discovered along a line from
+        # the king through a square the move emptied.
+        ksq = self.king_pos[not wtm]
+        checkers = []
+        if self._attacks(mv.to, ksq):
+            checkers.append(mv.to)
+        if rook_to is not None and self._attacks(rook_to, ksq):
+            checkers.append(rook_to)
+        for sq in [mv.fr, cap_sq, rook_fr]:
+            if sq is not None:
+                checker = self._discovered_checker(ksq, sq)
+                if checker is not None and checker not in checkers:
+                    checkers.append(checker)
+        self.checkers = checkers
+        self.in_check = bool(checkers)
+
         if mv.new_ep and self._is_legal_ep(mv.new_ep):
             self.ep = mv.new_ep
             self.hash ^= zobrist.ep_hash(self.ep)
@@ -614,18 +1015,14 @@ class Position(object):
         # passant capture.  So we have to test the legality of
         # en passant captures.
         if self.wtm:
-            if (valid_sq(ep - 0x11) and self.board[ep - 0x11] == 'P' and
-                    Move(self, ep - 0x11, ep, is_ep=True).is_legal()):
-                return True
-            elif (valid_sq(ep - 0xf) and self.board[ep - 0xf] == 'P' and
-                    Move(self, ep - 0xf, ep, is_ep=True).is_legal()):
-                return True
+            pawn = PAWN | WHITE_PC
+            frs = [ep - 0x11, ep - 0xf]
         else:
-            if (valid_sq(ep + 0xf) and self.board[ep + 0xf] == 'p' and
-                    Move(self, ep + 0xf, ep, is_ep=True).is_legal()):
-                return True
-            elif (valid_sq(ep + 0x11) and self.board[ep + 0x11] == 'p' and
-                    Move(self, ep + 0x11, ep, is_ep=True).is_legal()):
+            pawn = PAWN
+            frs = [ep + 0xf, ep + 0x11]
+        for fr in frs:
+            if (valid_sq(fr) and self.board[fr] == pawn and
+                    Move(self, fr, ep, is_ep=True).is_legal()):
                 return True
         return False
 
@@ -633,9 +1030,11 @@ class Position(object):
         hash = 0
         if self.wtm:
             hash ^= zobrist.side_hash
-        for (sq, pc) in self:
-            if pc != '-':
-                hash ^= zobrist.piece_hash(sq, pc)
+        for r in range(0, 8):
+            for f in range(0, 8):
+                sq = 0x10 * r + f
+                if self.board[sq] != EMPTY:
+                    hash ^= zobrist.piece_hash(sq, self.board[sq])
         if self.ep:
             hash ^= zobrist.ep_hash(self.ep)
         hash ^= zobrist.castle_hash(self.castle_flags)
@@ -643,62 +1042,97 @@ class Position(object):
 
     def undo_move(self, mv):
         """undo the move"""
+        self._move_table = None
         self.wtm = not self.wtm
+        board = self.board
+        wtm = self.wtm
+        own = self.pieces[wtm]
         self.ply -= 1
         self.ep = mv.undo.ep
-        self.board[mv.to] = mv.capture
-        self.board[mv.fr] = mv.pc
+        board[mv.to] = mv.capture
+        board[mv.fr] = mv.pc
+        own.remove(mv.to)
+        own.add(mv.fr)
+        if mv.is_capture:
+            self.pieces[not wtm].add(mv.to)
+            self.material[not wtm] += piece_material[mv.capture]
+        if mv.prom:
+            self.material[wtm] -= piece_material[mv.prom] \
+                - piece_material[PAWN]
         self.in_check = mv.undo.in_check
         self.castle_flags = mv.undo.castle_flags
         self.fifty_count = mv.undo.fifty_count
-        self.material = mv.undo.material
         self.hash = mv.undo.hash
 
-        if mv.pc == 'k':
-            self.king_pos[0] = mv.fr
-        elif mv.pc == 'K':
-            self.king_pos[1] = mv.fr
+        if mv.pc & TYPE_MASK == KING:
+            self.king_pos[wtm] = mv.fr
 
         if mv.is_ep:
-            if self.wtm:
-                assert(self.board[mv.to - 0x10] == '-')
-                self.board[mv.to - 0x10] = 'p'
-            else:
-                assert(self.board[mv.to + 0x10] == '-')
-                self.board[mv.to + 0x10] = 'P'
-        elif mv.is_oo:
-            if self.wtm:
-                assert(self.board[F1] == 'R')
-                self.board[H1] = 'R'
-                self.board[F1] = '-'
-            else:
-                assert(self.board[F8] == 'r')
-                self.board[H8] = 'r'
-                self.board[F8] = '-'
-        elif mv.is_ooo:
-            if self.wtm:
-                assert(self.board[D1] == 'R')
-                self.board[A1] = 'R'
-                self.board[D1] = '-'
+            if wtm:
+                cap_sq = mv.to - 0x10
+                assert(board[cap_sq] == EMPTY)
+                board[cap_sq] = PAWN
             else:
-                assert(self.board[D8] == 'r')
-                self.board[A8] = 'r'
-                self.board[D8] = '-'
+                cap_sq = mv.to + 0x10
+                assert(board[cap_sq] == EMPTY)
+                board[cap_sq] = PAWN | WHITE_PC
+            self.pieces[not wtm].add(cap_sq)
+            self.material[not wtm] += piece_material[PAWN]
+        elif mv.is_oo or mv.is_ooo:
+            (rook_fr, rook_to) = castle_rook_sqs[mv.to]
+            assert(board[rook_to] == ROOK | (WHITE_PC if wtm else 0))
+            board[rook_fr] = board[rook_to]
+            board[rook_to] = EMPTY
+            own.remove(rook_to)
+            own.add(rook_fr)
+
+        # a move rebuilt by PositionHistory does not keep the checkers
+        if mv.undo.checkers is None:
+            self.checkers = self._find_checkers()
+        else:
+            self.checkers = mv.undo.checkers
         #self._check_material()
         #assert(self.hash == self._compute_hash())
 
+    def get_past_san(self, ply):
+        """Compute the SAN of the move made at an earlier ply, when it
+        was not saved, by taking back moves to the position before it
+        and then making them again."""
+        assert(self.start_ply <= ply < self.ply)
+        mvs = []
+        while self.ply > ply:
+            mv = self.get_last_move()
+            self.undo_move(mv)
+            mvs.append(mv)
+        mvs.reverse()
+        san = mvs[0]._to_san()
+        for mv in mvs:
+            self.make_move(mv)
+            if mv is mvs[0]:
+                self.detect_check()
+                if self.is_checkmate:
+                    san += '#'
+                elif self.in_check:
+                    san += '+'
+                # save it with the move
+                mv._san = san
+        self.detect_check()
+        return san
+
     def _check_material(self):
-        bmat = sum([piece_material[pc.lower()]
-            for (sq, pc) in self if pc != '-' and not piece_is_white(pc)])
-        assert(bmat == self.material[0])
-        assert(self.material[1] == sum([piece_material[pc.lower()]
-            for (sq, pc) in self if pc != '-' and piece_is_white(pc)]))
+        for is_white in [False, True]:
+            assert(self.material[is_white] == sum([
+                piece_material[self.board[sq]]
+                for sq in self.pieces[is_white]]))
+        for (sq, pc) in self:
+            if pc != '-':
+                assert(sq in self.pieces[pc.isupper()])
 
     def detect_check(self):
         """detect whether the player to move is in check, checkmated,
         or stalemated"""
-        self.in_check = self.under_attack(self.king_pos[self.wtm],
-            not self.wtm)
+        # the checkers are kept up to date by make_move()
+        self.in_check = bool(self.checkers)
 
         any_legal = self._any_legal_moves()
         self.is_checkmate = self.in_check and not any_legal
@@ -711,172 +1145,189 @@ class Position(object):
     def _check_mating_material(self):
         self.white_has_mating_material = self.material[1] > 3
         self.black_has_mating_material = self.material[0] > 3
-        if (not self.white_has_mating_material or
-                not self.black_has_mating_material):
-            for (sq, pc) in self:
-                if pc == 'P':
+        if not self.white_has_mating_material:
+            for sq in self.pieces[1]:
+                if self.board[sq] == PAWN | WHITE_PC:
                     self.white_has_mating_material = True
-                elif pc == 'p':
+                    break
+        if not self.black_has_mating_material:
+            for sq in self.pieces[0]:
+                if self.board[sq] == PAWN:
                     self.black_has_mating_material = True
+                    break
 
 
     def get_last_move(self):
         return self.history.get_move(self.ply - 1)
 
     def _any_legal_moves(self):
-        if self.ep:
-            return True
-        ksq = self.king_pos[self.wtm]
-        if self._any_pc_moves(ksq, self.board[ksq]):
-            return True
-        # it's slow to iterate over every square in the board, but it's
-        # only necessary if the king has no legal moves
-        for (sq, pc) in self:
-            #if pc != '-' and piece_is_white(pc) == self.wtm:
-            if pc not in ['-', 'K', 'k'] and piece_is_white(pc) == self.wtm:
-                cur_sq = sq
-                if self._any_pc_moves(sq, pc):
-                    return True
-        return False
+        if self._move_table is None and not self.in_check:
+            # Any move by a piece other than the king that is not
+            # pinned is legal, so usually the first piece we look at
+            # answers the question without building the whole table.
+            ksq = self.king_pos[self.wtm]
+            pinned = self._get_pinned()
+            codes = []
+            for sq in self.pieces[self.wtm]:
+                if sq != ksq and sq not in pinned:
+                    self._add_piece_codes(sq, codes)
+                    for code in codes:
+                        # en passant can expose the king
+                        if not code & MV_EP:
+                            return True
+                    codes = []
+        return len(self.get_move_table().codes) > 0
 
     def _pawn_cap_at(self, sq):
         if not valid_sq(sq):
             return False
         pc = self.board[sq]
-        return pc != '-' and piece_is_white(pc) != self.wtm
-
-    def _any_pc_moves(self, sq, pc):
-        if pc == 'P':
-            if self.board[sq + 0x10] == '-':
-                if Move(self, sq, sq + 0x10).is_legal():
-                    return True
-                if rank(sq) == 1 and self.board[sq + 0x20] == '-' and Move(
-                        self, sq, sq + 0x20).is_legal():
-                    return True
-            if self._pawn_cap_at(sq + 0xf) and Move(
-                    self, sq, sq + 0xf,
-                    is_ep=sq + 0xf == self.ep).is_legal():
-                return True
-            if self._pawn_cap_at(sq + 0x11) and Move(
-                    self, sq, sq + 0x11,
-                    is_ep=sq + 0x11 == self.ep).is_legal():
-                return True
-        elif pc == 'p':
-            if self.board[sq - 0x10] == '-':
-                if Move(self, sq, sq - 0x10).is_legal():
-                    return True
-                if rank(sq) == 6 and self.board[sq - 0x20] == '-' and Move(
-                        self, sq, sq - 0x20).is_legal():
-                    return True
-            if self._pawn_cap_at(sq - 0xf) and Move(
-                    self, sq, sq - 0xf,
-                    is_ep=sq - 0xf == self.ep).is_legal():
-                return True
-            if self._pawn_cap_at(sq - 0x11) and Move(
-                    self, sq, sq - 0x11,
-                    is_ep=sq - 0x11 == self.ep).is_legal():
-                return True
-        else:
-            for d in piece_moves[pc.lower()]:
-                cur_sq = sq + d
-                # we don't need to check castling because if castling
-                # is legal, some other king move must be also
-                while valid_sq(cur_sq):
-                    topc = self.board[cur_sq]
-                    if topc == '-' or piece_is_white(topc) != self.wtm:
-                        mv = Move(self, sq, cur_sq)
-                        if mv.is_legal():
-                            return True
-                    if not pc in sliding_pieces or self.board[cur_sq] != '-':
-                        break
-                    cur_sq += d
-
-    def _is_pc_at(self, pc, sq):
-        return valid_sq(sq) and self.board[sq] == pc
+        return pc != EMPTY and bool(pc & WHITE_PC) != self.wtm
 
     def under_attack(self, sq, wtm):
         """determine whether a square is attacked by the given side"""
+        board = self.board
+        color = WHITE_PC if wtm else 0
+
         # pawn attacks
-        if wtm:
-            if (self._is_pc_at('P', sq - 0x11)
-                    or self._is_pc_at('P', sq - 0xf)):
-                return True
-        else:
-            if (self._is_pc_at('p', sq + 0x11)
-                    or self._is_pc_at('p', sq + 0xf)):
+        pc = PAWN | color
+        for fr in pawn_attackers[wtm][sq]:
+            if board[fr] == pc:
                 return True
 
         #  knight attacks
-        npc = 'N' if wtm else 'n'
-        for d in piece_moves['n']:
-            if self._is_pc_at(npc, sq + d):
+        pc = KNIGHT | color
+        for fr in piece_steps[KNIGHT][sq]:
+            if board[fr] == pc:
                 return True
 
         # king attacks
-        kpc = 'K' if wtm else 'k'
-        for d in piece_moves['k']:
-            if self._is_pc_at(kpc, sq + d):
+        pc = KING | color
+        for fr in piece_steps[KING][sq]:
+            if board[fr] == pc:
                 return True
 
         # bishop/queen attacks
-        for d in piece_moves['b']:
-            cur_sq = sq +d
-            while valid_sq(cur_sq):
-                if self.board[cur_sq] != '-':
-                    if wtm:
-                        if self.board[cur_sq] in ['B', 'Q']:
-                            return True
-                    else:
-                        if self.board[cur_sq] in ['b', 'q']:
-                            return True
+        queen = QUEEN | color
+        bishop = BISHOP | color
+        for ray in piece_rays[BISHOP][sq]:
+            for fr in ray:
+                pc = board[fr]
+                if pc != EMPTY:
+                    if pc == bishop or pc == queen:
+                        return True
                     # square blocked
                     break
-                cur_sq += d
-
 
         # rook/queen attacks
-        for d in piece_moves['r']:
-            cur_sq = sq + d
-            while valid_sq(cur_sq):
-                if self.board[cur_sq] != '-':
-                    if wtm:
-                        if self.board[cur_sq] in ['R', 'Q']:
-                            return True
-                    else:
-                        if self.board[cur_sq] in ['r', 'q']:
-                            return True
+        rook = ROOK | color
+        for ray in piece_rays[ROOK][sq]:
+            for fr in ray:
+                pc = board[fr]
+                if pc != EMPTY:
+                    if pc == rook or pc == queen:
+                        return True
                     # square blocked
                     break
-                cur_sq += d
 
         return False
 
+    def _find_checkers(self):
+        """Find the squares of the pieces giving check to the side to
+        move, by looking outward from its king.  After a move,
+        make_move() finds them more cheaply."""
+        board = self.board
+        ksq = self.king_pos[self.wtm]
+        color = 0 if self.wtm else WHITE_PC
+        ret = []
+        for fr in pawn_attackers[not self.wtm][ksq]:
+            if board[fr] == PAWN | color:
+                ret.append(fr)
+        for fr in piece_steps[KNIGHT][ksq]:
+            if board[fr] == KNIGHT | color:
+                ret.append(fr)
+        for pc_type in [BISHOP, ROOK]:
+            for ray in piece_rays[pc_type][ksq]:
+                for fr in ray:
+                    pc = board[fr]
+                    if pc != EMPTY:
+                        if pc == pc_type | color or pc == QUEEN | color:
+                            ret.append(fr)
+                        break
+        return ret
+
+    def _attacks(self, fr, to):
+        """determine whether the piece on fr attacks the square to"""
+        pc = self.board[fr]
+        pc_type = pc & TYPE_MASK
+        if pc_type == PAWN:
+            return fr in pawn_attackers[bool(pc & WHITE_PC)][to]
+        if not is_slider[pc_type]:
+            return fr in piece_steps[pc_type][to]
+        d = dir(fr, to)
+        if d == 0 or d not in piece_dirs[pc_type]:
+            return False
+        sq = fr + d
+        while sq != to:
+            if self.board[sq] != EMPTY:
+                return False
+            sq += d
+        return True
+
+    def _discovered_checker(self, ksq, sq):
+        """Find a piece of the side that just moved that gives check
+        to the king on ksq along the line through the empty square sq,
+        or return None."""
+        d = dir(ksq, sq)
+        if d == 0:
+            return None
+        if d in piece_dirs[ROOK]:
+            pc_type = ROOK
+        else:
+            pc_type = BISHOP
+        board = self.board
+        sq = ksq + d
+        while valid_sq(sq):
+            pc = board[sq]
+            if pc != EMPTY:
+                if (bool(pc & WHITE_PC) != self.wtm and
+                        pc & TYPE_MASK in [pc_type, QUEEN]):
+                    return sq
+                return None
+            sq += d
+        return None
+
     lalg_re = re.compile(r'([a-h][1-8])-?([a-h][1-8])(?:=([NBRQ]))?$', re.I)
     def move_from_lalg(self, s):
         m = self.lalg_re.match(s)
         if not m:
             return None
 
+        mv = self.get_move_table().get_lalg(s)
+        if mv:
+            return mv
+
+        # not a legal move, so parse it to find out why
         fr = str_to_sq(m.group(1).lower())
         to = str_to_sq(m.group(2).lower())
         prom = m.group(3)
         if prom == None:
             mv = Move(self, fr, to)
-            if mv.pc == 'K' and fr == E1:
+            if mv.pc == KING | WHITE_PC and fr == E1:
                 if to == G1:
                     mv.is_oo = True
                 elif to == C1:
                     mv.is_ooo = True
-            elif mv.pc == 'k' and fr == E8:
+            elif mv.pc == KING and fr == E8:
                 if to == G8:
                     mv.is_oo = True
                 elif to == C8:
                     mv.is_ooo = True
         else:
             if self.wtm:
-                mv = Move(self, fr, to, prom=prom.upper())
+                mv = Move(self, fr, to, prom=pc_codes[prom.upper()])
             else:
-                mv = Move(self, fr, to, prom=prom.lower())
+                mv = Move(self, fr, to, prom=pc_codes[prom.lower()])
 
         if mv:
             mv.check_pseudo_legal()
@@ -890,29 +1341,45 @@ class Position(object):
     decorator_re = re.compile(r'[\+#\?\!]+$')
     def move_from_san(self, s):
         s = self.decorator_re.sub('', s)
-        matched = False
+        if not (self.san_pawn_push_re.match(s) or
+                self.san_pawn_capture_re.match(s) or
+                self.san_piece_re.match(s)):
+            return None
+
+        mv = self.get_move_table().get_san(s)
+        if mv:
+            return mv
+
+        # Either the move is illegal, or it is legal but not written
+        # the way we write it, for example with an unnecessary file or
+        # rank or without a promotion piece.  Parse it to find out.
+        mv = self._parse_san(s)
+        if mv:
+            mv.check_legal()
+        return mv
+
+    def _parse_san(self, s):
         mv = None
 
         # examples: e4 e8=Q
         m = self.san_pawn_push_re.match(s)
         if m:
             to = str_to_sq(m.group(1))
-            if self.board[to] != '-':
+            if self.board[to] != EMPTY:
                 raise IllegalMoveError('pawn push blocked')
             prom = m.group(2)
             if prom:
                 if self.wtm:
-                    prom = m.group(2)
-                    assert(prom == prom.upper())
+                    prom = pc_codes[prom]
                 else:
-                    prom = m.group(2).lower()
+                    prom = pc_codes[prom.lower()]
             new_ep = None
             if self.wtm:
                 fr = to - 0x10
-                if rank(to) == 3 and self.board[fr] == '-':
+                if rank(to) == 3 and self.board[fr] == EMPTY:
                     new_ep = fr
                     fr = to - 0x20
-                if self.board[fr] != 'P':
+                if self.board[fr] != PAWN | WHITE_PC:
                     raise IllegalMoveError('illegal white pawn move')
                 if prom:
                     if rank(to) == 7:
@@ -923,10 +1390,10 @@ class Position(object):
                     mv = Move(self, fr, to, new_ep=new_ep)
             else:
                 fr = to + 0x10
-                if rank(to) == 4 and self.board[fr] == '-':
+                if rank(to) == 4 and self.board[fr] == EMPTY:
                     new_ep = fr
                     fr = to + 0x20
-                if self.board[fr] != 'p':
+                if self.board[fr] != PAWN:
                     raise IllegalMoveError('illegal black pawn move')
                 if prom:
                     if rank(to) == 0:
@@ -945,36 +1412,36 @@ class Position(object):
             prom = m.group(3)
             if prom:
                 if self.wtm:
-                    assert(prom == prom.upper())
+                    prom = pc_codes[prom]
                 else:
-                    prom = prom.lower()
+                    prom = pc_codes[prom.lower()]
 
             is_ep = to == self.ep
             if is_ep:
-                assert(self.board[to] == '-')
+                assert(self.board[to] == EMPTY)
             else:
                 topc = self.board[to]
-                if topc == '-' or piece_is_white(topc) == self.wtm:
+                if topc == EMPTY or bool(topc & WHITE_PC) == self.wtm:
                     raise IllegalMoveError('bad pawn capture')
 
             f = 'abcdefgh'.index(m.group(1))
             if f == file(to) - 1:
                 if self.wtm:
                     fr = to - 0x11
-                    if self.board[fr] != 'P':
+                    if self.board[fr] != PAWN | WHITE_PC:
                         raise IllegalMoveError('bad pawn capture')
                 else:
                     fr = to + 0xf
-                    if self.board[fr] != 'p':
+                    if self.board[fr] != PAWN:
                         raise IllegalMoveError('bad pawn capture')
             elif f == file(to) + 1:
                 if self.wtm:
                     fr = to - 0xf
-                    if self.board[fr] != 'P':
+                    if self.board[fr] != PAWN | WHITE_PC:
                         raise IllegalMoveError('bad pawn capture')
                 else:
                     fr = to + 0x11
-                    if self.board[fr] != 'p':
+                    if self.board[fr] != PAWN:
                         raise IllegalMoveError('bad pawn capture')
             else:
                 raise IllegalMoveError('bad pawn capture file')
@@ -988,13 +1455,13 @@ class Position(object):
         if m:
             to = str_to_sq(m.group(5))
             if m.group(4):
-                if self.board[to] == '-':
+                if self.board[to] == EMPTY:
                     raise IllegalMoveError('capture on blank square')
             else:
-                if self.board[to] != '-':
+                if self.board[to] != EMPTY:
                     raise IllegalMoveError('missing "x" to indicate capture')
 
-            pc = m.group(1) if self.wtm else m.group(1).lower()
+            pc = pc_codes[m.group(1) if self.wtm else m.group(1).lower()]
             # TODO: it would be faster to disambiguate first, so we
             # do not check whether moves are legal unnecessarily
             froms = self.get_from_sqs(pc, to)
@@ -1025,9 +1492,15 @@ class Position(object):
 
         return mv
 
+    castle_strs = frozenset(['O-O', 'OO', 'o-o', 'O-O-O', 'OOO', 'o-o-o'])
     def move_from_castle(self, s):
         mv = None
         s = self.decorator_re.sub('', s)
+        if s in self.castle_strs:
+            mv = self.get_move_table().get_san(s)
+            if mv:
+                return mv
+
         if not mv and s in ['O-O', 'OO', 'o-o']:
             if self.wtm:
                 mv = Move(self, E1, G1, is_oo=True)
@@ -1046,24 +1519,192 @@ class Position(object):
 
         return mv
 
+    def move_from_compact(self, code):
+        """ Make a Move from a code packed by compact_code().  The code
+        comes from a stored game, so the move is not checked for
+        legality. """
+        (kind, fr, to, pc) = split_compact(code)
+        if kind == COMPACT_OO:
+            ksq = self.king_pos[self.wtm]
+            return Move(self, ksq, ksq + 2, is_oo=True)
+        if kind == COMPACT_OOO:
+            ksq = self.king_pos[self.wtm]
+            return Move(self, ksq, ksq - 2, is_ooo=True)
+        if pc:
+            pc = pc_codes[pc.upper() if self.wtm else pc]
+        is_ep = False
+        new_ep = None
+        if self.board[fr] & TYPE_MASK == PAWN:
+            if to == self.ep:
+                is_ep = True
+            elif abs(to - fr) == 0x20:
+                new_ep = (fr + to) >> 1
+        return Move(self, fr, to, prom=pc, is_ep=is_ep, new_ep=new_ep)
+
     def get_from_sqs(self, pc, sq):
         '''given a piece (not including a pawn) and a destination square,
         return a list of all legal source squares'''
+        return self.get_move_table().get_froms(pc, sq)
+
+    def get_move_table(self):
+        """The MoveTable for the current position.  It is built the
+        first time it is needed after each move."""
+        if self._move_table is None:
+            self._move_table = self._make_move_table()
+        return self._move_table
+
+    def get_legal_moves(self):
+        """ Get a list of every legal move in the position. """
+        return self.get_move_table().get_moves()
+
+    def move_from_code(self, code):
+        fr = code & 0x7f
+        to = (code >> MV_TO_SHIFT) & 0x7f
+        prom = (code >> MV_PROM_SHIFT) & TYPE_MASK
+        if prom:
+            prom |= self.board[fr] & WHITE_PC
+        else:
+            prom = None
+        new_ep = (fr + to) >> 1 if code & MV_DOUBLE else None
+        return Move(self, fr, to, prom=prom, is_oo=bool(code & MV_OO),
+            is_ooo=bool(code & MV_OOO), is_ep=bool(code & MV_EP),
+            new_ep=new_ep)
+
+    def _make_move_table(self):
+        board = self.board
+        ksq = self.king_pos[self.wtm]
+        pinned = self._get_pinned()
+        # When in check, a move other than by the king must capture
+        # the checking piece or block its line to the king.  In
+        # double check, only the king can move.
+        if len(self.checkers) == 1:
+            checker = self.checkers[0]
+            targets = set([checker])
+            if is_slider[board[checker] & TYPE_MASK]:
+                d = dir(ksq, checker)
+                targets.update(range(ksq + d, checker, d))
+        elif self.checkers:
+            targets = set()
+        else:
+            targets = None
+        codes = []
+        objs = {}
+        for code in self._get_pseudo_legal_codes():
+            fr = code & 0x7f
+            to = (code >> MV_TO_SHIFT) & 0x7f
+            if code & (MV_EP | MV_OO | MV_OOO):
+                # test the move the slow way
+                mv = self.move_from_code(code)
+                if not mv.is_legal():
+                    continue
+                objs[code] = mv
+            elif fr == ksq:
+                # a king move; take the king off the board so that it
+                # does not block a checking piece's line
+                board[ksq] = EMPTY
+                legal = not self.under_attack(to, not self.wtm)
+                board[ksq] = KING | (WHITE_PC if self.wtm else 0)
+                if not legal:
+                    continue
+            else:
+                if targets is not None and to not in targets:
+                    continue
+                # a pinned piece can only move along the line
+                # between the king and the pinning piece
+                if fr in pinned and dir(ksq, to) != pinned[fr]:
+                    continue
+            codes.append(code)
+        return MoveTable(self, codes, objs)
+
+    def _get_pinned(self):
+        """ Find the pieces of the side to move that are pinned to
+        their king.  Returns a dict mapping the square of each pinned
+        piece to the direction from the king to the piece. """
+        board = self.board
+        ksq = self.king_pos[self.wtm]
+        color = WHITE_PC if self.wtm else 0
+        ret = {}
+        for pc_type in [BISHOP, ROOK]:
+            for ray in piece_rays[pc_type][ksq]:
+                own_sq = None
+                for sq in ray:
+                    pc = board[sq]
+                    if pc == EMPTY:
+                        continue
+                    if pc & WHITE_PC == color:
+                        if own_sq is not None:
+                            break
+                        own_sq = sq
+                    else:
+                        if own_sq is not None and pc & TYPE_MASK in [
+                                pc_type, QUEEN]:
+                            ret[own_sq] = dir(ksq, own_sq)
+                        break
+        return ret
+
+    def _get_pseudo_legal_codes(self):
         ret = []
-        is_sliding = pc in sliding_pieces
-        for d in piece_moves[pc.lower()]:
-            cur_sq = sq
-            while 1:
-                cur_sq += d
-                if not valid_sq(cur_sq):
-                    break
-                if self.board[cur_sq] == pc:
-                    if Move(self, cur_sq, sq).is_legal():
-                        ret.append(cur_sq)
-                if not (self.board[cur_sq] == '-' and is_sliding):
-                    break
+        for sq in self.pieces[self.wtm]:
+            self._add_piece_codes(sq, ret)
+
+        # check_legal() tests everything else about castling
+        if not self.in_check:
+            ksq = self.king_pos[self.wtm]
+            if self.check_castle_flags(self.wtm, True):
+                ret.append(ksq | (ksq + 2) << MV_TO_SHIFT | MV_OO)
+            if self.check_castle_flags(self.wtm, False):
+                ret.append(ksq | (ksq - 2) << MV_TO_SHIFT | MV_OOO)
         return ret
 
+    def _add_piece_codes(self, sq, ret):
+        """Add the codes of the pseudo-legal moves of the piece on sq,
+        other than castling."""
+        board = self.board
+        pc = board[sq]
+        pc_type = pc & TYPE_MASK
+        if pc_type == PAWN:
+            self._add_pawn_codes(sq, ret)
+            return
+        color = pc & WHITE_PC
+        if is_slider[pc_type]:
+            for ray in piece_rays[pc_type][sq]:
+                for to in ray:
+                    topc = board[to]
+                    if topc == EMPTY:
+                        ret.append(sq | to << MV_TO_SHIFT)
+                    else:
+                        if topc & WHITE_PC != color:
+                            ret.append(sq | to << MV_TO_SHIFT)
+                        break
+        else:
+            for to in piece_steps[pc_type][sq]:
+                topc = board[to]
+                if topc == EMPTY or topc & WHITE_PC != color:
+                    ret.append(sq | to << MV_TO_SHIFT)
+
+    def _add_pawn_codes(self, sq, ret):
+        if self.wtm:
+            (d, start_rank, prom_rank) = (0x10, 1, 7)
+        else:
+            (d, start_rank, prom_rank) = (-0x10, 6, 0)
+        tos = []
+        if self.board[sq + d] == EMPTY:
+            tos.append(sq + d)
+            if rank(sq) == start_rank and self.board[sq + 2 * d] == EMPTY:
+                ret.append(sq | (sq + 2 * d) << MV_TO_SHIFT | MV_DOUBLE)
+        for to in [sq + d - 1, sq + d + 1]:
+            if to == self.ep:
+                ret.append(sq | to << MV_TO_SHIFT | MV_EP)
+            elif self._pawn_cap_at(to):
+                tos.append(to)
+        for to in tos:
+            if rank(to) == prom_rank:
+                for prom in [QUEEN, ROOK, BISHOP, KNIGHT]:
+                    ret.append(sq | to << MV_TO_SHIFT |
+                        prom << MV_PROM_SHIFT)
+            else:
+                ret.append(sq | to << MV_TO_SHIFT)
+
     def is_draw_fifty(self):
         # If we checkmate comes on the move that causes the fifty-move
         # counter to reach 100, the game is not a draw.  That shouldn't
@@ -1133,7 +1774,7 @@ class Position(object):
             num_empty = 0
             for f in range(0, 8):
                 sq = 0x10 * r + f
-                pc = self.board[sq]
+                pc = pc_chars[self.board[sq]]
                 if pc == '-':
                     num_empty += 1
                 else:
@@ -1250,7 +1891,7 @@ def init_direction_table():
     for r in range(8):
         for f in range(8):
             sq = 0x10 * r + f
-            for d in piece_moves['q']:
+            for d in piece_dirs[QUEEN]:
                 cur_sq = sq + d
                 while valid_sq(cur_sq):
                     assert(0 <= cur_sq - sq + 0x7f <= 0xff)
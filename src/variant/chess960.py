@@ -28,7 +28,8 @@ from array import array
 
 from db import db
 from game_constants import *
-from variant.base_variant import BaseVariant, IllegalMoveError
+from variant.base_variant import (BaseVariant, IllegalMoveError,
+    compact_code, split_compact, COMPACT_OO, COMPACT_OOO)
 
 """
 0x88 board representation; pieces are represented as ASCII,
@@ -117,6 +118,10 @@ class Zobrist(object):
 zobrist = Zobrist()
 
 class Move(object):
+    __slots__ = ['pos', 'fr', 'to', 'pc', 'prom', 'is_oo', 'is_ooo',
+        'capture', 'is_capture', 'is_ep', 'new_ep', 'time', '_san',
+        '_verbose_alg', 'lag', 'undo']
+
     def __init__(self, pos, fr, to, prom=None, is_oo=False,
             is_ooo=False, is_ep=False, new_ep=None):
         self.pos = pos
@@ -233,7 +238,8 @@ class Move(object):
             else:
                 rsq = 0x70 + pos.hside_rook_file
                 assert(pos.board[rsq] == 'r')
-            sqs = [self.fr, self.to, rsq]
+            # the rook ends up next to the king
+            sqs = [self.fr, self.to, rsq, self.to - 1]
             for sq in range(min(sqs), max(sqs) + 1):
                 if sq != rsq and sq != self.fr and pos.board[sq] != '-':
                     raise IllegalMoveError('castling blocked')
@@ -263,7 +269,7 @@ class Move(object):
             else:
                 rsq = 0x70 + pos.aside_rook_file
                 assert(pos.board[rsq] == 'r')
-            sqs = [self.fr, self.to, rsq]
+            sqs = [self.fr, self.to, rsq, self.to + 1]
             for sq in range(min(sqs), max(sqs) + 1):
                 if sq != rsq and sq != self.fr and pos.board[sq] != '-':
                     raise IllegalMoveError('castling blocked')
@@ -360,9 +366,15 @@ class Move(object):
         else:
             return True
 
+    def to_compact(self):
+        """ The move packed by compact_code(). """
+        return compact_code(self.fr, self.to, self.prom, self.is_oo,
+            self.is_ooo)
+
 class Undo(object):
     """information needed to undo a move"""
-    pass
+    __slots__ = ['ep', 'in_check', 'castle_flags', 'fifty_count',
+        'material', 'hash']
 
 class PositionHistory(object):
     """keeps past of past positions for repetition detection"""
@@ -386,6 +398,15 @@ class PositionHistory(object):
     def get_move(self, ply):
         return self.moves[ply]
 
+    def __deepcopy__(self, memo):
+        # Moves are not changed once they have been made, so a copy of
+        # a position, such as a snapshot in examine mode, shares them.
+        # Copying every move and its undo information is slow.
+        ret = PositionHistory()
+        ret.hashes = self.hashes[:]
+        ret.moves = self.moves[:]
+        return ret
+
 class Position(object):
     def __init__(self, fen):
         self.board = array('c', 0x80 * ['-'])
@@ -501,7 +522,7 @@ class Position(object):
                     elif c == 'q':
                         if b_ooo:
                             raise BadFenError()
-                        for sq in range(A8, self.king_pos[1]):
+                        for sq in range(A8, self.king_pos[0]):
                             if self.board[sq] == 'r':
                                 self._set_aside_rook_file(file(sq))
                                 break
@@ -606,6 +627,10 @@ class Position(object):
                 sq = 0x10 * r + f
                 yield (sq, self.board[sq])
 
+    def piece_at(self, sq):
+        """ The FEN character for the piece on a square, or '-'. """
+        return self.board[sq]
+
     def make_move(self, mv):
         """make the move"""
         self._check_material()
@@ -765,7 +790,8 @@ class Position(object):
         self.in_check = mv.undo.in_check
         self.castle_flags = mv.undo.castle_flags
         self.fifty_count = mv.undo.fifty_count
-        self.material = mv.undo.material
+        # a copy, since a snapshot may share the move
+        self.material = mv.undo.material[:]
         self.hash = mv.undo.hash
 
         if mv.pc == 'k':
@@ -780,28 +806,20 @@ class Position(object):
             else:
                 assert(self.board[mv.to + 0x10] == '-')
                 self.board[mv.to + 0x10] = 'P'
-        elif mv.is_oo:
-            if self.wtm:
-                assert(self.board[F1] == 'R')
-                self.board[self.hside_rook_file] = 'R'
-                if mv.fr != F1:
-                    self.board[F1] = '-'
-            else:
-                assert(self.board[F8] == 'r')
-                self.board[0x70 + self.hside_rook_file] = 'r'
-                if mv.fr != F8:
-                    self.board[F8] = '-'
-        elif mv.is_ooo:
-            if self.wtm:
-                assert(self.board[D1] == 'R')
-                self.board[self.aside_rook_file] = 'R'
-                if mv.fr != D1:
-                    self.board[D1] = '-'
+        elif mv.is_oo or mv.is_ooo:
+            if mv.is_oo:
+                (rsq, rook_to) = (self.hside_rook_file, F1)
             else:
-                assert(self.board[D8] == 'r')
-                self.board[0x70 + self.aside_rook_file] = 'r'
-                if mv.fr != D8:
-                    self.board[D8] = '-'
+                (rsq, rook_to) = (self.aside_rook_file, D1)
+            if not self.wtm:
+                rsq += 0x70
+                rook_to += 0x70
+            # the king and rook can end up on each other's starting
+            # squares, so clear both before putting them back
+            self.board[mv.to] = '-'
+            self.board[rook_to] = '-'
+            self.board[rsq] = 'R' if self.wtm else 'r'
+            self.board[mv.fr] = mv.pc
         self._check_material()
         assert(self.hash == self._compute_hash())
 
@@ -1167,6 +1185,30 @@ class Position(object):
 
         return mv
 
+    def move_from_compact(self, code):
+        """ Make a Move from a code packed by compact_code().  The code
+        comes from a stored game, so the move is not checked for
+        legality. """
+        (kind, fr, to, pc) = split_compact(code)
+        if kind == COMPACT_OO:
+            if self.wtm:
+                return Move(self, self.king_pos[1], G1, is_oo=True)
+            return Move(self, self.king_pos[0], G8, is_oo=True)
+        if kind == COMPACT_OOO:
+            if self.wtm:
+                return Move(self, self.king_pos[1], C1, is_ooo=True)
+            return Move(self, self.king_pos[0], C8, is_ooo=True)
+        if pc and self.wtm:
+            pc = pc.upper()
+        is_ep = False
+        new_ep = None
+        if self.board[fr] in ['p', 'P']:
+            if to == self.ep:
+                is_ep = True
+            elif abs(to - fr) == 0x20:
+                new_ep = (fr + to) >> 1
+        return Move(self, fr, to, prom=pc, is_ep=is_ep, new_ep=new_ep)
+
     def get_from_sqs(self, pc, sq):
         '''given a piece (not including a pawn) and a destination square,
         return a list of all legal source squares'''
@@ -1185,6 +1227,62 @@ class Position(object):
                     break
         return ret
 
+    def get_legal_moves(self):
+        """ Get a list of every legal move in the position.  Each
+        candidate is tested by making and undoing it, so in_check
+        must be up to date, as it is after detect_check(). """
+        return [mv for mv in self._get_pseudo_legal_moves()
+            if mv.is_legal()]
+
+    def _get_pseudo_legal_moves(self):
+        ret = []
+        for (sq, pc) in self:
+            if pc == '-' or piece_is_white(pc) != self.wtm:
+                continue
+            if pc in ['P', 'p']:
+                self._add_pawn_moves(sq, pc, ret)
+                continue
+            for d in piece_moves[pc.lower()]:
+                cur_sq = sq + d
+                while valid_sq(cur_sq):
+                    topc = self.board[cur_sq]
+                    if topc == '-' or piece_is_white(topc) != self.wtm:
+                        ret.append(Move(self, sq, cur_sq))
+                    if topc != '-' or pc not in sliding_pieces:
+                        break
+                    cur_sq += d
+
+        # check_legal() tests everything else about castling
+        ksq = self.king_pos[self.wtm]
+        (oo_sq, ooo_sq) = (G1, C1) if self.wtm else (G8, C8)
+        if self.check_castle_flags(self.wtm, True):
+            ret.append(Move(self, ksq, oo_sq, is_oo=True))
+        if self.check_castle_flags(self.wtm, False):
+            ret.append(Move(self, ksq, ooo_sq, is_ooo=True))
+        return ret
+
+    def _add_pawn_moves(self, sq, pc, ret):
+        if pc == 'P':
+            (d, start_rank, proms) = (0x10, 1, 'QRBN')
+        else:
+            (d, start_rank, proms) = (-0x10, 6, 'qrbn')
+        tos = []
+        if self.board[sq + d] == '-':
+            tos.append(sq + d)
+            if rank(sq) == start_rank and self.board[sq + 2 * d] == '-':
+                ret.append(Move(self, sq, sq + 2 * d, new_ep=sq + d))
+        for to in [sq + d - 1, sq + d + 1]:
+            if to == self.ep:
+                ret.append(Move(self, sq, to, is_ep=True))
+            elif self._pawn_cap_at(to):
+                tos.append(to)
+        for to in tos:
+            if rank(to) in [0, 7]:
+                for prom in proms:
+                    ret.append(Move(self, sq, to, prom=prom))
+            else:
+                ret.append(Move(self, sq, to))
+
     def is_draw_fifty(self):
         # If we checkmate comes on the move that causes the fifty-move
         # counter to reach 100, the game is not a draw.  That shouldn't
@@ -1272,13 +1370,13 @@ class Position(object):
         stm_str = 'w' if self.wtm else 'b'
 
         castling = ''
-        if check_castle_flags(True, True):
+        if self.check_castle_flags(True, True):
             castling += 'K'
-        if check_castle_flags(True, False):
+        if self.check_castle_flags(True, False):
             castling += 'Q'
-        if check_castle_flags(False, True):
+        if self.check_castle_flags(False, True):
             castling += 'k'
-        if check_castle_flags(False, False):
+        if self.check_castle_flags(False, False):
             castling += 'q'
         if castling == '':
             castling = '-'
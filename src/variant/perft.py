@@ -0,0 +1,126 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Perft: count the leaf nodes of the tree of legal moves to a given
+depth, and compare with the published counts.  This checks the move
+generators and make/undo of every variant, and gives a baseline for
+their speed. """
+
+import variant.chess
+import variant.chess960
+import variant.crazyhouse
+import variant.bughouse
+
+# (variant name, FEN, holding, [perft(1), perft(2), ...])
+#
+# The chess positions are the standard perft suite from the
+# chessprogramming wiki.  The chess960 positions are from Reinhard
+# Scharnagl's list of 960 positions, with the castling rights written
+# as KQkq, which is all our FEN parser accepts.  The holding positions
+# are from the Fairy-Stockfish test suite.
+suite = [
+    ('chess', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        '', [20, 400, 8902, 197281, 4865609]),
+    ('chess',
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        '', [48, 2039, 97862, 4085603]),
+    ('chess', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        '', [14, 191, 2812, 43238, 674624]),
+    ('chess',
+        'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        '', [6, 264, 9467, 422333]),
+    ('chess', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+        '', [44, 1486, 62379, 2103487]),
+    ('chess', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/'
+        'R4RK1 w - - 0 10', '', [46, 2079, 89890, 3894594]),
+    ('chess960', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        '', [20, 400, 8902, 197281]),
+    ('chess960', 'bqnb1rkr/pp3ppp/3ppn2/2p5/5P2/P2P4/NPP1P1PP/BQ1BNRKR '
+        'w KQkq - 2 9', '', [21, 528, 12189, 326672]),
+    ('chess960', '2nnrbkr/p1qppppp/8/1ppb4/6PP/3PP3/PPP2P2/BQNNRBKR '
+        'w KQkq - 1 9', '', [21, 807, 18002, 667366]),
+    ('chess960', 'b1q1rrkb/pppppppp/3nn3/8/P7/1PPP4/4PPPP/BQNNRKRB '
+        'w KQ - 1 9', '', [20, 479, 10471, 273318]),
+    ('chess960', 'qbbnnrkr/2pp2pp/p7/1p2pp2/8/P3PP2/1PPP1KPP/QBBNNR1R '
+        'w kq - 0 9', '', [22, 593, 13440, 382958]),
+    ('chess960', '1nbbnrkr/p1p1ppp1/3p4/1p3P1p/3Pq2P/8/PPP1P1P1/QNBBNRKR '
+        'w KQkq - 0 9', '', [28, 1120, 31058, 1171749]),
+    ('crazyhouse', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        '', [20, 400, 8902, 197281, 4888832]),
+    ('crazyhouse', '2k5/8/8/8/8/8/8/4K3 w - - 0 1',
+        'QRBNPqrbnp', [301, 75353]),
+    ('crazyhouse', '2k5/8/8/8/8/8/8/4K3 w - - 0 1',
+        'Qn', [67, 3083, 88634]),
+    # on one board of a bughouse game, captured pieces go to the
+    # partner, so the counts only match crazyhouse until captured
+    # pieces could be dropped
+    ('bughouse', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        '', [20, 400, 8902, 197281]),
+    ('bughouse', '2k5/8/8/8/8/8/8/4K3 w - - 0 1',
+        'QRBNPqrbnp', [301, 75353]),
+]
+
+def make_pos(variant_name, fen, holding=''):
+    """ Make a Position for the given variant; holding is a string of
+    pieces, like 'Qn', for crazyhouse and bughouse. """
+    if variant_name == 'chess':
+        return variant.chess.Position(fen)
+    elif variant_name == 'chess960':
+        return variant.chess960.Position(fen)
+    elif variant_name == 'crazyhouse':
+        pos = variant.crazyhouse.Position(fen)
+    elif variant_name == 'bughouse':
+        pos = variant.bughouse.Position(fen)
+        # somewhere for captured pieces to go
+        pos.bug_link = variant.bughouse.Position(fen)
+        pos.bug_link.bug_link = pos
+    else:
+        raise RuntimeError('unknown variant %s' % variant_name)
+    for pc in holding:
+        pos.add_holding(pc)
+    pos.detect_check()
+    return pos
+
+def perft(pos, depth):
+    """ Count the positions reached after exactly depth plies. """
+    if depth == 0:
+        return 1
+    moves = pos.get_legal_moves()
+    if depth == 1:
+        return len(moves)
+    count = 0
+    for mv in moves:
+        pos.make_move(mv)
+        # detect_check() does more work than we need
+        pos.in_check = pos.under_attack(pos.king_pos[pos.wtm], not pos.wtm)
+        count += perft(pos, depth - 1)
+        pos.undo_move(mv)
+    return count
+
+def divide(pos, depth):
+    """ Return a list of (move, perft) for each legal move, which is
+    useful for finding the move where a count goes wrong. """
+    ret = []
+    for mv in pos.get_legal_moves():
+        pos.make_move(mv)
+        pos.in_check = pos.under_attack(pos.king_pos[pos.wtm], not pos.wtm)
+        ret.append((str(mv), perft(pos, depth - 1)))
+        pos.undo_move(mv)
+    return ret
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
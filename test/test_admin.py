@@ -753,6 +753,25 @@ class TestLight(Test):
         self.expect("Admin mode (*) is now shown.", t)
         self.close(t)
 
+class AexportpgnTest(Test):
+    def test_aexportpgn(self):
+        t = self.connect_as_admin()
+        t.write('aexportpgn\n')
+        self.expect('Exporting games to export/games-', t)
+        self.expect_re(r'PGN export finished: \d+ games written', t,
+            timeout=10)
+        self.close(t)
+
+    def test_aexportpgn_user(self):
+        t = self.connect_as_admin()
+        t.write('aexportpgn admin\n')
+        self.expect('Exporting games to export/admin-', t)
+        self.expect('PGN export finished', t, timeout=10)
+
+        t.write('aexportpgn nosuchplayer\n')
+        self.expect('no player matching', t)
+        self.close(t)
+
 class AreloadTest(Test):
     def test_areload(self):
         self._skip('not stable')
@@ -201,9 +201,8 @@ class TestFlag(Test):
 
     @with_player('TestPlayer')
     def test_autoflag_nomove(self):
-        """ Test when a player forfeits on time without making a move. The
-        server make take a few seconds to award the forfeit, since it
-        checks at the heartbeat timer. """
+        """ Test when a player forfeits on time without making a move.
+        The server checks the flag when the player's time runs out. """
         t = self.connect_as_admin()
         t2 = self.connect_as('testplayer')
 
@@ -246,6 +245,43 @@ class TestFlag(Test):
         self.close(t)
         self.close(t2)
 
+    @with_player('TestPlayer')
+    def test_autoflag_on_time(self):
+        """ Test that the flag falls when the player's time runs out,
+        not some seconds later. """
+        t = self.connect_as_admin()
+        t2 = self.connect_as('testplayer')
+
+        t.write('set style 12\n')
+        t2.write('set style 12\n')
+
+        t.write('set autoflag 1\n')
+        self.expect('Auto-flagging enabled.', t)
+
+        t.write('match testplayer white 0+1 u\n')
+        self.expect('Challenge:', t2)
+        t2.write('accept\n')
+        self.expect('<12> ', t2)
+
+        t.write('e4\n')
+        self.expect('P/e2-e4', t2)
+        t2.write('e5\n')
+        self.expect('P/e7-e5', t)
+        t.write('f4\n')
+        self.expect('P/f2-f4', t2)
+        start = time.time()
+
+        # black has about 10 seconds left
+        self.expect('TestPlayer forfeits on time} 1-0', t2, timeout=15)
+        secs = time.time() - start
+        self.assert_(8.0 < secs < 11.0)
+
+        t.write('aclearhist admin\n')
+        self.expect('History of admin cleared.', t)
+
+        self.close(t)
+        self.close(t2)
+
     @with_player('TestPlayer')
     def test_autoflag_move(self):
         """ Test when a player forfeits on time after moving barely
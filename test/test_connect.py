@@ -97,6 +97,15 @@ class LoginTest(Test):
         self.expect(' Starting FICS session as admin(*)', t)
         self.close(t)
 
+    def test_login_typeahead(self):
+        """ Lines sent before the user is looked up in the database
+        should be handled in order once the lookup is done. """
+        t = self.connect()
+        t.write('admin\n%s\nfinger\n' % admin_passwd)
+        self.expect(' Starting FICS session as admin(*)', t)
+        self.expect('Finger of admin', t)
+        self.close(t)
+
     def test_double_login(self):
         t = self.connect_as_admin()
         t2 = self.connect()
@@ -282,6 +282,95 @@ class TestBackward(Test):
         t.write('unex\n')
         self.close(t)
 
+class TestGoto(Test):
+    def test_goto(self):
+        t = self.connect_as_guest('GuestPQLQ')
+        t.write('set style 12\n')
+
+        t.write('goto 1\n')
+        self.expect('You are not examining a game', t)
+
+        t.write('ex\ne4\ne5\nf4\n')
+        self.expect('GuestPQLQ moves: f4', t)
+
+        t.write('goto 4\n')
+        self.expect('There is no position after 4 moves; the game has 3 moves.', t)
+
+        t.write('goto 1\n')
+        self.expect('GuestPQLQ goes to move 1.', t)
+        self.expect('<12> rnbqkbnr pppppppp -------- -------- ----P--- -------- PPPP-PPP RNBQKBNR B -1 1 1 1 1 0 1 GuestPQLQ GuestPQLQ 2 0 0 39 39 0 0 1 P/e2-e4 (0:00) e4 0 0 0', t)
+
+        t.write('goto 3\n')
+        self.expect('GuestPQLQ goes to move 3.', t)
+        self.expect('<12> rnbqkbnr pppp-ppp -------- ----p--- ----PP-- -------- PPPP--PP RNBQKBNR B -1 1 1 1 1 0 1 GuestPQLQ GuestPQLQ 2 0 0 39 39 0 0 2 P/f2-f4 (0:00) f4 0 0 0', t)
+
+        # a new move replaces the rest of the game
+        t.write('goto 1\n')
+        self.expect('GuestPQLQ goes to move 1.', t)
+        t.write('d5\n')
+        self.expect('GuestPQLQ moves: d5', t)
+        t.write('forward\n')
+        self.expect("You're at the end of the game.", t)
+        t.write('goto 0\n')
+        self.expect('<12> rnbqkbnr pppppppp -------- -------- -------- -------- PPPPPPPP RNBQKBNR W -1 1 1 1 1 0 1 GuestPQLQ GuestPQLQ 2 0 0 39 39 0 0 1 none (0:00) none 0 0 0', t)
+        t.write('forward 2\n')
+        self.expect('<12> rnbqkbnr ppp-pppp -------- ---p---- ----P--- -------- PPPP-PPP RNBQKBNR W -1 1 1 1 1 0 1 GuestPQLQ GuestPQLQ 2 0 0 39 39 0 0 2 P/d7-d5 (0:00) d5 0 0 0', t)
+
+        t.write('unex\n')
+        self.close(t)
+
+    @with_player('testplayer')
+    def test_goto_crazyhouse(self):
+        """ Jump back and forth across a snapshot in a crazyhouse game
+        with captures, which change the material. """
+        t = self.connect_as_admin()
+        t2 = self.connect_as('testplayer')
+
+        t.write('set style 12\n')
+        t.write('aclearhist admin\n')
+        self.expect('History of admin cleared.', t)
+
+        t.write('match testplayer 2 12 white zh u\n')
+        self.expect('Challenge:', t2)
+        t2.write('a\n')
+        self.expect('<12> ', t)
+        self.expect('<12> ', t2)
+
+        moves = ['e4', 'Nc6', 'd4', 'e6', 'Nf3', 'd5', 'Nc3', 'Bb4', 'exd5',
+            'Qxd5', 'Bd2', 'Bxc3', 'Bxc3', 'P@b4', 'P@c4', 'Qd6', 'd5',
+            'exd5', 'cxd5', 'bxc3', 'dxc6', 'P@d2+', 'Nxd2', 'cxd2+']
+        wtm = True
+        for mv in moves:
+            if wtm:
+                t.write('%s\n' % mv)
+            else:
+                t2.write('%s\n' % mv)
+            self.expect('<12> ', t)
+            self.expect('<12> ', t2)
+            wtm = not wtm
+        t.write('resign\n')
+        self.expect('admin resigns} 0-1', t)
+        self.expect('admin resigns} 0-1', t2)
+        self.close(t2)
+
+        t.write('ex admin -1\n')
+        self.expect('<12> ', t)
+        for ply in [24, 9, 14, 7, 9]:
+            t.write('goto %d\n' % ply)
+            self.expect('goes to move %d.' % ply, t)
+        t.write('goto 19\n')
+        self.expect('<12> r-b-k-nr ppp--ppp --nq---- ---P---- -p------ --B--N-- PPP--PPP R--QKB-R B ', t)
+        t.write('goto 0\n')
+        self.expect('<12> rnbqkbnr pppppppp -------- -------- -------- -------- PPPPPPPP RNBQKBNR W ', t)
+        t.write('goto 24\n')
+        self.expect('<12> r-b-k-nr ppp--ppp --Pq---- -------- -------- -------- PPPp-PPP R--QKB-R W ', t)
+        t.write('unex\n')
+        self.expect('You are no longer examining game 1.', t)
+
+        t.write('aclearhist admin\n')
+        self.expect('History of admin cleared.', t)
+        self.close(t)
+
 class TestUnexamine(Test):
     def test_unexamine(self):
         t = self.connect_as_guest()
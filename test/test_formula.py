@@ -124,6 +124,28 @@ class TestFormula(Test):
         self.close(t)
         self.close(t2)
 
+    def test_formula_change(self):
+        """ A changed formula takes effect right away. """
+        t = self.connect_as_guest('GuestABCD')
+        t2 = self.connect_as_guest()
+
+        t.write('set f1 lightning\n')
+        self.expect('f1 set to "lightning".', t)
+        t.write('set formula f1\n')
+        self.expect('formula set to "f1".', t)
+        t2.write('match guestabcd 3 0\n')
+        self.expect('Ignoring (formula)', t)
+        self.expect('Match request does not meet formula', t2)
+
+        t.write('set f1 blitz\n')
+        self.expect('f1 set to "blitz".', t)
+        t2.write('match guestabcd 3 0\n')
+        self.expect('Issuing: ', t2)
+        self.expect('Challenge:', t)
+
+        self.close(t)
+        self.close(t2)
+
     '''def test_formula_1(self):
         t = self.connect_as_guest('GuestABCD')
         t.write('set formula inc=0 && time=3 && !private && rating>1500 && 1850>rating\n')
@@ -119,6 +119,37 @@ class TestGame(Test):
         self.close(t)
         self.close(t2)
 
+    def test_illegal_san(self):
+        t = self.connect_as_guest('GuestABCD')
+        t2 = self.connect_as_admin()
+        t.write('set style 12\n')
+        t2.write('set style 12\n')
+
+        t.write('match admin white 1 0\n')
+        self.expect('Issuing:', t)
+        self.expect('Challenge:', t2)
+        t2.write('accept\n')
+        self.expect('<12> ', t)
+        self.expect('<12> ', t2)
+
+        # capturing one's own piece
+        t.write('Kxf2\n')
+        self.expect('Illegal move (Kxf2).', t)
+
+        for (conn, mv) in [(t, 'e4'), (t2, 'e5'), (t, 'Qh5')]:
+            conn.write('%s\n' % mv)
+            self.expect('<12> ', t)
+            self.expect('<12> ', t2)
+
+        # the f-pawn is pinned
+        t2.write('f6\n')
+        self.expect('Illegal move (f6).', t2)
+
+        t.write('abort\n')
+        t2.write('abort\n')
+        self.close(t)
+        self.close(t2)
+
     def test_lalg(self):
         moves = ['g2g3', 'b7b6', 'f1g2', 'b8c6', 'g1f3', 'c8b7', 'e1g1',
             'e7e6', 'd2d4', 'd8e7', 'c1f4', 'e8c8']
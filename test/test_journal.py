@@ -0,0 +1,179 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import datetime
+
+from twisted.internet import defer
+
+from test import *
+
+import journal
+
+class FakeDB(object):
+    """ Stands in for the game, history and rating tables, with the
+    same duplicate key behavior as the real queries. """
+    def __init__(self):
+        self.games = []
+        self.idns = {}
+        self.history = {}
+        self.ratings = {}
+        self.fail_history = 0
+
+    def game_find(self, g):
+        for (i, row) in enumerate(self.games):
+            if all(row[k] == g[k] for k in ['white_name', 'black_name',
+                    'when_started', 'when_ended']):
+                return i + 1
+        return None
+
+    def game_add_many(self, games):
+        first_id = len(self.games) + 1
+        self.games.extend(games)
+        return first_id
+
+    def game_add_idn_many(self, rows):
+        for (game_id, idn) in rows:
+            self.idns[game_id] = idn
+
+    def user_add_history_many(self, entries):
+        if self.fail_history:
+            self.fail_history -= 1
+            raise RuntimeError('lost connection')
+        for e in entries:
+            self.history[(e['user_id'], e['num'])] = e
+
+    def user_set_rating_many(self, rows):
+        for r in rows:
+            self.ratings[(r['user_id'], r['speed_id'],
+                r['variant_id'])] = r
+
+class FakeAsyncDB(object):
+    def __init__(self, db_):
+        self.db = db_
+
+    def run_interaction(self, f, *args, **kwargs):
+        return defer.maybeDeferred(f, self.db, *args, **kwargs)
+
+class TestJournal(Test):
+    def setUp(self):
+        self.db = FakeDB()
+        self.patch(journal, 'adb', FakeAsyncDB(self.db))
+        self.path = self.mktemp()
+
+    def _make_journal(self):
+        j = journal.Journal(self.path)
+        # the test flushes by hand
+        self._cancel_flush(j)
+        return j
+
+    def _cancel_flush(self, j):
+        if j.flush_call and j.flush_call.active():
+            j.flush_call.cancel()
+        j.flush_call = None
+
+    def _crash(self, j):
+        """ Forget everything a server that died had in memory. """
+        self._cancel_flush(j)
+        j.pending = []
+        j.f.close()
+
+    def _add_game(self, j):
+        when = datetime.datetime(2010, 6, 1, 12, 30, 15)
+        (seq, d) = j.add_game({'white_name': 'GuestABCD',
+            'white_rating': 1500, 'black_name': 'GuestEFGH',
+            'black_rating': 1600, 'eco': 'A00', 'variant_id': 0,
+            'speed_id': 2, 'time': 3, 'inc': 0, 'rated': 1,
+            'result': '1-0', 'result_reason': 'Res', 'ply_count': 2,
+            'movetext': 'e4 e5', 'compact_moves': '\x00\x01\xff\x00',
+            'when_started': when,
+            'when_ended': when + datetime.timedelta(minutes=5)}, None)
+        for (user_id, num, color_char) in [(1, 0, 'W'), (2, 7, 'B')]:
+            j.add_history(user_id, {'num': num, 'result_char': '+',
+                'user_rating': 1500, 'color_char': color_char,
+                'opp_name': 'GuestEFGH', 'opp_rating': 1600,
+                'eco': 'A00', 'flags': 'brn', 'time': 3, 'inc': 0,
+                'result_reason': 'Res', 'when_ended': when}, seq)
+        j.add_rating(1, 2, 0, 1510.0, 80.0, 0.06, 1, 0, 0, when)
+        self._cancel_flush(j)
+        return d
+
+    def _check_stored_once(self):
+        self.assertEqual(len(self.db.games), 1)
+        self.assertEqual(self.db.games[0]['compact_moves'],
+            '\x00\x01\xff\x00')
+        self.assertEqual(len(self.db.history), 2)
+        for e in self.db.history.values():
+            self.assertEqual(e['game_id'], 1)
+        self.assertEqual(len(self.db.ratings), 1)
+
+    def test_flush(self):
+        j = self._make_journal()
+        d = self._add_game(j)
+        game_ids = []
+        d.addCallback(game_ids.append)
+        j.flush()
+        self.assertEqual(game_ids, [1])
+        self._check_stored_once()
+
+    def test_retry_after_failed_flush(self):
+        j = self._make_journal()
+        d = self._add_game(j)
+        game_ids = []
+        d.addCallback(game_ids.append)
+
+        # the game is written, but the history is not
+        self.db.fail_history = 1
+        j.flush()
+        self.assertEqual(len(self.db.games), 1)
+        self.assertEqual(len(self.db.history), 0)
+        self.assertEqual(game_ids, [])
+
+        j.flush()
+        self.assertEqual(game_ids, [1])
+        self._check_stored_once()
+        self._cancel_flush(j)
+
+    def test_replay(self):
+        j = self._make_journal()
+        self._add_game(j)
+        self._crash(j)
+
+        # the server starts again, and nothing was written
+        j = self._make_journal()
+        self.assertEqual(len(j.pending), 4)
+        j.flush()
+        self._check_stored_once()
+
+        # a third start has nothing left to do
+        j = self._make_journal()
+        self.assertEqual(j.pending, [])
+
+    def test_replay_after_partial_write(self):
+        j = self._make_journal()
+        self._add_game(j)
+        self.db.fail_history = 1
+        j.flush()
+        self._crash(j)
+
+        # the server died before retrying
+        self.assertEqual(len(self.db.games), 1)
+        j = self._make_journal()
+        j.flush()
+        self._check_stored_once()
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -39,4 +39,32 @@ class TestPassword(Test):
         t.write("password test %s\r\n" % admin_passwd)
         self.close(t)
 
+    def test_password_then_command(self):
+        """ Lines sent while a password is being checked are handled
+        after it, in order. """
+        t = self.connect_as_admin()
+        t.write('password wrongpass test\r\nuptime\r\n')
+        self.expect("Incorrect", t)
+        self.expect("Up for:", t)
+        self.close(t)
+
+    def test_password_one_prompt(self):
+        """ Output to others while the new password is being hashed
+        doesn't send a prompt before the result. """
+        t = self.connect_as_admin()
+        t2 = self.connect_as_guest()
+        t.read_until('fics% ', 2)
+
+        t.write('password %s test\r\n' % admin_passwd)
+        t2.write('date\r\n')
+        s = t.read_until('changed', 5)
+        self.assert_('changed' in s)
+        self.assert_('fics%' not in s)
+        self.expect('fics% ', t)
+
+        t.write("password test %s\r\n" % admin_passwd)
+        self.expect("changed", t)
+        self.close(t)
+        self.close(t2)
+
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
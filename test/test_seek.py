@@ -550,4 +550,29 @@ class TestSeekinfo(Test):
         self.close(t2)
         self.close(t3)
 
+    def test_seekinfo_examining(self):
+        """ Seeks are not announced to users examining a game. """
+        t = self.connect_as_guest()
+        t2 = self.connect_as_guest('GuestABCD')
+
+        t.write('iset seekinfo 1\n')
+        self.expect('seekinfo set.', t)
+        t.write('ex\n')
+        self.expect('Starting a game', t)
+
+        t2.write('seek 3+1\n')
+        m = self.expect_re(r'Your seek has been posted with index (\d+).', t2)
+        n1 = int(m.group(1))
+        self.expect_not('<s> %d' % n1, t)
+
+        t.write('unex\n')
+        self.expect('You are no longer examining game', t)
+        t2.write('seek 5+0\n')
+        m = self.expect_re(r'Your seek has been posted with index (\d+).', t2)
+        n2 = int(m.group(1))
+        self.expect('<s> %d w=GuestABCD' % n2, t)
+
+        self.close(t)
+        self.close(t2)
+
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -55,6 +55,20 @@ class TestTimeseal(Test):
         process.expect_exact(pexpect.EOF)
         process.close()
 
+class TestTimesealMalformed(Test):
+    def test_malformed_timestamp(self):
+        t = self.connect()
+        t.read_until('login:', 2)
+        # 'TIMESTAMP|' encrypted with a timestamp of 'abc'
+        t.write('\x95\x80q\x80\x9e\x80\x80\x9e\x80\xcd\x90r\xa9\x80\xb3\x89\x80\xd6\x91\x8e\x90\x99\x8d\xa2\x80\n')
+        self.expect('login:', t)
+
+        t.write('guest\n')
+        self.expect('Press return to enter', t)
+        t.write('\n')
+        self.expect(' Starting FICS session as ', t)
+        self.close(t)
+
 class TestTimesealWindows(Test):
     def test_timeseal_windows(self):
         if not os.path.exists(wine_prog):
@@ -27,4 +27,18 @@ class TestDate(Test):
         self.expect('Up for:', t)
         t.close()
 
+    def test_uptime_output_stats(self):
+        t = self.connect_as_admin()
+        t.write('uptime\n')
+        self.expect_re(r'Output: \d+ writes in \d+ sends', t)
+        self.close(t)
+
+    def test_uptime_login_stats(self):
+        t = self.connect_as_admin()
+        t.write('uptime\n')
+        # the admin has logged in at least once
+        self.expect_re(r'Login ms \(average/longest\): lookup [\d.]+/[\d.]+ \([1-9]\d*\), passwd [\d.]+/[\d.]+ \([1-9]\d*\), fetch [\d.]+/[\d.]+ \([1-9]\d*\), log_on', t)
+        self.expect_re(r'Logins in progress: \d+ \(\d+ queued\)', t)
+        self.close(t)
+
 # vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,64 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from test.test import *
+
+from variant import perft
+from variant.base_variant import encode_compact, decode_compact
+
+class TestCompact(Test):
+    def _check_moves(self, pos):
+        """ Every legal move should come back the same from its code. """
+        for mv in pos.get_legal_moves():
+            mv2 = pos.move_from_compact(mv.to_compact())
+            self.assertEqual(mv2.to_san(), mv.to_san())
+            self.assertEqual((mv2.is_ep, mv2.new_ep, mv2.is_oo, mv2.is_ooo),
+                (mv.is_ep, mv.new_ep, mv.is_oo, mv.is_ooo))
+
+    def test_encode(self):
+        codes = [0, 1, 0x7fff, 0xffff]
+        s = encode_compact(codes)
+        self.assertEqual(len(s), 8)
+        self.assertEqual(s[2:4], '\x01\x00')
+        self.assertEqual(decode_compact(s), codes)
+
+    def test_chess(self):
+        for fen in ['r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/'
+                'R3K2R w KQkq - 0 1',
+                'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 '
+                'w kq - 0 1',
+                'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR '
+                'w KQkq f6 0 3']:
+            self._check_moves(perft.make_pos('chess', fen))
+
+    def test_chess960(self):
+        self._check_moves(perft.make_pos('chess960',
+            'bqnb1rkr/pp3ppp/3ppn2/2p5/5P2/P2P4/NPP1P1PP/BQ1BNRKR '
+            'w KQkq - 2 9'))
+
+    def test_crazyhouse(self):
+        self._check_moves(perft.make_pos('crazyhouse',
+            'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+            'w KQkq - 0 1', 'PNq'))
+
+    def test_bughouse(self):
+        self._check_moves(perft.make_pos('bughouse',
+            'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+            'w KQkq - 0 1', 'PNq'))
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent
@@ -0,0 +1,59 @@
+# Copyright (C) 2010  Wil Mahan <wmahan+fatics@gmail.com>
+#
+# This file is part of FatICS.
+#
+# FatICS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FatICS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with FatICS.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+from test.test import *
+
+from variant import perft
+
+# keep the test quick; bench/bench_perft.py goes deeper
+MAX_NODES = 10000
+
+class TestPerft(Test):
+    def _check_variant(self, variant_name):
+        for (name, fen, holding, counts) in perft.suite:
+            if name != variant_name:
+                continue
+            pos = perft.make_pos(name, fen, holding)
+            for (i, count) in enumerate(counts):
+                if count > MAX_NODES:
+                    break
+                self.assertEqual(perft.perft(pos, i + 1), count)
+            # make and undo should leave the position as it was
+            self.assertEqual(pos.to_xfen(), fen)
+
+    def test_chess(self):
+        self._check_variant('chess')
+
+    def test_chess960(self):
+        self._check_variant('chess960')
+
+    def test_crazyhouse(self):
+        self._check_variant('crazyhouse')
+
+    def test_bughouse(self):
+        self._check_variant('bughouse')
+
+    def test_divide(self):
+        pos = perft.make_pos('chess', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/'
+            '1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+        div = dict(perft.divide(pos, 2))
+        self.assertEqual(len(div), 48)
+        self.assertEqual(sum(div.values()), 2039)
+
+# vim: expandtab tabstop=4 softtabstop=4 shiftwidth=4 smarttab autoindent